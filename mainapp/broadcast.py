@@ -0,0 +1,430 @@
+import asyncio
+import json
+import os
+import re
+import secrets
+import socket
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+from .fanout import LocalFanout
+from .metrics import Metrics
+from .utilities import TimeUtility
+
+
+class StockBroadcastService:
+    """
+    Service class for broadcasting stock data to WebSocket clients
+
+    The last broadcast snapshot is kept in the Django cache (shared by every Celery
+    worker and Daphne process) with a sequence number, and the sequence number at
+    which each ticker last changed (its version). Each broadcast only carries the
+    tickers and fields that changed since that snapshot, along with the previous
+    version of every changed ticker so consumers can detect missed deltas.
+
+    Sequence numbers only compare within one snapshot epoch: a random id drawn
+    whenever the snapshot is (re)created, e.g. after Redis lost the key and seq
+    restarted at 1. Events carry the epoch; consumers resync on a mismatch.
+
+    Changes are sent to the firehose group (clients without subscriptions) and to
+    the group of each changed ticker some client subscribed to (see group_for and
+    SubscriptionRegistry), so subscribed clients only receive the tickers they watch. Groups live in the channel layer, or in each
+    ASGI process when STOCK_FANOUT_MODE = "pubsub" (see LocalFanout).
+    """
+
+    GROUP_NAME = "stock_updates"
+    SNAPSHOT_KEY = "stock_snapshot"
+    PUBLISH_LOCK_KEY = "stock_snapshot:lock"
+    # Seconds before the publish lock of a crashed publisher expires
+    PUBLISH_LOCK_TIMEOUT = 10
+
+    # In-process mirror of the snapshot for consumers (see aget_snapshot)
+    _mirror = None
+    _mirror_expires = 0.0
+    _mirror_loading = None
+    latest_seq = 0
+    latest_epoch = None
+
+    @classmethod
+    def get_snapshot(cls):
+        """
+        Returns the last broadcast snapshot
+
+        Returns:
+            dict: {"seq": int, "stocks": {ticker: stock data dictionary},
+                   "versions": {ticker: seq of the ticker's last change},
+                   "epoch": snapshot epoch and "updated_at": UTC time of the
+                   last broadcast, if any}
+        """
+        snapshot = cache.get(cls.SNAPSHOT_KEY) or {"seq": 0, "stocks": {}}
+        snapshot.setdefault("versions", {})
+        return snapshot
+
+    @classmethod
+    async def aget_snapshot(cls):
+        """
+        Async counterpart of get_snapshot, served from an in-process mirror
+
+        The mirror is reused while it is at least as new as every delta this process
+        has seen (note_seq) and younger than STOCK_SNAPSHOT_MIRROR_TTL seconds, so a
+        burst of (re)connecting clients costs one cache read instead of one each.
+        Concurrent reloads are coalesced. The returned snapshot must not be modified.
+        """
+        mirror = cls._mirror
+        if (
+            mirror is not None
+            and mirror.get("epoch") == cls.latest_epoch
+            and mirror["seq"] >= cls.latest_seq
+            and time.monotonic() < cls._mirror_expires
+        ):
+            return mirror
+
+        loop = asyncio.get_running_loop()
+        loading = cls._mirror_loading
+        if loading is None or loading.done() or loading.get_loop() is not loop:
+            loading = cls._mirror_loading = loop.create_task(cls._load_mirror())
+        return await asyncio.shield(loading)
+
+    @classmethod
+    async def _load_mirror(cls):
+        snapshot = await cache.aget(cls.SNAPSHOT_KEY) or {"seq": 0, "stocks": {}}
+        snapshot.setdefault("versions", {})
+        cls._mirror = snapshot
+        cls._mirror_expires = time.monotonic() + getattr(settings, 'STOCK_SNAPSHOT_MIRROR_TTL', 1)
+        return snapshot
+
+    @classmethod
+    def note_seq(cls, seq, epoch=None):
+        """Record that this process has seen the delta seq of epoch (invalidates older mirrors)"""
+        if epoch != cls.latest_epoch:
+            # A new epoch restarts the sequence
+            cls.latest_epoch, cls.latest_seq = epoch, seq
+        elif seq > cls.latest_seq:
+            cls.latest_seq = seq
+
+    @staticmethod
+    def group_for(ticker):
+        """
+        Channel layer group carrying changes for a ticker
+
+        One group per ticker, or one per shard when STOCK_SUBSCRIPTION_SHARDS is set
+        (fewer group sends per tick; consumers drop tickers they did not subscribe to).
+        """
+        shards = getattr(settings, 'STOCK_SUBSCRIPTION_SHARDS', 0)
+        if shards:
+            return f"stock_shard_{zlib.crc32(ticker.encode('utf-8')) % shards}"
+        # Group names only allow ASCII alphanumerics, hyphens, underscores and periods
+        return "stock_" + re.sub(r"[^a-zA-Z0-9\-_.]", "_", ticker)[:90]
+
+    @staticmethod
+    def compute_delta(previous, current):
+        """
+        Compute the changes between two ticker -> stock data mappings
+
+        Args:
+            previous: Ticker -> stock data row (StockQuote or dict) of the last broadcast
+            current: Ticker -> stock data row (StockQuote or dict) of this broadcast
+
+        Returns:
+            dict: {"data": [...], "replace": [...], "removed": [...]} where data holds
+                  the ticker plus changed fields of each changed row (plain dicts), replace lists
+                  tickers whose row in data is complete and must replace the old row
+                  (new tickers, or rows that gained or lost fields), and removed
+                  lists tickers no longer broadcast
+        """
+        data, replace = [], []
+        for ticker, row in current.items():
+            old_row = previous.get(ticker)
+            if old_row is None or old_row.keys() != row.keys():
+                data.append(dict(row))
+                replace.append(ticker)
+                continue
+            changed = {key: value for key, value in row.items() if old_row[key] != value}
+            if changed:
+                data.append({"ticker": ticker, **changed})
+        removed = [ticker for ticker in previous if ticker not in current]
+        return {"data": data, "replace": replace, "removed": removed}
+
+    @staticmethod
+    def split_event(event, group_for):
+        """
+        Split a stock_delta event into one event per group
+
+        Args:
+            event: stock_delta channel layer event
+            group_for: Callable mapping a ticker to its group name
+
+        Returns:
+            dict: Group name -> stock_delta event holding only that group's tickers
+        """
+        events = {}
+
+        def event_for(ticker):
+            group = group_for(ticker)
+            if group not in events:
+                events[group] = {
+                    "type": event["type"], "seq": event["seq"], "epoch": event.get("epoch"),
+                    "data": [], "replace": [], "removed": [], "since": {},
+                }
+            events[group]["since"][ticker] = event["since"][ticker]
+            return events[group]
+
+        replace = set(event["replace"])
+        for row in event["data"]:
+            group_event = event_for(row["ticker"])
+            group_event["data"].append(row)
+            if row["ticker"] in replace:
+                group_event["replace"].append(row["ticker"])
+        for ticker in event["removed"]:
+            event_for(ticker)["removed"].append(ticker)
+        return events
+
+    @classmethod
+    @contextmanager
+    def publish_lock(cls):
+        """
+        Hold the cross-process publish lock (a cache.add key)
+
+        Reading the snapshot, allocating seq + 1, storing the new snapshot and sending
+        the event must not interleave between publishers (overlapping poll ticks,
+        fetch_stocks_data_task), or two events would carry the same seq and consumers
+        would drop the second one.
+        """
+        token = secrets.token_hex(8)
+        while not cache.add(cls.PUBLISH_LOCK_KEY, token, timeout=cls.PUBLISH_LOCK_TIMEOUT):
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            if cache.get(cls.PUBLISH_LOCK_KEY) == token:
+                cache.delete(cls.PUBLISH_LOCK_KEY)
+
+    @classmethod
+    def publish(cls, stocks_data):
+        """
+        Broadcast the changes since the last snapshot
+
+        Nothing is sent when no ticker changed.
+
+        Args:
+            stocks_data: List of stock data dictionaries
+
+        Returns:
+            dict: The firehose channel layer event that was sent, or None
+        """
+        with cls.publish_lock():
+            return cls.publish_locked(stocks_data)
+
+    @classmethod
+    def publish_locked(cls, stocks_data):
+        """publish, for callers already holding publish_lock"""
+        previous = cls.get_snapshot()
+        current = {stock_data["ticker"]: stock_data for stock_data in stocks_data}
+        delta = cls.compute_delta(previous["stocks"], current)
+        if not (delta["data"] or delta["removed"]):
+            return None
+
+        seq = previous["seq"] + 1
+        # A missing snapshot (first broadcast, or the cache lost it) starts a new epoch
+        epoch = previous.get("epoch") or secrets.token_hex(8)
+        changed = [row["ticker"] for row in delta["data"]]
+        since = {ticker: previous["versions"].get(ticker) for ticker in changed + delta["removed"]}
+        versions = {ticker: version for ticker, version in previous["versions"].items() if ticker in current}
+        versions.update({ticker: seq for ticker in changed})
+        snapshot = {
+            "seq": seq,
+            "stocks": current,
+            "versions": versions,
+            "epoch": epoch,
+            "updated_at": TimeUtility().get_current_datetime_endwith_z(),
+        }
+        cache.set(cls.SNAPSHOT_KEY, snapshot, timeout=None)
+
+        event = {"type": "stock_delta", "seq": seq, "epoch": epoch, **delta, "since": since}
+        if LocalFanout.enabled():
+            with Metrics.timer("stock_broadcast_publish_seconds", mode="pubsub"):
+                LocalFanout.publish(event)
+            return event
+        channel_layer = get_channel_layer()
+        if channel_layer:
+            # Ticker groups nobody subscribed to are empty; skip them
+            subscribed = {cls.group_for(ticker) for ticker in SubscriptionRegistry.tickers()}
+            with Metrics.timer("stock_broadcast_publish_seconds", mode="channel_layer"):
+                messages = {cls.GROUP_NAME: cls.encode_event(event)}
+                for group, group_event in cls.split_event(event, cls.group_for).items():
+                    if group in subscribed:
+                        messages[group] = cls.encode_event(group_event)
+                async_to_sync(cls.send_groups)(channel_layer, messages)
+        return event
+
+    @staticmethod
+    async def send_groups(channel_layer, messages):
+        """
+        Send every group its message concurrently
+
+        All sends share one event loop, so a tick sets up one loop (and, with
+        channels_redis, its connections) instead of one per group.
+
+        Args:
+            channel_layer: Channel layer to send through
+            messages: Group name -> channel layer event
+        """
+        await asyncio.gather(*(channel_layer.group_send(group, message) for group, message in messages.items()))
+
+    @classmethod
+    def encode_event(cls, event):
+        """
+        Serialize a stock_delta event's client message once for every recipient
+
+        The channel layer event then carries the JSON text frame (plus seq, epoch,
+        since and removed for gap detection) instead of the rows, and consumers forward
+        the frame unchanged. Disabled by WS_PREENCODED_FRAMES = False.
+        """
+        if not getattr(settings, 'WS_PREENCODED_FRAMES', True):
+            return event
+        with Metrics.timer("stock_broadcast_encode_seconds"):
+            message = cls.delta_message(event["seq"], event["data"], event["replace"], event["removed"])
+            frame = json.dumps(message)
+        return {
+            "type": event["type"],
+            "seq": event["seq"],
+            "epoch": event.get("epoch"),
+            "since": event["since"],
+            "removed": event["removed"],
+            "frame": frame,
+        }
+
+    @staticmethod
+    def decode_event(event):
+        """Return (data, replace) of a stock_delta event, pre-encoded or not"""
+        if "frame" in event:
+            message = json.loads(event["frame"])
+            return message["data"], message["replace"]
+        return event["data"], event["replace"]
+
+    @staticmethod
+    def snapshot_message(snapshot, tickers=None):
+        """
+        Client message carrying the complete state of a subscription
+
+        Args:
+            snapshot: Snapshot returned by get_snapshot
+            tickers: Subscribed tickers, or None for every ticker
+
+        Returns:
+            dict: stock_update message with rows sorted by symbol
+        """
+        stocks = [dict(row) for ticker, row in snapshot["stocks"].items() if tickers is None or ticker in tickers]
+        stocks.sort(key=lambda x: x.get("symbol", ""))
+        return {"type": "stock_update", "seq": snapshot["seq"], "data": stocks}
+
+    @staticmethod
+    def delta_message(seq, data, replace, removed):
+        """Client message for the applicable part of a stock_delta event"""
+        return {
+            "type": "stock_delta",
+            "seq": seq,
+            "data": data,
+            "replace": replace,
+            "removed": removed,
+        }
+
+
+class SubscriptionRegistry:
+    """
+    Tickers WebSocket clients are subscribed to, across every ASGI process
+
+    Each process counts its consumers' subscriptions in memory and publishes the
+    set of tickers to the Django cache (one key per process, expiring after
+    WS_SUBSCRIPTION_TTL seconds) from a heartbeat task, plus an index of live
+    processes. The poll task reads the union (tickers) to extend its universe.
+    """
+
+    INDEX_KEY = "ws-subscriptions:processes"
+    PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+    _counts = Counter()
+    _dirty = False
+    loop = None
+    heartbeat = None
+
+    @staticmethod
+    def _ttl():
+        return getattr(settings, 'WS_SUBSCRIPTION_TTL', 60)
+
+    @staticmethod
+    def process_key(process_id):
+        return f"ws-subscriptions:{process_id}"
+
+    @classmethod
+    def add(cls, tickers):
+        cls._counts.update(tickers)
+        cls._dirty = True
+        cls.ensure_heartbeat()
+
+    @classmethod
+    def remove(cls, tickers):
+        for ticker in tickers:
+            cls._counts[ticker] -= 1
+            if cls._counts[ticker] <= 0:
+                del cls._counts[ticker]
+        cls._dirty = True
+
+    @classmethod
+    def ensure_heartbeat(cls):
+        loop = asyncio.get_running_loop()
+        if cls.loop is not loop:
+            cls.loop = loop
+            cls.heartbeat = loop.create_task(cls.run_heartbeat())
+
+    @classmethod
+    async def run_heartbeat(cls):
+        """Publish changes within a second and refresh the entry well before it expires"""
+        last_flush = 0.0
+        while True:
+            await asyncio.sleep(1)
+            if cls._dirty or time.monotonic() - last_flush > cls._ttl() / 3:
+                if await cls.try_flush():
+                    last_flush = time.monotonic()
+
+    @classmethod
+    async def try_flush(cls):
+        """Publish the subscriptions now; on failure the heartbeat retries (returns False)"""
+        cls._dirty = False
+        try:
+            await cls.flush()
+            return True
+        except Exception as error:
+            cls._dirty = True
+            print(f"Subscription registry error: {error}")
+            return False
+
+    @classmethod
+    async def flush(cls):
+        ttl = cls._ttl()
+        await cache.aset(cls.process_key(cls.PROCESS_ID), sorted(cls._counts), timeout=ttl)
+        now = time.time()
+        index = await cache.aget(cls.INDEX_KEY) or {}
+        if cls.PROCESS_ID not in index or now - index[cls.PROCESS_ID] > ttl / 3:
+            index = {process: seen for process, seen in index.items() if now - seen < ttl}
+            index[cls.PROCESS_ID] = now
+            await cache.aset(cls.INDEX_KEY, index, timeout=None)
+
+    @classmethod
+    def tickers(cls):
+        """
+        Union of the tickers subscribed in every live ASGI process
+
+        Returns:
+            list: Ticker symbols, sorted
+        """
+        index = cache.get(cls.INDEX_KEY) or {}
+        subscriptions = cache.get_many([cls.process_key(process) for process in index])
+        return sorted(set().union(*subscriptions.values()))
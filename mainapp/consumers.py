@@ -1,42 +1,447 @@
 # chat/consumers.py
-import json
-
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
-
-
-class StockConsumer(WebsocketConsumer):
-    def connect(self):
-        # Join stock updates group
-        self.group_name = "stock_updates"
-        
-        async_to_sync(self.channel_layer.group_add)(
-            self.group_name, self.channel_name
-        )
-
-        self.accept()
-
-    def disconnect(self, close_code):
-        # Leave stock updates group
-        async_to_sync(self.channel_layer.group_discard)(
-            self.group_name, self.channel_name
-        )
-
-    # Receive message from WebSocket (currently not processing client input)
-    def receive(self, text_data):
-        # Client input will be implemented later
-        # For now, we only broadcast stock data from Celery Beat
-        pass
-
-    # Receive stock data update from Celery task via channel layer
-    def stock_update(self, event):
-        """
-        Handler for stock data updates from Celery task
-        """
-        stock_data = event["stock_data"]
-        
-        # Send stock data to WebSocket client
-        self.send(text_data=json.dumps({
-            "type": "stock_update",
-            "data": stock_data
-        }))
\ No newline at end of file
+import asyncio
+import re
+import time
+from collections import deque
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from .broadcast import StockBroadcastService, SubscriptionRegistry
+from .fanout import LocalFanout
+from .metrics import Metrics
+from .utilities import FundamentalsService
+from .wire_formats import WireFormat
+
+
+class DeltaBuffer:
+    """
+    Outbound stock_delta changes of one client, conflated per ticker
+
+    Holds at most one row per ticker however many deltas arrive before the client
+    takes them (latest value wins; partial rows are merged field by field). A single
+    pending delta keeps its pre-encoded frame so it can still be forwarded as-is.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def __bool__(self):
+        return self.seq is not None
+
+    def clear(self):
+        self.seq = None
+        self.rows = {}
+        self.replace = set()
+        self.removed = set()
+        self.frame = None
+        self.parts = None
+
+    def add(self, seq, parts, frame=None):
+        """
+        Add a delta
+
+        Args:
+            seq: Sequence number of the delta
+            parts: Callable returning the delta's (data, replace, removed)
+            frame: Pre-encoded send() keyword arguments for the delta, if any
+        """
+        if not self and frame is not None:
+            self.seq, self.frame, self.parts = seq, frame, parts
+            return
+        self.unfreeze()
+        self.seq = seq
+        self.merge(*parts())
+
+    def unfreeze(self):
+        """Replace the pending pre-encoded frame by its rows"""
+        if self.frame is not None:
+            self.frame = None
+            self.merge(*self.parts())
+
+    def merge(self, data, replace, removed):
+        replace = set(replace)
+        for row in data:
+            ticker = row["ticker"]
+            self.removed.discard(ticker)
+            if ticker in replace or ticker not in self.rows:
+                self.rows[ticker] = dict(row)
+                if ticker in replace:
+                    self.replace.add(ticker)
+            else:
+                self.rows[ticker].update(row)
+        for ticker in removed:
+            self.rows.pop(ticker, None)
+            self.replace.discard(ticker)
+            self.removed.add(ticker)
+
+    def discard(self, tickers):
+        """Drop pending changes of tickers"""
+        if not self:
+            return
+        self.unfreeze()
+        for ticker in tickers:
+            self.rows.pop(ticker, None)
+            self.replace.discard(ticker)
+            self.removed.discard(ticker)
+        if not (self.rows or self.removed):
+            self.clear()
+
+    def take(self):
+        """
+        Empty the buffer
+
+        Returns:
+            tuple: (pre-encoded send() keyword arguments or None, stock_delta message or None)
+        """
+        frame, message = self.frame, None
+        if frame is None:
+            message = StockBroadcastService.delta_message(
+                self.seq, list(self.rows.values()), sorted(self.replace), sorted(self.removed)
+            )
+        self.clear()
+        return frame, message
+
+
+class StockConsumer(AsyncWebsocketConsumer):
+    """
+    Streams stock data to a WebSocket client
+
+    Clients start on the firehose (every broadcast ticker) unless they connect with
+    ?tickers=A.NS,B.NS. Sending {"type": "subscribe", "tickers": [...]} switches to
+    per-ticker groups; {"type": "unsubscribe", "tickers": [...]} leaves them.
+    Subscribed tickers are polled, so only well-formed symbols the market-data
+    provider has fundamentals for are accepted.
+
+    Broadcast events arrive pre-encoded (see StockBroadcastService.encode_event)
+    and are forwarded as-is whenever they apply to this client unchanged. Clients
+    may negotiate a binary encoding through the WebSocket subprotocol, and ask for
+    stock rows in columnar form with ?format=columnar (see WireFormat).
+
+    Deltas are handed to a sender task through a DeltaBuffer, so the channel layer
+    inbox is always drained promptly. Clients that opt in (connecting with ?ack=1,
+    or sending "ack": true with a subscribe message) pace delivery by acknowledging
+    the seq of each message they have processed ({"type": "ack", "seq": 13}; acks
+    are cumulative): at most WS_ACK_WINDOW snapshot and delta messages are in
+    flight unacknowledged. The ASGI server gives no such signal (Daphne accepts
+    every frame into its transport buffer at once), so without acks a slow reader's
+    frames pile up in server memory. While the window is full, deltas are conflated
+    in the outbox, so a slow client gets fewer, fresher deltas instead of a backlog
+    of stale ones, and is disconnected (close code 4008) once it has been behind for
+    longer than WS_MAX_CLIENT_LAG seconds. Other clients get every delta unpaced.
+    """
+
+    # Yahoo Finance style symbols (e.g. RELIANCE.NS, M&M.NS, ^NSEI, BRK-B, EURUSD=X)
+    TICKER_PATTERN = re.compile(r"^[A-Z0-9^][A-Z0-9&.=-]{0,19}$")
+
+    # Encoded firehose snapshot frames of the current snapshot mirror
+    _snapshot_frames = {}
+
+    async def connect(self):
+        self.group_name = StockBroadcastService.GROUP_NAME
+        self.firehose = False
+        self.tickers = set()
+        self.groups_joined = set()
+        # Ticker -> version (seq of its last change) the client currently has, within snapshot epoch
+        self.versions = {}
+        self.epoch = None
+        self.outbox = DeltaBuffer()
+        self.outbox_ready = asyncio.Event()
+        # When the oldest change not yet sent to the client was buffered
+        self.behind_since = None
+        # Seqs of the messages sent but not acknowledged yet, oldest first (clients that opted in to acks)
+        self.unacked = deque()
+        self.ack_window = getattr(settings, 'WS_ACK_WINDOW', 4)
+        self.acks = False
+        self.closing = False
+        self.sender = None
+
+        query = parse_qs(self.scope.get("query_string", b"").decode("utf-8"))
+        subprotocol, self.encoding, self.indexed = WireFormat.negotiate(self.scope.get("subprotocols"))
+        self.columnar = query.get("format", [None])[-1] == "columnar"
+        self.acks = query.get("ack", [None])[-1] in ("1", "true")
+        await self.accept(subprotocol)
+        self.sender = asyncio.create_task(self.send_outbox())
+        if self.indexed:
+            await self.send_message(WireFormat.schema_message())
+
+        tickers = [ticker for value in query.get("tickers", []) for ticker in value.split(",")]
+        if tickers:
+            await self.subscribe(tickers)
+        else:
+            # Join stock updates group
+            self.firehose = True
+            await self.join_group(self.group_name)
+            # Deltas only make sense on top of a full snapshot
+            await self.send_snapshot()
+
+    async def disconnect(self, close_code):
+        if self.sender:
+            self.sender.cancel()
+        SubscriptionRegistry.remove(self.tickers)
+        # Leave every stock updates group
+        for group in list(self.groups_joined):
+            await self.leave_group(group)
+
+    async def join_group(self, group):
+        if group not in self.groups_joined:
+            if LocalFanout.enabled():
+                await LocalFanout.add(group, self)
+            else:
+                await self.channel_layer.group_add(group, self.channel_name)
+            self.groups_joined.add(group)
+
+    async def leave_group(self, group):
+        if group in self.groups_joined:
+            if LocalFanout.enabled():
+                LocalFanout.discard(group, self)
+            else:
+                await self.channel_layer.group_discard(group, self.channel_name)
+            self.groups_joined.discard(group)
+
+    # Receive message from WebSocket
+    async def receive(self, text_data=None, bytes_data=None):
+        """
+        Handle client messages: ack, subscribe, unsubscribe and resync
+        """
+        try:
+            message = WireFormat.decode(text_data, bytes_data, self.encoding)
+        except (TypeError, ValueError):
+            return await self.send_error("Messages must be JSON objects.")
+        if not isinstance(message, dict):
+            return await self.send_error("Messages must be JSON objects.")
+
+        message_type = message.get("type")
+        if message_type == "ack":
+            seq = message.get("seq")
+            if not isinstance(seq, int) or isinstance(seq, bool):
+                return await self.send_error("seq must be an integer.")
+            self.acknowledge(seq)
+        elif message_type == "resync":
+            await self.send_snapshot()
+        elif message_type in ("subscribe", "unsubscribe"):
+            tickers = message.get("tickers")
+            if not isinstance(tickers, list) or not all(isinstance(ticker, str) for ticker in tickers):
+                return await self.send_error("tickers must be a list of stock symbols.")
+            if message_type == "subscribe":
+                if message.get("ack") is True:
+                    self.acks = True
+                await self.subscribe(tickers)
+            else:
+                await self.unsubscribe(tickers)
+        else:
+            await self.send_error(f"Unknown message type: {message_type}")
+
+    async def subscribe(self, tickers):
+        """
+        Add tickers to this client's subscription and send the resulting state
+        """
+        tickers = {ticker.strip().upper() for ticker in tickers if ticker.strip()}
+        invalid = sorted(ticker for ticker in tickers if not self.TICKER_PATTERN.match(ticker))
+        if invalid:
+            return await self.send_error(f"Invalid stock symbols: {', '.join(invalid)}")
+        limit = getattr(settings, 'WS_MAX_SUBSCRIPTIONS', 200)
+        if len(self.tickers | tickers) > limit:
+            return await self.send_error(f"Maximum {limit} subscriptions allowed per connection.")
+        # Every subscribed ticker joins the polled universe, so unknown symbols are refused
+        new = sorted(tickers - self.tickers)
+        known = await sync_to_async(FundamentalsService.known_tickers, thread_sensitive=False)(new) if new else []
+        unknown = sorted(set(new) - set(known))
+        if unknown:
+            return await self.send_error(f"Unknown stock symbols: {', '.join(unknown)}")
+
+        if self.firehose:
+            self.firehose = False
+            await self.leave_group(self.group_name)
+        added = tickers - self.tickers
+        SubscriptionRegistry.add(added)
+        self.tickers |= tickers
+        for ticker in tickers:
+            await self.join_group(StockBroadcastService.group_for(ticker))
+        await self.send_subscriptions()
+        if added:
+            # Broadcasts only reach registered groups: register before taking the snapshot
+            await SubscriptionRegistry.try_flush()
+        await self.send_snapshot()
+
+    async def unsubscribe(self, tickers):
+        """
+        Remove tickers from this client's subscription
+        """
+        tickers = {ticker.strip().upper() for ticker in tickers}
+        SubscriptionRegistry.remove(self.tickers & tickers)
+        self.tickers -= tickers
+        for ticker in tickers:
+            self.versions.pop(ticker, None)
+        self.outbox.discard(tickers)
+        # Shards can be shared by several subscribed tickers
+        needed = {StockBroadcastService.group_for(ticker) for ticker in self.tickers}
+        for group in list(self.groups_joined):
+            if group != self.group_name and group not in needed:
+                await self.leave_group(group)
+        await self.send_subscriptions()
+
+    @property
+    def wire_format(self):
+        """(encoding, indexed, columnar) of this client's messages"""
+        return (self.encoding, self.indexed, self.columnar)
+
+    def acknowledge(self, seq):
+        """Release the messages up to seq from the in-flight window"""
+        while self.unacked and self.unacked[0] <= seq:
+            self.unacked.popleft()
+        if self.outbox and not self.window_full():
+            self.outbox_ready.set()
+
+    def sent(self, seq):
+        """Count a snapshot or delta message against the ack window"""
+        if self.acks and self.ack_window:
+            self.unacked.append(seq)
+
+    def window_full(self):
+        return self.acks and bool(self.ack_window) and len(self.unacked) >= self.ack_window
+
+    def wants(self, ticker):
+        return self.firehose or ticker in self.tickers
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        started = time.perf_counter()
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+        Metrics.observe("ws_send_seconds", time.perf_counter() - started)
+
+    async def send_message(self, message):
+        """Send a client message in the negotiated wire format"""
+        await self.send(**WireFormat.encode(message, self.encoding, self.indexed, self.columnar))
+
+    async def send_subscriptions(self):
+        await self.send_message({"type": "subscriptions", "tickers": sorted(self.tickers)})
+
+    async def send_error(self, message):
+        await self.send_message({"type": "error", "message": message})
+
+    async def send_snapshot(self):
+        """
+        Send the complete state of this client's subscription
+        """
+        snapshot = await StockBroadcastService.aget_snapshot()
+        # The snapshot supersedes every pending delta
+        self.outbox.clear()
+        self.behind_since = None
+        if snapshot.get("epoch") != self.epoch:
+            # Seqs of the old epoch are not comparable with the new ones, acks included
+            self.epoch = snapshot.get("epoch")
+            self.unacked.clear()
+        if self.firehose:
+            self.versions = {ticker: snapshot["versions"].get(ticker) for ticker in snapshot["stocks"]}
+            if snapshot["stocks"]:
+                self.sent(snapshot["seq"])
+                await self.send(**self.firehose_snapshot_frame(snapshot, self.wire_format))
+            return
+        message = StockBroadcastService.snapshot_message(snapshot, self.tickers)
+        self.versions = {row["ticker"]: snapshot["versions"].get(row["ticker"]) for row in message["data"]}
+        self.sent(snapshot["seq"])
+        await self.send_message(message)
+
+    @classmethod
+    def firehose_snapshot_frame(cls, snapshot, wire_format):
+        """
+        Encoded full snapshot, shared by every firehose client of this process
+
+        Returns:
+            dict: send() keyword arguments, encoded once per snapshot and wire format
+        """
+        frames = cls._snapshot_frames
+        if frames.get("snapshot") is not snapshot:
+            frames = cls._snapshot_frames = {"snapshot": snapshot}
+        if wire_format not in frames:
+            message = StockBroadcastService.snapshot_message(snapshot)
+            frames[wire_format] = WireFormat.encode(message, *wire_format)
+        return frames[wire_format]
+
+    # Receive stock data changes from Celery task via channel layer
+    async def stock_delta(self, event):
+        """
+        Handler for stock data deltas from Celery task
+
+        Each changed ticker carries its previous version ("since"). Rows the client
+        already has (from a newer snapshot) are skipped; a mismatch means a delta
+        was missed, and the client gets a fresh snapshot instead, as it does when
+        the event belongs to another snapshot epoch (seq restarted). When every ticker
+        in the event applies, the pre-encoded frame is forwarded unchanged.
+
+        Applicable changes go to the outbox; send_outbox delivers them.
+        """
+        if self.closing:
+            return
+        seq = event["seq"]
+        StockBroadcastService.note_seq(seq, event.get("epoch"))
+        if event.get("epoch") != self.epoch:
+            return await self.send_snapshot()
+        removed = set(event["removed"])
+        applicable = []
+        for ticker, since in event["since"].items():
+            if not self.wants(ticker) or (ticker in removed and ticker not in self.versions):
+                continue
+            known = self.versions.get(ticker)
+            if known is not None and known >= seq:
+                continue
+            if since != known:
+                return await self.send_snapshot()
+            applicable.append(ticker)
+
+        if not applicable:
+            return
+        for ticker in applicable:
+            if ticker in removed:
+                self.versions.pop(ticker, None)
+            else:
+                self.versions[ticker] = seq
+
+        if "frame" in event and len(applicable) == len(event["since"]):
+            # Common case: the frame applies to this client unchanged
+            frame = WireFormat.encode_frame(event["frame"], *self.wire_format)
+            data_replace = StockBroadcastService.decode_event
+            self.outbox.add(seq, lambda: (*data_replace(event), event["removed"]), frame)
+        else:
+            applicable = set(applicable)
+
+            def parts():
+                data, replace = StockBroadcastService.decode_event(event)
+                return (
+                    [row for row in data if row["ticker"] in applicable],
+                    [ticker for ticker in replace if ticker in applicable],
+                    [ticker for ticker in event["removed"] if ticker in applicable],
+                )
+
+            self.outbox.add(seq, parts)
+
+        now = time.monotonic()
+        if self.behind_since is None or not self.acks:
+            self.behind_since = now
+        elif now - self.behind_since > getattr(settings, 'WS_MAX_CLIENT_LAG', 30):
+            # Too slow to keep up even with conflated deltas
+            self.closing = True
+            self.outbox.clear()
+            await self.close(code=4008)
+            return
+        self.outbox_ready.set()
+
+    async def send_outbox(self):
+        """
+        Sender task: send buffered deltas whenever the ack window has room
+        """
+        while True:
+            await self.outbox_ready.wait()
+            self.outbox_ready.clear()
+            if not self.outbox or self.window_full():
+                continue
+            self.sent(self.outbox.seq)
+            frame, message = self.outbox.take()
+            if frame is not None:
+                await self.send(**frame)
+            else:
+                await self.send_message(message)
+            if not self.outbox:
+                self.behind_since = None
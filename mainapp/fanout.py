@@ -0,0 +1,121 @@
+import asyncio
+import json
+import threading
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+
+class LocalFanout:
+    """
+    Process-local fan-out of stock broadcasts (STOCK_FANOUT_MODE = "pubsub")
+
+    With the channel layer, every group_send writes one Redis message per
+    subscribed channel, so broadcast cost grows with the total number of
+    connections. In pubsub mode the publisher sends each stock_delta event once
+    to a Redis pub/sub channel; every ASGI process subscribes once and hands the
+    event to its own StockConsumer instances in memory.
+    """
+
+    _client = None
+    _client_lock = threading.Lock()
+
+    # Per event loop (one per ASGI process) state
+    loop = None
+    groups = {}
+    listener = None
+    ready = None
+
+    @staticmethod
+    def enabled():
+        return getattr(settings, 'STOCK_FANOUT_MODE', 'channel_layer') == 'pubsub'
+
+    @staticmethod
+    def redis_url():
+        return getattr(settings, 'STOCK_FANOUT_REDIS_URL', 'redis://127.0.0.1:6379/0')
+
+    @staticmethod
+    def channel():
+        return getattr(settings, 'STOCK_FANOUT_CHANNEL', 'stock_fanout')
+
+    @classmethod
+    def publish(cls, event):
+        """
+        Publish a stock_delta event to every ASGI process (called by the Celery worker)
+
+        Args:
+            event: Firehose stock_delta event (with data, before encoding)
+        """
+        if cls._client is None:
+            with cls._client_lock:
+                if cls._client is None:
+                    cls._client = redis.Redis.from_url(cls.redis_url())
+        cls._client.publish(cls.channel(), json.dumps(event))
+
+    @classmethod
+    async def add(cls, group, consumer):
+        """Deliver events of group to consumer; starts this process's listener on first use"""
+        await cls.ensure_listener()
+        cls.groups.setdefault(group, set()).add(consumer)
+
+    @classmethod
+    def discard(cls, group, consumer):
+        members = cls.groups.get(group)
+        if members is not None:
+            members.discard(consumer)
+            if not members:
+                del cls.groups[group]
+
+    @classmethod
+    async def ensure_listener(cls):
+        loop = asyncio.get_running_loop()
+        if cls.loop is not loop:
+            # First use in this process (or a new event loop, e.g. in tests)
+            cls.loop, cls.groups, cls.ready = loop, {}, asyncio.Event()
+            cls.listener = loop.create_task(cls.listen())
+        # Events published before the subscription would be missed
+        await asyncio.wait_for(cls.ready.wait(), timeout=5)
+
+    @classmethod
+    async def listen(cls):
+        """Subscribe to the fan-out channel and deliver its events, reconnecting on errors"""
+        while True:
+            client = aioredis.Redis.from_url(cls.redis_url())
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(cls.channel())
+                    cls.ready.set()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            await cls.deliver(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                print(f"Stock fan-out listener error: {error}")
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+    @classmethod
+    async def deliver(cls, event):
+        """
+        Hand a stock_delta event to the local consumers of every group it touches
+
+        Each group's event is encoded once per process, as StockBroadcastService
+        does for the channel layer.
+        """
+        from .broadcast import StockBroadcastService
+
+        group_events = {StockBroadcastService.GROUP_NAME: event}
+        group_events.update(StockBroadcastService.split_event(event, StockBroadcastService.group_for))
+        for group, group_event in group_events.items():
+            consumers = cls.groups.get(group)
+            if not consumers:
+                continue
+            encoded = StockBroadcastService.encode_event(group_event)
+            for consumer in list(consumers):
+                try:
+                    await consumer.stock_delta(encoded)
+                except Exception as error:
+                    print(f"Stock fan-out delivery error: {error}")
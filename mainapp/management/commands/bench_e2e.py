@@ -0,0 +1,375 @@
+import asyncio
+import json
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import websockets
+from asgiref.sync import sync_to_async
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from curl_cffi.requests import AsyncSession
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from mainapp.management.commands.bench_fanout import LOCAL_SETTINGS
+from mainapp.providers import SimulatedProvider
+from mainapp.tasks import fetch_stocks_data_task
+from mainapp.utilities import QuoteCache
+
+
+# Simulated price paths move fast enough that every tick changes every ticker
+SIMULATOR_SETTINGS = {
+    "STOCK_DATA_PROVIDER": "simulated",
+    "STOCK_SIMULATOR_STEP": 0.01,
+    "STOCK_SIMULATOR_VOLATILITY": 20,
+}
+
+
+class AsgiClient:
+    """Requests and WebSocket connections served in-process by the project's ASGI application"""
+
+    HEADERS = [(b"host", b"127.0.0.1"), (b"content-type", b"application/json")]
+
+    def __init__(self):
+        from stock_tracker.asgi import application
+
+        self.application = application
+
+    async def post(self, path, body):
+        headers = self.HEADERS + [(b"content-length", str(len(body)).encode("ascii"))]
+        communicator = HttpCommunicator(self.application, "POST", path, body=body, headers=headers)
+        response = await communicator.get_response(timeout=60)
+        # Let the handler finish, as a server does once the client has the response
+        await communicator.send_input({"type": "http.disconnect"})
+        await communicator.wait(timeout=60)
+        return response["status"]
+
+    async def connect(self, path):
+        communicator = WebsocketCommunicator(self.application, path, headers=self.HEADERS)
+        connected, _ = await communicator.connect(timeout=30)
+        if not connected:
+            raise CommandError(f"WebSocket connection to {path} was rejected")
+        return AsgiConnection(communicator)
+
+    async def close(self):
+        pass
+
+
+class AsgiConnection:
+    def __init__(self, communicator):
+        self.communicator = communicator
+
+    async def receive(self):
+        """Wait for the next frame; returns its size in bytes"""
+        output = await self.communicator.receive_output(timeout=60)
+        return len(output.get("bytes") or output.get("text").encode("utf-8"))
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class LiveClient:
+    """Requests and WebSocket connections to a running server (--url)"""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.session = AsyncSession()
+
+    async def post(self, path, body):
+        response = await self.session.post(
+            self.url + path, data=body, headers={"Content-Type": "application/json"}, timeout=60,
+        )
+        return response.status_code
+
+    async def connect(self, path):
+        websocket = await websockets.connect("ws" + self.url[len("http"):] + path, max_size=None)
+        return LiveConnection(websocket)
+
+    async def close(self):
+        await self.session.close()
+
+
+class LiveConnection:
+    def __init__(self, websocket):
+        self.websocket = websocket
+
+    async def receive(self):
+        message = await asyncio.wait_for(self.websocket.recv(), timeout=60)
+        return len(message if isinstance(message, bytes) else message.encode("utf-8"))
+
+    async def close(self):
+        await self.websocket.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "End-to-end benchmark of POST /stocks/ at configurable concurrency and of "
+        "fetch_stocks_data_task broadcasts to N WebSocket clients, against the "
+        "simulated market-data provider"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--endpoints", nargs="+", choices=["stocks", "stocks-async"], default=["stocks", "stocks-async"],
+            help="REST endpoints to load (default: stocks stocks-async)",
+        )
+        parser.add_argument(
+            "--concurrency", nargs="+", type=int, default=[1, 10, 50],
+            help="Requests in flight (default: 1 10 50)",
+        )
+        parser.add_argument(
+            "--tickers", nargs="+", type=int, default=[10, 50],
+            help="Tickers per REST request (default: 10 50)",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=200,
+            help="Requests per REST scenario (default: 200)",
+        )
+        parser.add_argument(
+            "--clients", nargs="+", type=int, default=[100, 500],
+            help="WebSocket client counts (default: 100 500)",
+        )
+        parser.add_argument(
+            "--ws-tickers", type=int, default=50,
+            help="Tickers fetched and broadcast per task run (default: 50)",
+        )
+        parser.add_argument(
+            "--ticks", type=int, default=10,
+            help="fetch_stocks_data_task runs per WebSocket scenario (default: 10)",
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0.05,
+            help="Simulated upstream latency in seconds (default: 0.05)",
+        )
+        parser.add_argument(
+            "--error-rate", type=float, default=0.0,
+            help="Simulated upstream error rate (default: 0)",
+        )
+        parser.add_argument(
+            "--format", choices=["rows", "columnar"], default="rows",
+            help="Response and WebSocket message format (default: rows)",
+        )
+        parser.add_argument(
+            "--quote-cache", action="store_true",
+            help="Keep QuoteCache enabled (by default every request reaches the provider)",
+        )
+        parser.add_argument(
+            "--skip-rest", action="store_true",
+            help="Only run the WebSocket scenarios",
+        )
+        parser.add_argument(
+            "--skip-websocket", action="store_true",
+            help="Only run the REST scenarios",
+        )
+        parser.add_argument(
+            "--url", default=None,
+            help="Benchmark a running server (e.g. http://127.0.0.1:8000) instead of the in-process ASGI "
+                 "application; it must use STOCK_DATA_PROVIDER = \"simulated\" and share this "
+                 "process's cache and channel layer",
+        )
+        parser.add_argument(
+            "--output", default=None,
+            help="Write the results as JSON to this path",
+        )
+        parser.add_argument(
+            "--compare", default=None,
+            help="JSON results of a previous run to compare against",
+        )
+
+    def handle(self, *args, **options):
+        overrides = dict(SIMULATOR_SETTINGS)
+        overrides.update(
+            STOCK_SIMULATOR_LATENCY=options["latency"],
+            STOCK_SIMULATOR_ERROR_RATE=options["error_rate"],
+            QUOTE_CACHE_ENABLED=options["quote_cache"],
+        )
+        if options["url"] is None:
+            overrides.update(LOCAL_SETTINGS)
+
+        results = {
+            "commit": self.commit(),
+            "created_at": datetime.now(dt_timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "target": options["url"] or "asgi",
+            "settings": {
+                "latency": options["latency"],
+                "error_rate": options["error_rate"],
+                "quote_cache": options["quote_cache"],
+                "format": options["format"],
+            },
+            "rest": [],
+            "websocket": [],
+        }
+        with override_settings(**overrides):
+            asyncio.run(self.run(options, results))
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options["compare"]:
+            with open(options["compare"]) as previous:
+                self.compare(json.load(previous), results)
+
+    async def run(self, options, results):
+        client = LiveClient(options["url"]) if options["url"] else AsgiClient()
+        try:
+            if not options["skip_rest"]:
+                self.stdout.write(
+                    f"{'endpoint':>13} {'conc':>5} {'tickers':>8} {'req/s':>8} {'errors':>7} "
+                    f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+                )
+                for endpoint in options["endpoints"]:
+                    for concurrency in options["concurrency"]:
+                        for tickers in options["tickers"]:
+                            result = await self.run_rest(
+                                client, endpoint, concurrency, tickers, options["requests"], options["format"],
+                            )
+                            results["rest"].append(result)
+                            self.stdout.write(
+                                f"{endpoint:>13} {concurrency:>5} {tickers:>8} {result['throughput']:>8.1f} "
+                                f"{result['errors']:>7} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+                                f"{result['p99_ms']:>8.1f}"
+                            )
+            if not options["skip_websocket"]:
+                self.stdout.write(
+                    f"{'clients':>8} {'tickers':>8} {'deliveries/s':>13} {'task ms':>8} "
+                    f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'bytes':>7}"
+                )
+                for clients in options["clients"]:
+                    result = await self.run_websocket(
+                        client, clients, options["ws_tickers"], options["ticks"], options["format"],
+                    )
+                    results["websocket"].append(result)
+                    self.stdout.write(
+                        f"{clients:>8} {result['tickers']:>8} {result['throughput']:>13.0f} "
+                        f"{result['task_p50_ms']:>8.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+                        f"{result['p99_ms']:>8.1f} {result['bytes_per_delivery']:>7.0f}"
+                    )
+        finally:
+            await client.close()
+
+    async def run_rest(self, client, endpoint, concurrency, tickers, requests, response_format="rows"):
+        """
+        Send requests POSTs with tickers tickers each, keeping concurrency of them in flight
+
+        Returns:
+            dict: Scenario, throughput (requests/s), errors (non-200 responses) and latency percentiles
+        """
+        await sync_to_async(QuoteCache.clear)()
+        path = reverse(endpoint) + self.query(response_format)
+        body = json.dumps({"stocks": SimulatedProvider.tickers(tickers)}).encode("utf-8")
+        # Warm up fundamentals, so only the live price path is measured
+        await client.post(path, body)
+
+        pending = iter(range(requests))
+        latencies, errors = [], 0
+
+        async def worker():
+            nonlocal errors
+            for _ in pending:
+                started = time.perf_counter()
+                status = await client.post(path, body)
+                latencies.append((time.perf_counter() - started) * 1000)
+                errors += status != 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+        return {
+            "endpoint": endpoint, "concurrency": concurrency, "tickers": tickers, "requests": requests,
+            "throughput": round(requests / wall, 2), "errors": errors, **self.percentiles(latencies),
+        }
+
+    async def run_websocket(self, client, clients, tickers, ticks, message_format="rows"):
+        """
+        Connect clients to the firehose and time fetch_stocks_data_task broadcasts to each of them
+
+        Latencies run from the start of the task (fetch included) to a client receiving the tick.
+
+        Returns:
+            dict: Scenario, throughput (deliveries/s), task duration and latency percentiles
+        """
+        stocks = SimulatedProvider.tickers(tickers)
+        # Runs in its own thread, as in a Celery worker, while the consumers keep the event loop
+        run_task = sync_to_async(fetch_stocks_data_task, thread_sensitive=False)
+        await run_task(stocks)
+
+        path = "/ws/stock/" + self.query(message_format)
+        connections = [await client.connect(path) for _ in range(clients)]
+        for connection in connections:
+            await connection.receive()  # snapshot
+
+        latencies, task_durations, size, wall = [], [], 0, 0.0
+        for _ in range(ticks):
+            started = time.perf_counter()
+
+            async def deliver(connection):
+                nonlocal size
+                received = await connection.receive()
+                size += received
+                return (time.perf_counter() - started) * 1000
+
+            deliveries = asyncio.gather(*(deliver(connection) for connection in connections))
+            await run_task(stocks)
+            task_durations.append((time.perf_counter() - started) * 1000)
+            latencies.extend(await deliveries)
+            wall += time.perf_counter() - started
+
+        for connection in connections:
+            await connection.close()
+        task_p50 = self.percentiles(task_durations)["p50_ms"]
+        return {
+            "clients": clients, "tickers": tickers, "ticks": ticks,
+            "throughput": round(len(latencies) / wall, 2), "task_p50_ms": task_p50,
+            "bytes_per_delivery": round(size / len(latencies), 1), **self.percentiles(latencies),
+        }
+
+    @staticmethod
+    def query(output_format):
+        return "?format=columnar" if output_format == "columnar" else ""
+
+    @staticmethod
+    def percentiles(values):
+        """Nearest-rank p50/p95/p99 of values, in the result keys"""
+        ordered = sorted(values)
+        return {
+            f"p{percent}_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))], 2)
+            for percent in (50, 95, 99)
+        }
+
+    @staticmethod
+    def commit():
+        """Short hash of the checked-out commit (suffixed "-dirty" with local changes), if any"""
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+            dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                   capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return f"{commit}-dirty" if dirty else commit
+
+    def compare(self, previous, results):
+        """Print the change of every scenario's throughput and p50/p99 against a previous run"""
+        self.stdout.write(f"Compared with {previous.get('commit')} ({previous.get('created_at')}):")
+        keys = {"rest": ("endpoint", "concurrency", "tickers"), "websocket": ("clients", "tickers")}
+        for section, key_fields in keys.items():
+            before = {tuple(entry[field] for field in key_fields): entry for entry in previous.get(section, [])}
+            for entry in results[section]:
+                key = tuple(entry[field] for field in key_fields)
+                if key not in before:
+                    continue
+                changes = " ".join(
+                    f"{metric} {self.change(before[key][metric], entry[metric])}"
+                    for metric in ("throughput", "p50_ms", "p99_ms")
+                )
+                label = " ".join(f"{field}={value}" for field, value in zip(key_fields, key))
+                self.stdout.write(f"  {section} {label}: {changes}")
+
+    @staticmethod
+    def change(before, after):
+        return f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
@@ -0,0 +1,158 @@
+import asyncio
+import random
+import statistics
+import time
+
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from mainapp.broadcast import StockBroadcastService
+from mainapp.consumers import StockConsumer
+from mainapp.management.commands.bench_fetch import BENCHMARK_TICKERS
+from mainapp.utilities import FundamentalsService
+
+
+LOCAL_SETTINGS = {
+    # Room for the quotes and fundamentals of large ticker universes (LocMemCache culls past 300 entries by default)
+    "CACHES": {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "bench-fanout",
+            "OPTIONS": {"MAX_ENTRIES": 100000},
+        },
+    },
+    "CHANNEL_LAYERS": {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer", "CONFIG": {"capacity": 1000}}},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark WebSocket broadcast fan-out to N simulated clients, with frames "
+        "encoded once by the publisher versus encoded by every consumer"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clients", nargs="+", type=int, default=[100, 500, 1000],
+            help="Connected client counts to benchmark (default: 100 500 1000)",
+        )
+        parser.add_argument(
+            "--tickers", type=int, default=50,
+            help="Tickers in the broadcast universe (default: 50)",
+        )
+        parser.add_argument(
+            "--ticks", type=int, default=20,
+            help="Broadcasts per run (default: 20)",
+        )
+        parser.add_argument(
+            "--subscribe", type=int, default=0,
+            help="Tickers each client subscribes to; 0 uses the firehose (default: 0)",
+        )
+        parser.add_argument(
+            "--subprotocol", default=None,
+            help="WebSocket subprotocol (wire format) the clients request, e.g. msgpack.indexed",
+        )
+        parser.add_argument(
+            "--fanout", choices=["channel_layer", "pubsub"], default=None,
+            help="Override STOCK_FANOUT_MODE (pubsub needs Redis: use with --configured-layers)",
+        )
+        parser.add_argument(
+            "--configured-layers", action="store_true",
+            help="Use the configured cache and channel layer instead of in-memory ones",
+        )
+
+    def handle(self, *args, **options):
+        overrides = {} if options["configured_layers"] else dict(LOCAL_SETTINGS)
+        if options["fanout"]:
+            overrides["STOCK_FANOUT_MODE"] = options["fanout"]
+        self.stdout.write(
+            f"{'clients':>8} {'mode':>12} {'deliveries/s':>13} {'cpu ms/tick':>12} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'bytes/tick':>11}"
+        )
+        for clients in options["clients"]:
+            for preencoded in (False, True):
+                with override_settings(WS_PREENCODED_FRAMES=preencoded, **overrides):
+                    result = asyncio.run(self.run(clients, options))
+                mode = "encode-once" if preencoded else "per-client"
+                latencies = result["latencies"]
+                p95, p99 = self.percentiles(latencies, (95, 99))
+                self.stdout.write(
+                    f"{clients:>8} {mode:>12} {len(latencies) / result['wall']:>13.0f} "
+                    f"{result['cpu'] / options['ticks']:>12.2f} {statistics.median(latencies):>8.2f} "
+                    f"{p95:>8.2f} {p99:>8.2f} {result['bytes'] / len(latencies):>11.0f}"
+                )
+
+    async def run(self, clients, options):
+        """
+        Connect clients, publish ticks and time every delivery
+
+        Returns:
+            dict: {"latencies": [ms from publish to a client receiving the tick], "wall": seconds,
+                   "cpu": CPU ms, "bytes": frame bytes delivered}
+        """
+        tickers = BENCHMARK_TICKERS[:options["tickers"]]
+        prices = {ticker: 100.0 for ticker in tickers}
+        rng = random.Random(0)
+
+        def rows():
+            return [{"symbol": ticker[:-3], "ticker": ticker, "current_price": price}
+                    for ticker, price in prices.items()]
+
+        publish = sync_to_async(StockBroadcastService.publish)
+        # Start from an empty snapshot so every run broadcasts the same deltas
+        await publish([])
+        await publish(rows())
+
+        path = "/ws/stock/"
+        # Every ticker changes on every tick: one frame per group a client is in
+        frames = 1
+        if options["subscribe"]:
+            subscribed = tickers[:options["subscribe"]]
+            # Subscriptions only accept tickers with fundamentals; don't ask the provider for them
+            await sync_to_async(cache.set_many)(
+                {FundamentalsService.cache_key(ticker): {"shortName": ticker[:-3]} for ticker in subscribed}
+            )
+            path += "?tickers=" + ",".join(subscribed)
+            frames = len({StockBroadcastService.group_for(ticker) for ticker in subscribed})
+        subprotocols = [options["subprotocol"]] if options["subprotocol"] else None
+        communicators = [
+            WebsocketCommunicator(StockConsumer.as_asgi(), path, subprotocols=subprotocols)
+            for _ in range(clients)
+        ]
+        for communicator in communicators:
+            await communicator.connect()
+            # Snapshot, preceded by the schema and subscription list when applicable
+            preamble = 1 + bool(options["subscribe"]) + (options["subprotocol"] or "").endswith(".indexed")
+            for _ in range(preamble):
+                await communicator.receive_output(timeout=30)
+
+        latencies, wall, cpu, size = [], 0.0, 0.0, 0
+        for _ in range(options["ticks"]):
+            for ticker in prices:
+                prices[ticker] *= 1 + rng.uniform(-0.001, 0.001)
+
+            async def deliver(communicator):
+                nonlocal size
+                for _ in range(frames):
+                    output = await communicator.receive_output(timeout=30)
+                    size += len(output.get("bytes") or output.get("text").encode("utf-8"))
+                return (time.perf_counter() - started) * 1000
+
+            started, cpu_started = time.perf_counter(), time.process_time()
+            await publish(rows())
+            latencies.extend(await asyncio.gather(*(deliver(communicator) for communicator in communicators)))
+            wall += time.perf_counter() - started
+            cpu += (time.process_time() - cpu_started) * 1000
+
+        for communicator in communicators:
+            await communicator.disconnect()
+        return {"latencies": latencies, "wall": wall, "cpu": cpu, "bytes": size}
+
+    @staticmethod
+    def percentiles(values, percents):
+        """Nearest-rank percentiles of values"""
+        ordered = sorted(values)
+        return [ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))] for percent in percents]
@@ -0,0 +1,73 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from mainapp.utilities import FetchPool, StockDataService
+
+
+# Large and mid cap NSE listings used as the benchmark universe
+BENCHMARK_TICKERS = [
+    'RELIANCE.NS', 'TCS.NS', 'HDFCBANK.NS', 'ICICIBANK.NS', 'INFY.NS', 'HINDUNILVR.NS', 'ITC.NS', 'SBIN.NS',
+    'BHARTIARTL.NS', 'KOTAKBANK.NS', 'LT.NS', 'AXISBANK.NS', 'ASIANPAINT.NS', 'MARUTI.NS', 'HCLTECH.NS',
+    'SUNPHARMA.NS', 'TITAN.NS', 'BAJFINANCE.NS', 'ULTRACEMCO.NS', 'WIPRO.NS', 'NESTLEIND.NS', 'ONGC.NS',
+    'NTPC.NS', 'POWERGRID.NS', 'M&M.NS', 'TATASTEEL.NS', 'JSWSTEEL.NS', 'ADANIENT.NS', 'ADANIPORTS.NS',
+    'COALINDIA.NS', 'BAJAJFINSV.NS', 'TECHM.NS', 'HINDALCO.NS', 'GRASIM.NS', 'DIVISLAB.NS', 'CIPLA.NS',
+    'DRREDDY.NS', 'BRITANNIA.NS', 'EICHERMOT.NS', 'HEROMOTOCO.NS', 'BAJAJ-AUTO.NS', 'APOLLOHOSP.NS',
+    'TATACONSUM.NS', 'INDUSINDBK.NS', 'SBILIFE.NS', 'HDFCLIFE.NS', 'BPCL.NS', 'SHRIRAMFIN.NS', 'TRENT.NS',
+    'BEL.NS', 'HAL.NS', 'VEDL.NS', 'DLF.NS', 'PIDILITIND.NS', 'SIEMENS.NS', 'GODREJCP.NS', 'DABUR.NS',
+    'HAVELLS.NS', 'AMBUJACEM.NS', 'SHREECEM.NS', 'BANKBARODA.NS', 'PNB.NS', 'CANBK.NS', 'IOC.NS', 'GAIL.NS',
+    'TATAPOWER.NS', 'ADANIGREEN.NS', 'ADANIPOWER.NS', 'ICICIGI.NS', 'ICICIPRULI.NS', 'SBICARD.NS',
+    'CHOLAFIN.NS', 'MARICO.NS', 'COLPAL.NS', 'BERGEPAINT.NS', 'MUTHOOTFIN.NS', 'LUPIN.NS', 'TORNTPHARM.NS',
+    'ZYDUSLIFE.NS', 'AUROPHARMA.NS', 'BOSCHLTD.NS', 'MOTHERSON.NS', 'TVSMOTOR.NS', 'ABB.NS', 'INDIGO.NS',
+    'NAUKRI.NS', 'IRCTC.NS', 'JINDALSTEL.NS', 'SRF.NS', 'PIIND.NS', 'UPL.NS', 'LTIM.NS', 'PERSISTENT.NS',
+    'MPHASIS.NS', 'COFORGE.NS', 'POLYCAB.NS', 'DMART.NS', 'PAGEIND.NS', 'OFSS.NS', 'LICI.NS',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark upstream fetch latency with a cold fetch pool (new executor and HTTP "
+        "session, as every call used to create) versus the warm shared pool"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", nargs="+", type=int, default=[10, 50, 100],
+            help="Ticker counts to benchmark (default: 10 50 100)",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5,
+            help="Runs per size and mode (default: 5)",
+        )
+        parser.add_argument(
+            "--per-ticker", action="store_true",
+            help="Disable bulk downloads so every ticker is fetched separately",
+        )
+
+    def handle(self, *args, **options):
+        with override_settings(STOCK_FETCH_BATCHED=not options["per_ticker"]):
+            self.stdout.write(f"{'tickers':>8} {'cold p50 ms':>12} {'warm p50 ms':>12} {'speedup':>8}")
+            for size in options["sizes"]:
+                tickers = BENCHMARK_TICKERS[:size]
+                # Populate the fundamentals cache so only the live price path is measured
+                StockDataService.fetch_stocks_data_uncached(tickers)
+                cold = [self.time_fetch(tickers, cold=True) for _ in range(options["repeat"])]
+                warm = [self.time_fetch(tickers, cold=False) for _ in range(options["repeat"])]
+                cold_p50, warm_p50 = statistics.median(cold), statistics.median(warm)
+                self.stdout.write(
+                    f"{len(tickers):>8} {cold_p50:>12.1f} {warm_p50:>12.1f} {cold_p50 / warm_p50:>7.2f}x"
+                )
+        FetchPool.shutdown()
+
+    def time_fetch(self, tickers, cold):
+        """Time one uncached fetch of tickers in milliseconds"""
+        if cold:
+            FetchPool.shutdown()
+        else:
+            # Make sure the pool and its connections exist before timing
+            StockDataService.fetch_stocks_data_uncached(tickers[:1])
+        started = time.perf_counter()
+        StockDataService.fetch_stocks_data_uncached(tickers)
+        return (time.perf_counter() - started) * 1000
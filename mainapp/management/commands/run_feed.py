@@ -0,0 +1,48 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mainapp.polling import FeedRunner
+from stock_tracker.celery import TRACKED_STOCKS
+
+
+class Command(BaseCommand):
+    help = (
+        "Poll stock data in a long-lived asyncio loop and publish straight to WebSocket "
+        "clients at a fixed rate (Celery beat polling pauses while this runs)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval", type=float, default=getattr(settings, 'STOCK_FEED_INTERVAL', 1),
+            help="Seconds between ticks (default: STOCK_FEED_INTERVAL)",
+        )
+        parser.add_argument(
+            "--tickers", nargs="+", default=None,
+            help="Always-polled tickers (default: TRACKED_STOCKS); subscribed tickers are added",
+        )
+        parser.add_argument(
+            "--ignore-market-hours", action="store_true",
+            help="Keep the interval while the exchange is closed",
+        )
+        parser.add_argument(
+            "--ticks", type=int, default=None,
+            help="Stop after this many published ticks",
+        )
+
+    def handle(self, *args, **options):
+        runner = FeedRunner(
+            options["tickers"] or TRACKED_STOCKS,
+            options["interval"],
+            follow_market=not options["ignore_market_hours"],
+        )
+        self.stdout.write(f"Feed {runner.feed_id} polling every {options['interval']}s")
+        on_tick = (lambda entry: self.stdout.write(str(entry))) if options["verbosity"] > 1 else None
+        try:
+            asyncio.run(runner.run(ticks=options["ticks"], on_tick=on_tick))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(
+            f"Published {runner.published} ticks, skipped {runner.skipped} slots, recovered from {runner.errors} errors"
+        )
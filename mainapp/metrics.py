@@ -0,0 +1,218 @@
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class Metrics:
+    """
+    Process-local counters and histograms, exported in Prometheus text format
+
+    Recording is an in-memory update under a lock, cheap enough to leave on
+    under full load (STOCK_METRICS_ENABLED turns it off). A daemon thread in
+    every process that records anything (web, Celery worker, run_feed) copies
+    its totals to the Django cache every STOCK_METRICS_FLUSH_INTERVAL seconds
+    (one key per process, expiring after STOCK_METRICS_TTL, plus an index of
+    live processes, as SubscriptionRegistry does). GET /metrics on any web
+    process sums the totals of every live process, so a single scrape target
+    covers Celery workers too. Totals of a process that exits drop out after
+    the TTL, which Prometheus treats as a counter reset.
+    """
+
+    INDEX_KEY = "metrics:processes"
+
+    # Histogram upper bounds in seconds
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    # Name -> (type, help) of every metric family
+    FAMILIES = {
+        "stock_upstream_fetch_seconds": (
+            "histogram", "Duration of upstream fetch calls by kind (ticker: fetch_stock_data, "
+                         "chunk: bulk price download, async: AsyncStockDataService price fetch)",
+        ),
+        "stock_fetch_queue_wait_seconds": (
+            "histogram", "Time upstream fetch calls waited for a FetchPool thread (async: for the concurrency semaphore)",
+        ),
+        "stock_fetch_errors_total": ("counter", "Stock rows returned as errors, by polled ticker (other: any ticker outside the polled universe)"),
+        "stock_cache_requests_total": ("counter", "Quote and fundamentals cache lookups per ticker, by cache and result"),
+        "stock_broadcast_publish_seconds": (
+            "histogram", "Time to hand one broadcast to every group (channel layer group_send) or to Redis pub/sub",
+        ),
+        "stock_broadcast_encode_seconds": ("histogram", "Time to pre-encode the client frame of one broadcast event"),
+        "ws_send_seconds": ("histogram", "Time StockConsumer.send took per WebSocket message"),
+        "stock_request_phase_seconds": (
+            "histogram", "Duration of request phases (validate, fetch, sort, envelope, render, total) by route",
+        ),
+        "stock_run_seconds": ("histogram", "Duration of the runs recorded in RunHistory, by task"),
+        "stock_feed_errors_total": ("counter", "run_feed loop iterations that raised (the feed backs off and carries on)"),
+        "stock_metrics_processes": ("gauge", "Processes whose metrics are included in this scrape"),
+    }
+
+    _lock = threading.Lock()
+    _counters = {}
+    _histograms = {}
+    _flusher = None
+
+    @staticmethod
+    def enabled():
+        return getattr(settings, 'STOCK_METRICS_ENABLED', True)
+
+    @staticmethod
+    def _ttl():
+        return getattr(settings, 'STOCK_METRICS_TTL', 120)
+
+    @staticmethod
+    def process_id():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @staticmethod
+    def process_key(process_id):
+        return f"metrics:{process_id}"
+
+    @classmethod
+    def inc(cls, name, amount=1, **labels):
+        """Add amount to a counter"""
+        if not amount or not cls.enabled():
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with cls._lock:
+            cls._counters[key] = cls._counters.get(key, 0) + amount
+        if cls._flusher is None:
+            cls.start_flusher()
+
+    @classmethod
+    def observe(cls, name, seconds, **labels):
+        """Record a duration in a histogram"""
+        if not cls.enabled():
+            return
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect_left(cls.BUCKETS, seconds)
+        with cls._lock:
+            histogram = cls._histograms.get(key)
+            if histogram is None:
+                # Per-bucket (not cumulative) counts, the +Inf bucket, then the sum
+                histogram = cls._histograms[key] = [0] * (len(cls.BUCKETS) + 1) + [0.0]
+            histogram[bucket] += 1
+            histogram[-1] += seconds
+        if cls._flusher is None:
+            cls.start_flusher()
+
+    @classmethod
+    @contextmanager
+    def timer(cls, name, **labels):
+        """Record the duration of the with block in a histogram"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.observe(name, time.perf_counter() - started, **labels)
+
+    @classmethod
+    def start_flusher(cls):
+        with cls._lock:
+            if cls._flusher is None:
+                cls._flusher = threading.Thread(target=cls.run_flusher, name="metrics-flusher", daemon=True)
+                cls._flusher.start()
+
+    @classmethod
+    def run_flusher(cls):
+        while True:
+            time.sleep(getattr(settings, 'STOCK_METRICS_FLUSH_INTERVAL', 5))
+            try:
+                cls.flush()
+            except Exception as error:
+                print(f"Metrics flush error: {error}")
+
+    @classmethod
+    def _after_fork(cls):
+        # A forked child (Celery prefork pool) starts from zero with its own lock and flusher
+        cls._lock = threading.Lock()
+        cls._counters, cls._histograms, cls._flusher = {}, {}, None
+
+    @classmethod
+    def flush(cls):
+        """Publish this process's totals to the Django cache"""
+        with cls._lock:
+            totals = {
+                "counters": dict(cls._counters),
+                "histograms": {key: list(histogram) for key, histogram in cls._histograms.items()},
+            }
+        ttl = cls._ttl()
+        process_id = cls.process_id()
+        cache.set(cls.process_key(process_id), totals, timeout=ttl)
+        now = time.time()
+        index = cache.get(cls.INDEX_KEY) or {}
+        if process_id not in index or now - index[process_id] > ttl / 3:
+            index = {process: seen for process, seen in index.items() if now - seen < ttl}
+            index[process_id] = now
+            cache.set(cls.INDEX_KEY, index, timeout=None)
+
+    @classmethod
+    def collect(cls):
+        """
+        Sum the published totals of every live process
+
+        Returns:
+            tuple: (counters, histograms, number of processes); keys are (name, labels)
+        """
+        if cls.enabled():
+            cls.flush()
+        index = cache.get(cls.INDEX_KEY) or {}
+        published = cache.get_many([cls.process_key(process) for process in index])
+        counters, histograms = {}, {}
+        for totals in published.values():
+            for key, value in totals["counters"].items():
+                counters[key] = counters.get(key, 0) + value
+            for key, histogram in totals["histograms"].items():
+                merged = histograms.get(key)
+                histograms[key] = list(histogram) if merged is None else [a + b for a, b in zip(merged, histogram)]
+        return counters, histograms, len(published)
+
+    @staticmethod
+    def format_labels(labels, **extra):
+        pairs = list(labels) + list(extra.items())
+        if not pairs:
+            return ""
+        escaped = (
+            (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in pairs
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    @classmethod
+    def render(cls):
+        """
+        Prometheus text exposition format (version 0.0.4) of collect()
+
+        Returns:
+            str: Response body for GET /metrics
+        """
+        counters, histograms, processes = cls.collect()
+        series = {}
+        for (name, labels), value in sorted(counters.items()):
+            series.setdefault(name, []).append(f"{name}{cls.format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(histograms.items()):
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(cls.BUCKETS + ("+Inf",), histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{cls.format_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{cls.format_labels(labels)} {histogram[-1]}")
+            lines.append(f"{name}_count{cls.format_labels(labels)} {cumulative}")
+        series["stock_metrics_processes"] = [f"stock_metrics_processes {processes}"]
+
+        output = []
+        for name in sorted(series):
+            metric_type, description = cls.FAMILIES.get(name, ("untyped", name))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(series[name])
+        return "\n".join(output) + "\n"
+
+
+os.register_at_fork(after_in_child=Metrics._after_fork)
@@ -0,0 +1,183 @@
+import cProfile
+import contextvars
+import itertools
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from .metrics import Metrics
+
+
+class RequestTiming:
+    """
+    Named phase durations of the current request
+
+    ServerTimingMiddleware starts a recording for every request; code on the
+    request path wraps its phases in RequestTiming.phase(name). Outside a
+    request (Celery tasks, run_feed) nothing is recorded.
+    """
+
+    _current = contextvars.ContextVar("request_timing", default=None)
+
+    @classmethod
+    def start(cls):
+        """Start recording for the current request; returns the token to pass to stop()"""
+        return cls._current.set({})
+
+    @classmethod
+    def stop(cls, token):
+        """Stop recording and return the phase durations in seconds"""
+        timings = cls._current.get() or {}
+        cls._current.reset(token)
+        return timings
+
+    @classmethod
+    def record(cls, name, seconds):
+        timings = cls._current.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + seconds
+
+    @classmethod
+    @contextmanager
+    def phase(cls, name):
+        """Add the duration of the with block to phase name of the current request"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.record(name, time.perf_counter() - started)
+
+    @classmethod
+    def milliseconds(cls):
+        """Phase durations recorded so far, in milliseconds"""
+        return {name: round(seconds * 1000, 2) for name, seconds in (cls._current.get() or {}).items()}
+
+    @staticmethod
+    def requested(request):
+        """Whether the client asked for the timings in the response meta block (?timing=1)"""
+        return request.GET.get("timing") in ("1", "true")
+
+
+class ServerTimingMiddleware:
+    """
+    Server-Timing header with the phases of every request, and sampled profiling
+
+    Each response carries "Server-Timing: validate;dur=0.41, fetch;dur=120.3,
+    ..., total;dur=125.7" (milliseconds, STOCK_SERVER_TIMING), and every phase
+    is recorded in the stock_request_phase_seconds histogram. The render phase
+    covers DRF rendering of template responses.
+
+    With STOCK_PROFILE_SAMPLE_RATE = N, one in N requests to STOCK_PROFILE_PATHS
+    (exact paths, so /stocks/ does not cover the async /stocks/async/ or
+    /stocks/snapshot/ views, which would use up samples) runs its (synchronous) view and rendering under cProfile, one at a time per
+    process; the stats are written to STOCK_PROFILE_DIR (open them with
+    python -m pstats or snakeviz) and named in a "profile" Server-Timing entry.
+
+    Must be the last entry of MIDDLEWARE: a profiled request calls the view from
+    process_view, after every other middleware's process_view has run.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    _requests = itertools.count(1)
+    _dumps = itertools.count(1)
+    _profiling = threading.Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Django runs a synchronous process_view through sync_to_async; this one needs no thread
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started, token = self.begin(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = RequestTiming.stop(token)
+        return self.finish(request, response, started, timings)
+
+    async def __acall__(self, request):
+        started, token = self.begin(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = RequestTiming.stop(token)
+        return self.finish(request, response, started, timings)
+
+    def begin(self, request):
+        rate = getattr(settings, 'STOCK_PROFILE_SAMPLE_RATE', 0)
+        request.profile = bool(
+            rate
+            and request.path in getattr(settings, 'STOCK_PROFILE_PATHS', ())
+            and next(self._requests) % rate == 0
+        )
+        return time.perf_counter(), RequestTiming.start()
+
+    def finish(self, request, response, started, timings):
+        timings["total"] = time.perf_counter() - started
+        route = request.resolver_match.url_name if request.resolver_match else "unmatched"
+        for name, seconds in timings.items():
+            Metrics.observe("stock_request_phase_seconds", seconds, route=route, phase=name)
+        if getattr(settings, 'STOCK_SERVER_TIMING', True):
+            entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+            if getattr(request, "profile_path", None):
+                entries.append(f'profile;desc="{os.path.basename(request.profile_path)}"')
+            response["Server-Timing"] = ", ".join(entries)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Run sampled requests' views under cProfile; others continue as usual (None)"""
+        if not request.profile or iscoroutinefunction(view_func):
+            return None
+        return self.profile_view(request, view_func, view_args, view_kwargs)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if not request.profile or iscoroutinefunction(view_func):
+            return None
+        # Profile the view in the thread Django would run it in
+        return await sync_to_async(self.profile_view)(request, view_func, view_args, view_kwargs)
+
+    def profile_view(self, request, view_func, view_args, view_kwargs):
+        if not self._profiling.acquire(blocking=False):
+            return None
+        try:
+            profiler = cProfile.Profile()
+            response = profiler.runcall(view_func, request, *view_args, **view_kwargs)
+            if callable(getattr(response, "render", None)):
+                response = profiler.runcall(self.render, response)
+            request.profile_path = self.dump(profiler, request)
+        finally:
+            self._profiling.release()
+        return response
+
+    @staticmethod
+    def render(response):
+        with RequestTiming.phase("render"):
+            return response.render()
+
+    def process_template_response(self, request, response):
+        started = time.perf_counter()
+        response.add_post_render_callback(lambda rendered: RequestTiming.record("render", time.perf_counter() - started))
+        return response
+
+    @staticmethod
+    def dump(profiler, request):
+        """Write the profile to STOCK_PROFILE_DIR; returns its path"""
+        directory = getattr(settings, 'STOCK_PROFILE_DIR', os.path.join(settings.BASE_DIR, "profiles"))
+        os.makedirs(directory, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9]+", "-", request.path).strip("-") or "root"
+        dump = next(ServerTimingMiddleware._dumps)
+        path = os.path.join(directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{name}-{os.getpid()}-{dump}.prof")
+        profiler.dump_stats(path)
+        return path
@@ -23,6 +23,13 @@ class ExtendSchemaStructure(Enum):
                         "default": ["RELIANCE.NS", "TCS.NS", "HDFCBANK.NS"],
                         "description": "List of stock ticker symbols with .NS suffix for NSE stocks",
                         "example": ["RELIANCE.NS", "TCS.NS", "HDFCBANK.NS", "INFY.NS"]
+                    },
+                    "deadline_ms": {
+                        "type": "integer",
+                        "minimum": 1,
+                        "maximum": 60000,
+                        "description": "Optional total latency budget in milliseconds; stocks not fetched in time are returned with an error",
+                        "example": 1500
                     }
                 },
                 "required": ["stocks"]
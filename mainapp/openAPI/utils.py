@@ -166,6 +166,8 @@ class OpenAPIDescription(Enum):
     - Maximum 100 stocks can be requested per API call
     - Stock symbols must include the .NS suffix (e.g., RELIANCE.NS, TCS.NS)
     - If a stock symbol is invalid or data is unavailable, an error will be included in the response for that specific stock
+    - Optional `deadline_ms` sets a total latency budget; stocks not fetched in time are returned with an error (e.g. "Deadline exceeded fetching INFY.NS")
+    - Stocks served from a cached quote that is being refreshed carry `"stale": true`
     - All stock data is fetched in parallel for optimal performance
     """
 
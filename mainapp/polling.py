@@ -0,0 +1,440 @@
+import asyncio
+import os
+import socket
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .broadcast import StockBroadcastService, SubscriptionRegistry
+from .metrics import Metrics
+from .utilities import AsyncStockDataService, RunHistory, TimeUtility
+
+
+class PollService:
+    """
+    One beat tick over the polled universe, split into chunks across workers
+
+    The universe is the configured tickers plus every ticker a WebSocket client
+    is subscribed to (SubscriptionRegistry), capped at STOCK_POLL_MAX_TICKERS and
+    split into chunks of STOCK_POLL_CHUNK_SIZE. Each chunk is fetched by its own
+    task and stored in the Django cache; the task that completes the tick (an
+    atomic countdown) merges the chunks and publishes a single broadcast. No
+    result backend is involved.
+    """
+
+    TICK_KEY = "poll:tick"
+    PUBLISHED_KEY = "poll:published"
+    HISTORY_NAME = "mainapp.tasks.poll_stocks_task"
+    # Seconds a process reuses its copy of the polled universe for metric labels
+    LABEL_UNIVERSE_TTL = 30
+
+    _label_universe = frozenset()
+    _label_universe_at = None
+
+    @staticmethod
+    def pending_key(tick):
+        return f"poll:{tick}:pending"
+
+    @staticmethod
+    def chunk_key(tick, index):
+        return f"poll:{tick}:{index}"
+
+    @staticmethod
+    def _tick_timeout():
+        # Chunks of a tick that has not completed by then are abandoned
+        return int(getattr(settings, 'STOCK_POLL_INTERVAL', 10) * 6)
+
+    @classmethod
+    def universe(cls, configured):
+        """
+        Tickers to poll: configured first, then subscribed ones
+
+        Args:
+            configured: Always-polled ticker symbols
+
+        Returns:
+            list: Unique ticker symbols
+        """
+        tickers = list(dict.fromkeys(list(configured) + SubscriptionRegistry.tickers()))
+        return tickers[:getattr(settings, 'STOCK_POLL_MAX_TICKERS', 2000)]
+
+    @classmethod
+    def metric_label(cls, ticker):
+        """
+        Ticker label for metrics: the ticker itself if it is polled, "other" otherwise
+
+        REST clients may request any symbol, so labelling by the raw ticker would let
+        them create unbounded series; the polled universe is capped at STOCK_POLL_MAX_TICKERS.
+
+        Args:
+            ticker: Stock ticker symbol
+
+        Returns:
+            str: Label value
+        """
+        now = time.monotonic()
+        if cls._label_universe_at is None or now - cls._label_universe_at > cls.LABEL_UNIVERSE_TTL:
+            from stock_tracker.celery import TRACKED_STOCKS
+
+            cls._label_universe_at = now
+            try:
+                cls._label_universe = frozenset(cls.universe(TRACKED_STOCKS))
+            except Exception as error:
+                # Keep the previous universe; the next refresh retries
+                print(f"Metric label universe error: {error}")
+        return ticker if ticker in cls._label_universe else "other"
+
+    @staticmethod
+    def chunks(tickers):
+        size = getattr(settings, 'STOCK_POLL_CHUNK_SIZE', 100)
+        return [tickers[i:i + size] for i in range(0, len(tickers), size)]
+
+    @classmethod
+    def start_tick(cls, chunk_count):
+        """
+        Register a tick of chunk_count chunks
+
+        Returns:
+            int: Tick number (increasing)
+        """
+        cache.add(cls.TICK_KEY, 0, timeout=None)
+        tick = cache.incr(cls.TICK_KEY)
+        cache.set(cls.pending_key(tick), chunk_count, timeout=cls._tick_timeout())
+        return tick
+
+    @classmethod
+    def complete_chunk(cls, tick, index, chunk_count, stocks_data):
+        """
+        Store a chunk's stock data and, if it was the tick's last chunk, merge the tick
+
+        Returns:
+            list: Every chunk's stock data sorted by symbol when the tick is complete,
+                  otherwise None
+        """
+        cache.set(cls.chunk_key(tick, index), stocks_data, timeout=cls._tick_timeout())
+        try:
+            remaining = cache.decr(cls.pending_key(tick))
+        except ValueError:
+            # Tick expired
+            return None
+        if remaining > 0:
+            return None
+
+        keys = [cls.chunk_key(tick, i) for i in range(chunk_count)]
+        chunks = cache.get_many(keys)
+        cache.delete_many(keys + [cls.pending_key(tick)])
+        if len(chunks) != chunk_count:
+            return None
+        stocks_data = [stock_data for key in keys for stock_data in chunks[key]]
+        return sorted(stocks_data, key=lambda x: x.get('symbol', ''))
+
+    @classmethod
+    def publish_tick(cls, tick, stocks_data, started_at, chunk_count):
+        """
+        Broadcast a complete tick, unless a newer tick was already published
+
+        Args:
+            tick: Tick number from start_tick
+            stocks_data: Merged stock data of the tick
+            started_at: Epoch seconds when the tick was started
+            chunk_count: Number of chunks in the tick
+
+        Returns:
+            dict: RunHistory entry of the tick, or None when it was superseded
+        """
+        # Compare ticks under the publish lock, so overlapping ticks publish in order
+        with StockBroadcastService.publish_lock():
+            if tick < (cache.get(cls.PUBLISHED_KEY) or 0):
+                return None
+            cache.set(cls.PUBLISHED_KEY, tick, timeout=None)
+            event = StockBroadcastService.publish_locked(stocks_data)
+        changed = len(event["data"]) + len(event["removed"]) if event else 0
+        interval = PollScheduler.observe(started_at, len(stocks_data), changed)
+        return RunHistory.record(
+            cls.HISTORY_NAME,
+            tick=tick,
+            duration_ms=round((time.time() - started_at) * 1000, 1),
+            tickers=len(stocks_data),
+            errors=sum(1 for stock_data in stocks_data if "error" in stock_data),
+            changed=changed,
+            chunks=chunk_count,
+            next_interval=interval,
+        )
+
+
+class PollScheduler:
+    """
+    Market-hours-aware cadence for poll_stocks_task
+
+    With STOCK_POLL_ADAPTIVE the beat fires every STOCK_POLL_MIN_INTERVAL seconds
+    and each tick first asks claim() whether a poll is due. The interval depends on
+    the exchange phase (TimeUtility.market_phase):
+
+    - closed (nights, weekends, holidays): STOCK_POLL_CLOSED_INTERVAL heartbeat
+    - pre_open and post_close: STOCK_POLL_INTERVAL
+    - open: starts at STOCK_POLL_INTERVAL, halves while at least
+      STOCK_POLL_SPEEDUP_RATIO of the polled tickers change per tick and grows by
+      half while at most STOCK_POLL_SLOWDOWN_RATIO do, within
+      [STOCK_POLL_MIN_INTERVAL, STOCK_POLL_MAX_INTERVAL]
+    """
+
+    NEXT_DUE_KEY = "poll:next-due"
+    INTERVAL_KEY = "poll:interval"
+
+    @staticmethod
+    def enabled():
+        return getattr(settings, 'STOCK_POLL_ADAPTIVE', True)
+
+    @classmethod
+    def interval(cls, phase=None):
+        """
+        Current poll interval in seconds for the exchange phase (default: now)
+        """
+        phase = phase or TimeUtility.market_phase()
+        if phase == "closed":
+            return getattr(settings, 'STOCK_POLL_CLOSED_INTERVAL', 900)
+        if phase == "open":
+            return cache.get(cls.INTERVAL_KEY) or getattr(settings, 'STOCK_POLL_INTERVAL', 10)
+        return getattr(settings, 'STOCK_POLL_INTERVAL', 10)
+
+    @classmethod
+    def claim(cls):
+        """
+        Whether a poll is due now; if so, the next one is scheduled one interval later
+
+        A change of exchange phase (e.g. closed -> pre_open) makes a poll due at once.
+
+        Returns:
+            bool: True when the caller should poll
+        """
+        if not cls.enabled():
+            return True
+        now = time.time()
+        phase = TimeUtility.market_phase()
+        due = cache.get(cls.NEXT_DUE_KEY)
+        if due and due["phase"] == phase and now < due["at"]:
+            return False
+        cls.schedule(now + cls.interval(phase), phase)
+        return True
+
+    @classmethod
+    def schedule(cls, at, phase):
+        cache.set(cls.NEXT_DUE_KEY, {"at": at, "phase": phase}, timeout=None)
+
+    @classmethod
+    def observe(cls, started_at, tickers, changed):
+        """
+        Adapt the in-session interval to the share of tickers that changed in a tick
+
+        Args:
+            started_at: Epoch seconds when the tick was started
+            tickers: Number of tickers polled
+            changed: Number of tickers that changed
+
+        Returns:
+            float: Interval until the next poll
+        """
+        if not cls.enabled():
+            return getattr(settings, 'STOCK_POLL_INTERVAL', 10)
+        phase = TimeUtility.market_phase()
+        interval = cls.interval(phase)
+        if phase == "open" and tickers:
+            ratio = changed / tickers
+            if ratio >= getattr(settings, 'STOCK_POLL_SPEEDUP_RATIO', 0.5):
+                interval = interval / 2
+            elif ratio <= getattr(settings, 'STOCK_POLL_SLOWDOWN_RATIO', 0.1):
+                interval = interval * 1.5
+            interval = min(
+                max(interval, getattr(settings, 'STOCK_POLL_MIN_INTERVAL', 2)),
+                getattr(settings, 'STOCK_POLL_MAX_INTERVAL', 30),
+            )
+            cache.set(cls.INTERVAL_KEY, interval, timeout=None)
+        cls.schedule(started_at + interval, phase)
+        return interval
+
+
+class FeedRunner:
+    """
+    Long-lived asyncio feed (manage.py run_feed) polling without Celery
+
+    Every period the runner fetches the polled universe with
+    AsyncStockDataService (bypassing the quote cache read, refreshing it for REST
+    readers) and publishes straight to the channel layer. Ticks are scheduled at a
+    fixed rate: tick n starts at start + n * period however long earlier ticks took,
+    and slots missed by an overrunning tick are skipped instead of bunched up.
+
+    A running feed holds a lease in the Django cache; poll_stocks_task skips its
+    ticks while the lease is held, so Celery beat takes over as soon as the feed
+    stops. Only one feed publishes at a time. The lease is renewed on every wake-up
+    (at least every PHASE_CHECK_INTERVAL seconds) and expires a few intervals after
+    a feed dies, whatever the tick period.
+    """
+
+    LEASE_KEY = "feed:leader"
+    HISTORY_NAME = "feed"
+    # Longest sleep between exchange phase checks
+    PHASE_CHECK_INTERVAL = 5
+    # Missed renewals before the lease of a dead feed expires
+    LEASE_RENEWALS = 3
+
+    def __init__(self, configured, interval, follow_market=True):
+        """
+        Args:
+            configured: Always-polled ticker symbols
+            interval: Seconds between ticks while the exchange is not closed
+            follow_market: Fall back to STOCK_POLL_CLOSED_INTERVAL while the exchange is closed
+        """
+        self.configured = list(configured)
+        self.interval = interval
+        self.follow_market = follow_market
+        self.feed_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.published = 0
+        self.skipped = 0
+        self.errors = 0
+        # Whether this feed has held the lease, and whether another feed took it over since
+        self.leading = False
+        self.lost_lease = False
+
+    @classmethod
+    def active(cls):
+        """Whether a feed currently holds the lease"""
+        return cache.get(cls.LEASE_KEY) is not None
+
+    def period(self, phase):
+        if phase == "closed":
+            return getattr(settings, 'STOCK_POLL_CLOSED_INTERVAL', 900)
+        return self.interval
+
+    def claim_lease(self, busy=0):
+        """
+        Acquire or renew the feed lease; False while another feed holds it
+
+        Args:
+            busy: Seconds the caller will go without renewing beyond the usual
+                  PHASE_CHECK_INTERVAL (the fetch deadline of a tick)
+        """
+        timeout = self.LEASE_RENEWALS * self.PHASE_CHECK_INTERVAL + busy
+        if cache.add(self.LEASE_KEY, self.feed_id, timeout=timeout):
+            self.leading = True
+            return True
+        if cache.get(self.LEASE_KEY) == self.feed_id:
+            cache.set(self.LEASE_KEY, self.feed_id, timeout=timeout)
+            self.leading = True
+            return True
+        # Another feed took over (our lease expired while this one could not renew it)
+        self.lost_lease = self.leading
+        return False
+
+    def release_lease(self):
+        if cache.get(self.LEASE_KEY) == self.feed_id:
+            cache.delete(self.LEASE_KEY)
+
+    async def run(self, ticks=None, on_tick=None):
+        """
+        Run the feed until cancelled, for a number of published ticks, or until
+        another feed takes over the lease
+
+        A tick that raises (a Redis blip, a provider or channel layer error) is
+        logged and counted, and the feed backs off for up to PHASE_CHECK_INTERVAL
+        seconds before carrying on.
+
+        Args:
+            ticks: Number of ticks to publish, or None
+            on_tick: Callable receiving the RunHistory entry of every published tick
+        """
+        loop = asyncio.get_running_loop()
+        next_at = loop.time()
+        phase = None
+        failures = 0
+        try:
+            while ticks is None or self.published < ticks:
+                try:
+                    current_phase = TimeUtility.market_phase() if self.follow_market else "open"
+                    period = self.period(current_phase)
+                    if current_phase != phase:
+                        # Poll right away on a phase change and restart the schedule
+                        phase, next_at = current_phase, loop.time()
+                    delay = next_at - loop.time()
+                    if delay > 0:
+                        # Keep the lease alive through long (market closed) periods
+                        await sync_to_async(self.claim_lease)()
+                        if self.lost_lease:
+                            break
+                        await asyncio.sleep(min(delay, self.PHASE_CHECK_INTERVAL))
+                        continue
+
+                    entry = await self.tick(period, lag=loop.time() - next_at)
+                    if self.lost_lease:
+                        break
+                    failures = 0
+                    if entry is not None:
+                        self.published += 1
+                        if on_tick:
+                            on_tick(entry)
+                    next_at += period
+                    behind = loop.time() - next_at
+                    if behind > 0:
+                        missed = int(behind // period) + 1
+                        self.skipped += missed
+                        next_at += missed * period
+                except Exception as error:
+                    failures += 1
+                    self.errors += 1
+                    Metrics.inc("stock_feed_errors_total")
+                    backoff = min(2 ** (failures - 1), self.PHASE_CHECK_INTERVAL)
+                    print(f"Feed error (retrying in {backoff}s): {error}")
+                    await asyncio.sleep(backoff)
+            if self.lost_lease:
+                print(f"Feed {self.feed_id} lost its lease to another feed; stopping")
+        finally:
+            await sync_to_async(self.release_lease)()
+
+    async def tick(self, period, lag=0.0):
+        """
+        Fetch and publish one tick
+
+        Args:
+            period: Current period in seconds (the fetch deadline is 80% of it)
+            lag: Seconds the tick started after its scheduled time
+
+        Returns:
+            dict: RunHistory entry, or None when another feed holds the lease
+        """
+        deadline = period * 0.8
+        if not await sync_to_async(self.claim_lease)(busy=deadline):
+            return None
+        started = time.perf_counter()
+        universe = await sync_to_async(PollService.universe)(self.configured)
+        results = await AsyncStockDataService.fetch_stocks_data_coalesced(
+            universe, deadline_at=time.monotonic() + deadline
+        )
+        return await sync_to_async(self.publish)(universe, results, started, lag)
+
+    def publish(self, universe, results, started, lag):
+        """
+        Publish a tick, keeping the last good row of tickers that failed this time
+
+        A missed deadline on a short period must not blank out a quote clients
+        already have.
+        """
+        previous = StockBroadcastService.get_snapshot()["stocks"]
+        stocks_data = []
+        for ticker in universe:
+            stock_data = results[ticker]
+            if "error" in stock_data and "error" not in previous.get(ticker, stock_data):
+                stock_data = previous[ticker]
+            stocks_data.append(stock_data)
+        stocks_data.sort(key=lambda x: x.get('symbol', ''))
+
+        event = StockBroadcastService.publish(stocks_data)
+        return RunHistory.record(
+            self.HISTORY_NAME,
+            duration_ms=round((time.perf_counter() - started) * 1000, 1),
+            lag_ms=round(lag * 1000, 1),
+            tickers=len(stocks_data),
+            errors=sum(1 for ticker in universe if "error" in results[ticker]),
+            changed=len(event["data"]) + len(event["removed"]) if event else 0,
+            skipped=self.skipped,
+        )
@@ -0,0 +1,304 @@
+import asyncio
+import math
+import random
+import time
+import zlib
+from functools import lru_cache
+
+import yfinance as yf
+from yfinance.data import YfData
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class MarketDataProvider:
+    """
+    Upstream source of stock prices and fundamentals
+
+    StockDataService, AsyncStockDataService and FundamentalsService fetch
+    through the provider selected by STOCK_DATA_PROVIDER ("yfinance",
+    "simulated" or the dotted path of a MarketDataProvider subclass). Prices
+    and fundamentals use Yahoo Finance info keys ('currentPrice',
+    'previousClose', 'open', 'dayHigh', 'dayLow', 'volume'; see
+    FundamentalsService.FIELDS), so caching, coalescing and building of stock
+    rows stay the same whatever the source.
+    """
+
+    name = None
+
+    @staticmethod
+    def current():
+        """Return the provider class selected by STOCK_DATA_PROVIDER"""
+        name = getattr(settings, 'STOCK_DATA_PROVIDER', 'yfinance')
+        provider = PROVIDERS.get(name)
+        return provider if provider is not None else import_string(name)
+
+    @classmethod
+    def fetch_prices(cls, ticker):
+        """
+        Fetch live price fields for a single ticker
+
+        Returns:
+            dict: Info style price fields, empty if there is no data for the ticker
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def download_prices(cls, tickers):
+        """
+        Fetch live price fields for a chunk of tickers in one request
+
+        Returns:
+            dict: Ticker -> info style price fields; tickers without data are left out
+        """
+        return {ticker: prices for ticker in tickers if (prices := cls.fetch_prices(ticker))}
+
+    @classmethod
+    async def afetch_prices(cls, ticker):
+        """Async counterpart of fetch_prices (called on the event loop)"""
+        raise NotImplementedError
+
+    @classmethod
+    def fetch_fundamentals(cls, ticker):
+        """
+        Fetch the fundamentals of a single ticker
+
+        Returns:
+            dict: Info dictionary; keys outside FundamentalsService.FIELDS are ignored
+        """
+        raise NotImplementedError
+
+
+class YFinanceProvider(MarketDataProvider):
+    """
+    Yahoo Finance through yfinance and the quote API (threads) and the chart API (asyncio)
+    """
+
+    name = "yfinance"
+
+    CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/{ticker}"
+    QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/quote"
+    QUOTE_FIELDS = (
+        "regularMarketPrice", "regularMarketPreviousClose", "regularMarketOpen",
+        "regularMarketDayHigh", "regularMarketDayLow", "regularMarketVolume",
+    )
+
+    @classmethod
+    def fetch_prices(cls, ticker):
+        from .utilities import FetchPool, StockDataService
+
+        # Five days so that the previous close is available across weekends and holidays
+        hist = yf.Ticker(ticker, session=FetchPool.session()).history(period="5d", auto_adjust=False)
+        return StockDataService.prices_from_bars(hist)
+
+    @classmethod
+    def download_prices(cls, tickers):
+        from .utilities import FetchPool, StockDataService
+
+        # One request for the whole chunk (yf.download would issue one history request per ticker);
+        # YfData adds the cookie and crumb the quote endpoint requires
+        response = YfData(session=FetchPool.session()).get_raw_json(
+            cls.QUOTE_URL,
+            params={"symbols": ",".join(tickers), "fields": ",".join(cls.QUOTE_FIELDS), "formatted": "false"},
+            timeout=getattr(settings, 'STOCK_FETCH_CHUNK_TIMEOUT', 20),
+        )
+        requested = set(tickers)
+        prices = {}
+        for quote in (response.get("quoteResponse") or {}).get("result") or []:
+            fields = StockDataService.prices_from_quote(quote)
+            if quote.get("symbol") in requested and fields:
+                prices[quote["symbol"]] = fields
+        return prices
+
+    @classmethod
+    async def afetch_prices(cls, ticker):
+        from .utilities import AsyncStockDataService
+
+        response = await AsyncStockDataService.session().get(
+            cls.CHART_URL.format(ticker=ticker),
+            params={"range": "5d", "interval": "1d"},
+        )
+        return AsyncStockDataService.prices_from_chart(response.json())
+
+    @classmethod
+    def fetch_fundamentals(cls, ticker):
+        from .utilities import FetchPool
+
+        return yf.Ticker(ticker, session=FetchPool.session()).info or {}
+
+
+class SimulatedProviderError(Exception):
+    """Upstream failure injected by SimulatedProvider (STOCK_SIMULATOR_ERROR_RATE)"""
+
+
+class SimulatedProvider(MarketDataProvider):
+    """
+    Offline provider of geometric Brownian motion prices
+
+    Every ticker (the synthetic SIM0001.NS ... names from tickers(), or any
+    other symbol) follows its own GBM path seeded by STOCK_SIMULATOR_SEED and
+    the ticker, advancing one step every STOCK_SIMULATOR_STEP seconds of wall
+    clock time. A price depends only on (seed, ticker, step): every process
+    sees the same path, and runs with the same seed are reproducible. The
+    Brownian motion at a step is drawn by bisecting a Brownian bridge over a
+    span of 2**24 steps, so a quote costs about 24 draws however far into the
+    path it is, and paths restart (with a new seed) after each span.
+
+    Every request sleeps STOCK_SIMULATOR_LATENCY seconds (+/- the jitter
+    share) and fails with SimulatedProviderError with probability
+    STOCK_SIMULATOR_ERROR_RATE, so the fetch stack can be measured with
+    upstream behaviour under control.
+    """
+
+    name = "simulated"
+
+    SPAN_BITS = 24
+    TRADING_STEPS_PER_YEAR = 252 * 6.25 * 3600
+
+    # Request latency and error injection draws (not part of the price paths)
+    _noise = random.Random()
+
+    @staticmethod
+    def _setting(name, default):
+        return getattr(settings, f'STOCK_SIMULATOR_{name}', default)
+
+    @classmethod
+    def tickers(cls, count=None):
+        """Synthetic ticker symbols (STOCK_SIMULATOR_TICKERS of them by default)"""
+        count = cls._setting('TICKERS', 500) if count is None else count
+        return [f"SIM{index:04d}.NS" for index in range(1, count + 1)]
+
+    @classmethod
+    def step(cls, moment=None):
+        """Path step of a time.time() moment (default: now)"""
+        return int((time.time() if moment is None else moment) / cls._setting('STEP', 1))
+
+    @staticmethod
+    @lru_cache(maxsize=1 << 16)
+    def _draw(seed, ticker, era, low, high):
+        """Standard normal draw of one bridge interval (deterministic)"""
+        return random.Random(f"{seed}:{ticker}:{era}:{low}:{high}").gauss(0, 1)
+
+    @classmethod
+    def _brownian(cls, seed, ticker, step):
+        """Standard Brownian motion of ticker's path at step (in steps)"""
+        era, step = divmod(step, 1 << cls.SPAN_BITS)
+        low, high = 0, 1 << cls.SPAN_BITS
+        w_low, w_high = 0.0, math.sqrt(high) * cls._draw(seed, ticker, era, high, high)
+        while high - low > 1:
+            middle = (low + high) // 2
+            mean = (w_low + w_high) / 2
+            w_middle = mean + math.sqrt((high - low) / 4) * cls._draw(seed, ticker, era, low, high)
+            if step < middle:
+                high, w_high = middle, w_middle
+            else:
+                low, w_low = middle, w_middle
+        return w_low
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _profile(seed, ticker):
+        """Per-ticker constants: starting price, volatility scale, volume and fundamentals"""
+        rng = random.Random(f"{seed}:{ticker}:profile")
+        return {
+            "price": round(math.exp(rng.uniform(math.log(50), math.log(5000))), 2),
+            "volatility_scale": rng.uniform(0.5, 1.5),
+            "average_volume": int(math.exp(rng.uniform(math.log(1e5), math.log(2e7)))),
+            "shares": int(math.exp(rng.uniform(math.log(1e8), math.log(1e10)))),
+            "pe": rng.uniform(8, 80),
+            "dividend_yield": rng.uniform(0, 0.04),
+            "beta": rng.uniform(0.5, 1.6),
+        }
+
+    @classmethod
+    def price(cls, ticker, step):
+        """
+        GBM price of ticker at step
+
+        Args:
+            ticker: Stock ticker symbol
+            step: Path step (see step())
+
+        Returns:
+            float: S0 * exp((mu - sigma^2 / 2) * t + sigma * W(t)), t in years
+        """
+        seed = cls._setting('SEED', 0)
+        profile = cls._profile(seed, ticker)
+        dt = cls._setting('STEP', 1) / cls.TRADING_STEPS_PER_YEAR
+        sigma = profile["volatility_scale"] * cls._setting('VOLATILITY', 0.3)
+        mu = cls._setting('DRIFT', 0.05)
+        t = (step % (1 << cls.SPAN_BITS)) * dt
+        return profile["price"] * math.exp(
+            (mu - sigma * sigma / 2) * t + sigma * math.sqrt(dt) * cls._brownian(seed, ticker, step)
+        )
+
+    @classmethod
+    def prices_at(cls, ticker, moment=None):
+        """
+        Info style price fields of ticker at a time.time() moment (default: now)
+
+        The session opens at the start of the UTC day and the previous close is
+        the last step of the day before. The day's high and low only span the
+        open and current prices.
+        """
+        moment = time.time() if moment is None else moment
+        step = cls.step(moment)
+        day_start = cls.step(moment - moment % 86400)
+        current, open_ = cls.price(ticker, step), cls.price(ticker, day_start)
+        profile = cls._profile(cls._setting('SEED', 0), ticker)
+        return {
+            "currentPrice": current,
+            "previousClose": cls.price(ticker, day_start - 1),
+            "open": open_,
+            "dayHigh": max(open_, current),
+            "dayLow": min(open_, current),
+            "volume": int(profile["average_volume"] * (moment % 86400) / 86400),
+        }
+
+    @classmethod
+    def _request(cls, description):
+        """Latency to sleep for a request, after injecting its error"""
+        if cls._noise.random() < cls._setting('ERROR_RATE', 0.0):
+            raise SimulatedProviderError(f"Simulated upstream error fetching {description}")
+        latency = cls._setting('LATENCY', 0.05)
+        jitter = cls._setting('LATENCY_JITTER', 0.5)
+        return max(0.0, latency * cls._noise.uniform(1 - jitter, 1 + jitter))
+
+    @classmethod
+    def fetch_prices(cls, ticker):
+        time.sleep(cls._request(ticker))
+        return cls.prices_at(ticker)
+
+    @classmethod
+    def download_prices(cls, tickers):
+        time.sleep(cls._request(f"{len(tickers)} tickers"))
+        moment = time.time()
+        return {ticker: cls.prices_at(ticker, moment) for ticker in tickers}
+
+    @classmethod
+    async def afetch_prices(cls, ticker):
+        await asyncio.sleep(cls._request(ticker))
+        return cls.prices_at(ticker)
+
+    @classmethod
+    def fetch_fundamentals(cls, ticker):
+        time.sleep(cls._request(ticker))
+        profile = cls._profile(cls._setting('SEED', 0), ticker)
+        price = cls.prices_at(ticker)["currentPrice"]
+        symbol = ticker.replace('.NS', '')
+        # 52-week range from a deterministic hash of the ticker, around the current price
+        spread = 0.1 + (zlib.crc32(ticker.encode()) % 30) / 100
+        return {
+            "longName": f"Simulated {symbol} Ltd",
+            "shortName": symbol,
+            "averageVolume": profile["average_volume"],
+            "marketCap": int(profile["shares"] * price),
+            "fiftyTwoWeekHigh": price * (1 + spread),
+            "fiftyTwoWeekLow": price * (1 - spread),
+            "trailingPE": profile["pe"],
+            "dividendYield": profile["dividend_yield"],
+            "beta": profile["beta"],
+        }
+
+
+PROVIDERS = {provider.name: provider for provider in (YFinanceProvider, SimulatedProvider)}
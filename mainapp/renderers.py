@@ -0,0 +1,68 @@
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .wire_formats import WireFormat
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline-delimited JSON: one JSON document per line
+    """
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return self.render_event(data)
+
+    @staticmethod
+    def render_event(data, event=None):
+        """Encode one document as a line; the event name is implied by the payload"""
+        return json.dumps(data).encode("utf-8") + b"\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Server-Sent Events: one named event per document
+    """
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get("response")
+        event = "error" if response is not None and response.status_code >= 400 else "message"
+        return self.render_event(data, event=event)
+
+    @staticmethod
+    def render_event(data, event=None):
+        """Encode one document as an SSE event"""
+        payload = f"data: {json.dumps(data)}\n\n".encode("utf-8")
+        if event:
+            payload = f"event: {event}\n".encode("utf-8") + payload
+        return payload
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """
+    JSON with the stock rows in columnar form (?format=columnar)
+
+    data.stocks becomes {"fields": [...], "columns": [[...], ...]}: every field
+    name is sent once instead of once per row (see WireFormat.columns), which
+    more than halves responses with hundreds of stocks. Other documents render
+    as plain JSON.
+    """
+    media_type = "application/vnd.stocktracker.columnar+json"
+    format = "columnar"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(self.columnar(data), accepted_media_type, renderer_context)
+
+    @staticmethod
+    def columnar(data):
+        """Copy of a default_response envelope with its stock rows in columnar form"""
+        payload = data.get("data") if isinstance(data, dict) else None
+        if not isinstance(payload, dict) or not isinstance(payload.get("stocks"), list):
+            return data
+        return {**data, "data": {**payload, "stocks": WireFormat.columns(payload["stocks"])}}
@@ -10,6 +10,12 @@ class StockDataRequestSerializer(serializers.Serializer):
         required=True,
         help_text="List of stock symbols (e.g., ['RELIANCE.NS', 'TCS.NS'])"
     )
+    deadline_ms = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=60000,
+        help_text="Optional total latency budget in milliseconds; stocks not fetched in time are returned with an error"
+    )
     
     def validate_stocks(self, value):
         """
@@ -1,37 +1,134 @@
+import time
+
 from celery import shared_task
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from .utilities import StockDataService
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from .broadcast import StockBroadcastService
+from .polling import FeedRunner, PollScheduler, PollService
+from .utilities import StockDataService, FundamentalsService, FetchPool, RunHistory
 
 
-@shared_task(bind=True)
+@worker_process_shutdown.connect
+def shutdown_fetch_pool(**kwargs):
+    """Release the shared fetch executor and HTTP session when a worker process exits"""
+    FetchPool.shutdown()
+
+
+# Only compact run metadata is kept (RunHistory) unless STOCK_TASK_RESULTS = "full"
+@shared_task(bind=True, ignore_result=getattr(settings, 'STOCK_TASK_RESULTS', 'metadata') != 'full')
 def fetch_stocks_data_task(self, stocks_list):
     """
     Background task to fetch stock data for a list of stock tickers
     and broadcast it to connected WebSocket clients
     
+    The latest data lives in the broadcast snapshot; each run records its
+    duration, ticker count and error count in RunHistory.
+    
     Args:
         self: Task instance (from bind=True)
         stocks_list: List of stock ticker symbols (e.g., ['RELIANCE.NS', 'TCS.NS'])
         
     Returns:
-        list: List of stock data dictionaries, sorted by symbol
+        list: List of stock data dictionaries, sorted by symbol, when
+              STOCK_TASK_RESULTS = "full"; otherwise the run metadata
     """
     try:
-        stocks_data = StockDataService.fetch_stocks_data(stocks_list)
+        started = time.perf_counter()
+        # Broadcasts must not lag a tick behind, so every quote is fetched upstream (and re-cached)
+        stocks_data = StockDataService.fetch_stocks_data(stocks_list, refresh=True)
         
-        # Broadcast stock data to connected WebSocket clients
-        channel_layer = get_channel_layer()
-        if channel_layer:
-            async_to_sync(channel_layer.group_send)(
-                "stock_updates",
-                {
-                    "type": "stock_update",
-                    "stock_data": stocks_data
-                }
-            )
+        # Broadcast the changes since the last tick to connected WebSocket clients
+        event = StockBroadcastService.publish(stocks_data)
         
-        return stocks_data
+        run = RunHistory.record(
+            self.name,
+            duration_ms=round((time.perf_counter() - started) * 1000, 1),
+            tickers=len(stocks_data),
+            errors=sum(1 for stock_data in stocks_data if "error" in stock_data),
+            changed=len(event["data"]) + len(event["removed"]) if event else 0,
+        )
+        if getattr(settings, 'STOCK_TASK_RESULTS', 'metadata') == 'full':
+            return [dict(stock_data) for stock_data in stocks_data]
+        return run
     except Exception as e:
         # Log the error and re-raise so Celery can handle retries
         raise Exception(f"Error fetching stock data: {str(e)}")
+
+
+@shared_task(bind=True)
+def fetch_fundamentals_task(self, stocks_list):
+    """
+    Background task to refresh cached fundamentals (name, market cap, 52-week range,
+    PE, dividend yield, beta) for a list of stock tickers plus every subscribed ticker
+    
+    Args:
+        self: Task instance (from bind=True)
+        stocks_list: List of stock ticker symbols (e.g., ['RELIANCE.NS', 'TCS.NS'])
+        
+    Returns:
+        list: Tickers whose fundamentals could not be fetched
+    """
+    try:
+        # Subscribed tickers are polled too; refresh them so they don't expire into the hot path
+        fundamentals = FundamentalsService.refresh_fundamentals(PollService.universe(stocks_list))
+        return [ticker for ticker, data in fundamentals.items() if not data]
+    except Exception as e:
+        raise Exception(f"Error fetching fundamentals: {str(e)}")
+
+
+@shared_task(bind=True, ignore_result=True)
+def poll_stocks_task(self, configured_stocks):
+    """
+    Beat task: fetch and broadcast the polled universe (configured plus subscribed
+    tickers), fanned out in chunks across workers
+    
+    A single-chunk universe is fetched inline; otherwise one fetch_stocks_chunk_task
+    per chunk is queued, and the last one to finish publishes the merged tick.
+    Skipped while manage.py run_feed is running.
+    
+    Args:
+        self: Task instance (from bind=True)
+        configured_stocks: Always-polled ticker symbols
+    """
+    # manage.py run_feed replaces the beat while it runs
+    if FeedRunner.active():
+        return
+    # The beat fires at the fastest cadence; PollScheduler decides whether a poll is due
+    if not PollScheduler.claim():
+        return
+    started_at = time.time()
+    universe = PollService.universe(configured_stocks)
+    chunks = PollService.chunks(universe)
+    if not chunks:
+        return
+    tick = PollService.start_tick(len(chunks))
+    if len(chunks) == 1:
+        fetch_stocks_chunk_task(tick, 0, 1, chunks[0], started_at)
+        return
+    # A chunk that cannot start within one period belongs to a superseded tick
+    expires = getattr(settings, 'STOCK_POLL_INTERVAL', 10)
+    for index, chunk in enumerate(chunks):
+        fetch_stocks_chunk_task.apply_async((tick, index, len(chunks), chunk, started_at), expires=expires)
+
+
+@shared_task(bind=True, ignore_result=True)
+def fetch_stocks_chunk_task(self, tick, index, chunk_count, stocks_list, started_at):
+    """
+    Fetch one chunk of a poll tick; the tick's last chunk publishes the merged result
+    
+    Args:
+        self: Task instance (from bind=True)
+        tick: Tick number from PollService.start_tick
+        index: Chunk index within the tick
+        chunk_count: Number of chunks in the tick
+        stocks_list: Ticker symbols of this chunk
+        started_at: Epoch seconds when the tick was started
+    """
+    try:
+        # A cached quote younger than QUOTE_CACHE_TTL would be re-broadcast unchanged
+        stocks_data = StockDataService.fetch_stocks_data(stocks_list, refresh=True)
+        merged = PollService.complete_chunk(tick, index, chunk_count, stocks_data)
+        if merged is not None:
+            PollService.publish_tick(tick, merged, started_at, chunk_count)
+    except Exception as e:
+        raise Exception(f"Error fetching stock data: {str(e)}")
@@ -1,3 +1,951 @@
-from django.test import TestCase
+import asyncio
+import itertools
+import pickle
+import threading
+import time
+from datetime import datetime
+from unittest import mock
 
-# Create your tests here.
+import pytz
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.test import Client, RequestFactory, SimpleTestCase, override_settings
+
+from .broadcast import StockBroadcastService, SubscriptionRegistry
+from .consumers import DeltaBuffer, StockConsumer
+from .metrics import Metrics
+from .middleware import RequestTiming, ServerTimingMiddleware
+from .polling import FeedRunner, PollService
+from .providers import SimulatedProvider
+from .utilities import (
+    AsyncStockDataService, FetchPool, FundamentalsService, LatencyTracker, QuoteCache, SingleFlight, StockDataService,
+    StockQuote, TimeUtility,
+)
+
+# No Redis needed: tests run on an in-memory cache and channel layer and record no metrics
+LOCAL_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "tests"}}
+LOCAL_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_DATA_PROVIDER="simulated",
+    STOCK_SIMULATOR_LATENCY=0.3,
+    STOCK_SIMULATOR_LATENCY_JITTER=0,
+    STOCK_FETCH_MAX_WORKERS=2,
+)
+class FetchPoolTests(SimpleTestCase):
+    """FetchPool.iter_results timeouts, hedging and cancellation against SimulatedProvider"""
+
+    def setUp(self):
+        # The executor is sized on first use: start from a fresh one with STOCK_FETCH_MAX_WORKERS threads
+        FetchPool.shutdown()
+        LatencyTracker._samples.clear()
+        self.started = 0
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        FetchPool.shutdown()
+        LatencyTracker._samples.clear()
+
+    def fetch_prices(self, ticker):
+        with self.lock:
+            self.started += 1
+        return SimulatedProvider.fetch_prices(ticker)
+
+    def calls(self, count):
+        return {ticker: (self.fetch_prices, (ticker,)) for ticker in SimulatedProvider.tickers(count)}
+
+    @override_settings(STOCK_HEDGE_ENABLED=False)
+    def test_timeout_counts_from_call_start(self):
+        # 10 calls of 0.3s on 2 threads take 1.5s in total, but no single call is slow
+        results = list(FetchPool.iter_results(self.calls(10), "test", timeout=1))
+        self.assertEqual(len(results), 10)
+        self.assertEqual([key for key, result, error in results if error is not None], [])
+
+    @override_settings(STOCK_HEDGE_ENABLED=False)
+    def test_timeout_reports_slow_calls(self):
+        started = time.monotonic()
+        results = list(FetchPool.iter_results(self.calls(2), "test", timeout=0.1))
+        self.assertLess(time.monotonic() - started, 0.3)
+        self.assertTrue(all(isinstance(error, TimeoutError) for key, result, error in results))
+
+    @override_settings(STOCK_HEDGE_MIN_DELAY=0.05, STOCK_HEDGE_MAX_FRACTION=0.2)
+    def test_hedges_running_calls_only_up_to_the_cap(self):
+        for _ in range(20):
+            LatencyTracker.record("test", 0.01)
+        results = list(FetchPool.iter_results(self.calls(10), "test"))
+        self.assertEqual(len(results), 10)
+        self.assertEqual([key for key, result, error in results if error is not None], [])
+        time.sleep(0.5)
+        # 10 calls plus at most 2 hedges, and no duplicate of a queued call runs after the batch
+        self.assertLessEqual(self.started, 12)
+
+    @override_settings(STOCK_HEDGE_ENABLED=False)
+    def test_deadline_cancels_queued_calls(self):
+        results = list(FetchPool.iter_results(self.calls(10), "test", deadline_at=time.monotonic() + 0.4))
+        self.assertEqual(len(results), 10)
+        self.assertTrue(any(isinstance(error, TimeoutError) for key, result, error in results))
+        time.sleep(0.8)
+        # Only the calls that had started by the deadline ever reach the provider
+        self.assertLessEqual(self.started, 4)
+
+    @override_settings(STOCK_HEDGE_ENABLED=False)
+    def test_stopping_early_cancels_remaining_calls(self):
+        results = FetchPool.iter_results(self.calls(10), "test")
+        next(results)
+        results.close()
+        time.sleep(0.8)
+        self.assertLessEqual(self.started, 4)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_DATA_PROVIDER="simulated",
+    STOCK_SIMULATOR_LATENCY=0.3,
+    STOCK_SIMULATOR_LATENCY_JITTER=0,
+    ASYNC_FETCH_CONCURRENCY=2,
+)
+class AsyncFetchTimeoutTests(SimpleTestCase):
+    """AsyncStockDataService timeouts count from the upstream request, the deadline from the start"""
+
+    TICKERS = SimulatedProvider.tickers(10)
+
+    def fetch(self, deadline_at=None):
+        semaphore = asyncio.Semaphore(2)
+
+        async def gather():
+            return await asyncio.gather(
+                *(AsyncStockDataService.fetch_prices(ticker, semaphore, 1, deadline_at) for ticker in self.TICKERS),
+                return_exceptions=True,
+            )
+
+        return async_to_sync(gather)()
+
+    def test_timeout_excludes_the_semaphore_wait(self):
+        # 10 requests of 0.3s on 2 slots take 1.5s in total, but no single request is slow
+        results = self.fetch()
+        self.assertTrue(all(isinstance(result, dict) and result for result in results))
+
+    def test_deadline_bounds_the_semaphore_wait(self):
+        started = time.monotonic()
+        results = self.fetch(deadline_at=time.monotonic() + 0.4)
+        self.assertLess(time.monotonic() - started, 0.6)
+        errors = [str(result) for result in results if isinstance(result, asyncio.TimeoutError)]
+        self.assertEqual(len(errors), 8)
+        self.assertTrue(all(error.startswith("Deadline exceeded fetching") for error in errors))
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_DATA_PROVIDER="simulated",
+    STOCK_SIMULATOR_LATENCY=0,
+    STOCK_HEDGE_ENABLED=False,
+)
+class FundamentalsDeadlineTests(SimpleTestCase):
+    """Fundamentals cache misses are fetched within the request deadline"""
+
+    TICKERS = SimulatedProvider.tickers(4)
+
+    def setUp(self):
+        cache.clear()
+        QuoteCache.clear()
+        FetchPool.shutdown()
+
+    def tearDown(self):
+        FetchPool.shutdown()
+
+    @staticmethod
+    def slow_fundamentals(ticker):
+        time.sleep(1)
+        return {"shortName": ticker}
+
+    def assert_prices_within_deadline(self, fetch):
+        started = time.monotonic()
+        with mock.patch.object(SimulatedProvider, "fetch_fundamentals", side_effect=self.slow_fundamentals):
+            stocks_data = fetch()
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(len(stocks_data), len(self.TICKERS))
+        # Prices without fundamentals rather than a late response
+        self.assertTrue(all(row.get("current_price") and row["name"] == "N/A" for row in stocks_data))
+
+    def test_sync_path_serves_prices_when_fundamentals_are_slow(self):
+        self.assert_prices_within_deadline(lambda: StockDataService.fetch_stocks_data(self.TICKERS, deadline=0.3))
+
+    def test_async_path_serves_prices_when_fundamentals_are_slow(self):
+        fetch = async_to_sync(AsyncStockDataService.fetch_stocks_data)
+        self.assert_prices_within_deadline(lambda: fetch(self.TICKERS, deadline=0.3))
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_DATA_PROVIDER="simulated",
+    STOCK_SIMULATOR_LATENCY=0,
+    STOCK_SIMULATOR_STEP=0.001,
+    STOCK_SIMULATOR_VOLATILITY=20,
+    QUOTE_CACHE_TTL=60,
+)
+class QuoteCacheRefreshTests(SimpleTestCase):
+    """Poll ticks fetch upstream even when QuoteCache holds a fresh quote"""
+
+    TICKERS = SimulatedProvider.tickers(3)
+
+    def setUp(self):
+        cache.clear()
+        QuoteCache.clear()
+
+    def prices(self, **kwargs):
+        return {row["ticker"]: row["current_price"] for row in StockDataService.fetch_stocks_data(self.TICKERS, **kwargs)}
+
+    def test_refresh_bypasses_fresh_cache_entries(self):
+        cached = self.prices()
+        time.sleep(0.05)
+        self.assertEqual(self.prices(allow_stale=False), cached)
+        refreshed = self.prices(refresh=True)
+        self.assertNotEqual(refreshed, cached)
+        # The refreshed quotes are what REST readers get next
+        self.assertEqual(self.prices(), refreshed)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_DATA_PROVIDER="simulated",
+    STOCK_SIMULATOR_LATENCY=0,
+    QUOTE_CACHE_TTL=0.2,
+    QUOTE_CACHE_STALE_TTL=0.3,
+)
+class QuoteCacheStaleWhileRevalidateTests(SimpleTestCase):
+    """Stale quotes are served at once and refreshed by a single background fetch"""
+
+    TICKERS = SimulatedProvider.tickers(3)
+
+    def setUp(self):
+        cache.clear()
+        QuoteCache.clear()
+        QuoteCache._revalidating.clear()
+        self.fetched = []
+        uncached = StockDataService.iter_stocks_data_uncached
+
+        def slow_uncached(tickers, deadline_at=None):
+            # Keeps a revalidation in flight while the test reads
+            self.fetched.append(sorted(tickers))
+            time.sleep(0.1)
+            yield from uncached(tickers, deadline_at=deadline_at)
+
+        patcher = mock.patch.object(StockDataService, "iter_stocks_data_uncached", side_effect=slow_uncached)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self, **kwargs):
+        return StockDataService.fetch_stocks_data(self.TICKERS, **kwargs)
+
+    def wait_for_revalidation(self):
+        deadline = time.monotonic() + 2
+        while QuoteCache._revalidating and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_stale_reads_trigger_one_revalidation(self):
+        first = self.fetch()
+        time.sleep(0.25)
+        started = time.monotonic()
+        reads = [self.fetch() for _ in range(5)]
+        # Served from the cache without waiting for upstream
+        self.assertLess(time.monotonic() - started, 0.1)
+        for rows in reads:
+            self.assertTrue(all(row["stale"] for row in rows))
+            self.assertEqual([row["current_price"] for row in rows], [row["current_price"] for row in first])
+
+        self.wait_for_revalidation()
+        self.assertEqual(self.fetched, [sorted(self.TICKERS)] * 2)
+        self.assertFalse(any("stale" in row for row in self.fetch()))
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_quotes_past_the_stale_window_are_fetched(self):
+        self.fetch()
+        time.sleep(0.55)
+        rows = self.fetch()
+        self.assertFalse(any("stale" in row for row in rows))
+        self.assertEqual(len(self.fetched), 2)
+        self.assertFalse(QuoteCache._revalidating)
+
+    def test_stale_quotes_are_refetched_when_not_allowed(self):
+        self.fetch()
+        time.sleep(0.25)
+        rows = self.fetch(allow_stale=False)
+        self.assertFalse(any("stale" in row for row in rows))
+        self.assertEqual(len(self.fetched), 2)
+        self.assertFalse(QuoteCache._revalidating)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_DATA_PROVIDER="simulated",
+    STOCK_SIMULATOR_LATENCY=0,
+    SINGLE_FLIGHT_LEASE_TIMEOUT=1,
+)
+class SingleFlightTests(SimpleTestCase):
+    """Concurrent fetches of a ticker share one upstream call, within and across processes"""
+
+    TICKER = "TCS.NS"
+
+    def setUp(self):
+        cache.clear()
+        QuoteCache.clear()
+        self.fetched = []
+        self.lock = threading.Lock()
+        uncached = StockDataService.iter_stocks_data_uncached
+
+        def slow_uncached(tickers, deadline_at=None):
+            if tickers:
+                with self.lock:
+                    self.fetched.append(list(tickers))
+            time.sleep(0.2)
+            yield from uncached(tickers, deadline_at=deadline_at)
+
+        patcher = mock.patch.object(StockDataService, "iter_stocks_data_uncached", side_effect=slow_uncached)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self):
+        return StockDataService.fetch_stocks_data([self.TICKER])[0]
+
+    def test_concurrent_callers_share_one_upstream_call(self):
+        barrier = threading.Barrier(30)
+        results = []
+
+        def fetch():
+            barrier.wait()
+            results.append(self.fetch())
+
+        threads = [threading.Thread(target=fetch) for _ in range(30)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.fetched, [[self.TICKER]])
+        self.assertEqual(len(results), 30)
+        self.assertTrue(all(result == results[0] and "error" not in result for result in results))
+        self.assertEqual(SingleFlight._in_flight, {})
+
+    def test_failed_owner_fails_its_waiters(self):
+        owned, _ = SingleFlight.claim([self.TICKER])
+        _, waiting = SingleFlight.claim([self.TICKER])
+        SingleFlight.resolve(owned, {})
+        with self.assertRaises(RuntimeError):
+            waiting[self.TICKER].result(timeout=0)
+        # The next caller owns a new fetch
+        owned, waiting = SingleFlight.claim([self.TICKER])
+        self.assertEqual((list(owned), waiting), ([self.TICKER], {}))
+        SingleFlight.resolve(owned, {self.TICKER: {}})
+
+    @override_settings(SINGLE_FLIGHT_REDIS_LEASE=True)
+    def test_waits_for_the_process_holding_the_lease(self):
+        cache.add(SingleFlight.lease_key(self.TICKER), "other", timeout=1)
+        quote = StockDataService.build_stock_data(self.TICKER, {"previousClose": 100.0}, 101.0)
+
+        def other_process():
+            time.sleep(0.2)
+            QuoteCache.set_many([quote])
+            cache.delete(SingleFlight.lease_key(self.TICKER))
+
+        thread = threading.Thread(target=other_process)
+        thread.start()
+        result = self.fetch()
+        thread.join()
+        self.assertEqual(result, quote)
+        self.assertEqual(self.fetched, [])
+
+    @override_settings(SINGLE_FLIGHT_REDIS_LEASE=True)
+    def test_expired_lease_is_fetched_by_the_waiter(self):
+        # The lease holder died without storing a quote
+        cache.add(SingleFlight.lease_key(self.TICKER), "other", timeout=1)
+        started = time.monotonic()
+        result = self.fetch()
+        self.assertGreaterEqual(time.monotonic() - started, 0.9)
+        self.assertNotIn("error", result)
+        self.assertEqual(self.fetched, [[self.TICKER]])
+        # Our own lease is released once the quote is stored
+        self.assertIsNone(cache.get(SingleFlight.lease_key(self.TICKER)))
+
+
+@override_settings(CACHES=LOCAL_CACHES, STOCK_METRICS_ENABLED=True)
+class FetchErrorMetricTests(SimpleTestCase):
+    """stock_fetch_errors_total labels only polled tickers, so clients cannot add series"""
+
+    def setUp(self):
+        cache.clear()
+        SubscriptionRegistry._counts.clear()
+        PollService._label_universe_at = None
+
+    def tearDown(self):
+        SubscriptionRegistry._counts.clear()
+        PollService._label_universe_at = None
+
+    def error_label(self, ticker):
+        with mock.patch.object(Metrics, "inc") as inc:
+            StockDataService.build_error_data(ticker, "error")
+        return inc.call_args.kwargs["ticker"]
+
+    def test_tickers_outside_the_polled_universe_are_other(self):
+        SubscriptionRegistry._counts.update(["SIM0001.NS"])
+        async_to_sync(SubscriptionRegistry.flush)()
+        self.assertEqual(self.error_label("TCS.NS"), "TCS.NS")
+        self.assertEqual(self.error_label("SIM0001.NS"), "SIM0001.NS")
+        self.assertEqual(self.error_label("RANDOM123.NS"), "other")
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_DATA_PROVIDER="simulated",
+    STOCK_SIMULATOR_LATENCY=0,
+    STOCK_POLL_CLOSED_INTERVAL=900,
+)
+class FeedRunnerLeaseTests(SimpleTestCase):
+    """The run_feed lease follows the phase-check interval, not the tick period"""
+
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch.object(FeedRunner, "PHASE_CHECK_INTERVAL", 0.1)
+    async def test_lease_outlives_sleeps_but_not_a_dead_feed(self):
+        runner = FeedRunner(SimulatedProvider.tickers(1), interval=900)
+        task = asyncio.create_task(runner.run())
+        await asyncio.sleep(0.6)
+        # Renewed while the feed sleeps through its 900s period
+        self.assertEqual(runner.published, 1)
+        self.assertTrue(await sync_to_async(FeedRunner.active)())
+
+        # A feed that dies without releasing the lease gives way to Celery beat within a few intervals
+        with mock.patch.object(FeedRunner, "release_lease"):
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertTrue(await sync_to_async(FeedRunner.active)())
+        await asyncio.sleep(0.4)
+        self.assertFalse(await sync_to_async(FeedRunner.active)())
+
+    @mock.patch.object(FeedRunner, "PHASE_CHECK_INTERVAL", 0.1)
+    async def test_failing_tick_does_not_stop_the_feed(self):
+        runner = FeedRunner(SimulatedProvider.tickers(1), interval=0.05, follow_market=False)
+        tick = runner.tick
+        calls = []
+
+        async def flaky_tick(period, lag=0.0):
+            calls.append(period)
+            if len(calls) == 1:
+                raise ConnectionError("Redis went away")
+            return await tick(period, lag)
+
+        with mock.patch.object(runner, "tick", side_effect=flaky_tick):
+            await asyncio.wait_for(runner.run(ticks=2), timeout=5)
+        self.assertEqual((runner.errors, runner.published), (1, 2))
+        self.assertFalse(await sync_to_async(FeedRunner.active)())
+
+    @mock.patch.object(FeedRunner, "PHASE_CHECK_INTERVAL", 0.1)
+    async def test_feed_stops_when_another_feed_takes_over(self):
+        runner = FeedRunner(SimulatedProvider.tickers(1), interval=900, follow_market=False)
+        task = asyncio.create_task(runner.run())
+        await asyncio.sleep(0.2)
+        self.assertEqual(runner.published, 1)
+        await sync_to_async(cache.set)(FeedRunner.LEASE_KEY, "other-feed")
+        await asyncio.wait_for(task, timeout=1)
+        self.assertTrue(runner.lost_lease)
+        # The other feed's lease is left alone
+        self.assertEqual(await sync_to_async(cache.get)(FeedRunner.LEASE_KEY), "other-feed")
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_FANOUT_MODE="channel_layer",
+    WS_ACK_WINDOW=2,
+    WS_MAX_CLIENT_LAG=0.5,
+)
+class StockConsumerFlowControlTests(SimpleTestCase):
+    """Deliveries to WebSocket clients that opted in to acks are paced by them"""
+
+    TICKERS = SimulatedProvider.tickers(3)
+
+    def setUp(self):
+        cache.clear()
+        self.price = 100.0
+
+    async def publish(self):
+        self.price += 1
+        rows = [{"symbol": ticker[:-3], "ticker": ticker, "current_price": self.price} for ticker in self.TICKERS]
+        return await sync_to_async(StockBroadcastService.publish)(rows)
+
+    async def connect(self, path="/ws/stock/?ack=1"):
+        await self.publish()
+        communicator = WebsocketCommunicator(StockConsumer.as_asgi(), path)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot["type"], "stock_update")
+        return communicator, snapshot
+
+    async def receive_frames(self, communicator):
+        """Every output the consumer has produced by now"""
+        await asyncio.sleep(0.1)
+        outputs = []
+        while not await communicator.receive_nothing(timeout=0.05):
+            outputs.append(await communicator.receive_output())
+        return outputs
+
+    async def test_client_that_does_not_ack_is_disconnected(self):
+        communicator, snapshot = await self.connect()
+        outputs = []
+        for _ in range(10):
+            await self.publish()
+            outputs += await self.receive_frames(communicator)
+        # The snapshot plus one delta fill the window; later deltas wait in the outbox until the client is dropped
+        frames = [output for output in outputs if output["type"] == "websocket.send"]
+        self.assertEqual(len(frames), 1)
+        self.assertIn({"type": "websocket.close", "code": 4008}, outputs)
+        await communicator.disconnect()
+
+    async def test_client_without_acks_is_not_paced(self):
+        communicator, snapshot = await self.connect("/ws/stock/")
+        outputs = []
+        for _ in range(10):
+            await self.publish()
+            outputs += await self.receive_frames(communicator)
+        # Acks are opt-in: every delta is delivered and the client is never dropped
+        self.assertEqual([output["type"] for output in outputs], ["websocket.send"] * 10)
+        await communicator.disconnect()
+
+    async def test_acked_client_receives_conflated_deltas(self):
+        communicator, snapshot = await self.connect()
+        for _ in range(5):
+            await self.publish()
+        # The first delta fits the window next to the snapshot
+        delta = await communicator.receive_json_from()
+        self.assertEqual((delta["type"], delta["seq"]), ("stock_delta", snapshot["seq"] + 1))
+        self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+        # Acking it releases the deltas buffered meanwhile, conflated into one
+        await communicator.send_json_to({"type": "ack", "seq": delta["seq"]})
+        delta = await communicator.receive_json_from()
+        self.assertEqual(delta["seq"], snapshot["seq"] + 5)
+        self.assertEqual({row["current_price"] for row in delta["data"]}, {self.price})
+        for _ in range(3):
+            await communicator.send_json_to({"type": "ack", "seq": delta["seq"]})
+            event = await self.publish()
+            delta = await communicator.receive_json_from()
+            self.assertEqual(delta["seq"], event["seq"])
+        await communicator.disconnect()
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_DATA_PROVIDER="simulated",
+    STOCK_SIMULATOR_LATENCY=0,
+    STOCK_FANOUT_MODE="channel_layer",
+)
+class StockConsumerSubscriptionTests(SimpleTestCase):
+    """Only valid, known tickers are subscribed and so added to the polled universe"""
+
+    def setUp(self):
+        cache.clear()
+        SubscriptionRegistry._counts.clear()
+
+    def tearDown(self):
+        SubscriptionRegistry._counts.clear()
+
+    async def subscribe(self, tickers):
+        communicator = WebsocketCommunicator(StockConsumer.as_asgi(), "/ws/stock/?tickers=SIM0001.NS")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())["type"], "subscriptions")
+        self.assertEqual((await communicator.receive_json_from())["type"], "stock_update")
+        await communicator.send_json_to({"type": "subscribe", "tickers": tickers})
+        reply = await communicator.receive_json_from()
+        await communicator.disconnect()
+        return reply
+
+    async def test_malformed_symbols_are_refused(self):
+        reply = await self.subscribe(["SIM0002.NS", "not a ticker", "x" * 40])
+        self.assertEqual(reply["type"], "error")
+        self.assertIn("Invalid stock symbols", reply["message"])
+        self.assertEqual(set(SubscriptionRegistry._counts), set())
+
+    async def test_unknown_symbols_are_refused(self):
+        # The provider had no fundamentals for this symbol (a cached failed lookup)
+        await sync_to_async(cache.set)(FundamentalsService.cache_key("NOSUCH.NS"), {})
+        reply = await self.subscribe(["SIM0002.NS", "NOSUCH.NS"])
+        self.assertEqual(reply["type"], "error")
+        self.assertIn("NOSUCH.NS", reply["message"])
+
+    async def test_known_symbols_are_normalised_and_subscribed(self):
+        reply = await self.subscribe([" sim0002.ns "])
+        self.assertEqual(reply, {"type": "subscriptions", "tickers": ["SIM0001.NS", "SIM0002.NS"]})
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_FANOUT_MODE="channel_layer",
+)
+class BroadcastGroupSendTests(SimpleTestCase):
+    """A tick sends to the firehose and subscribed groups only, on one event loop"""
+
+    TICKERS = SimulatedProvider.tickers(3)
+
+    def setUp(self):
+        cache.clear()
+        SubscriptionRegistry._counts.clear()
+
+    def tearDown(self):
+        SubscriptionRegistry._counts.clear()
+
+    def test_sends_to_subscribed_groups_on_one_loop(self):
+        SubscriptionRegistry._counts.update(self.TICKERS[:1])
+        async_to_sync(SubscriptionRegistry.flush)()
+        sends = []
+
+        async def group_send(group, message):
+            sends.append((group, asyncio.get_running_loop()))
+
+        rows = [{"symbol": ticker[:-3], "ticker": ticker, "current_price": 1.0} for ticker in self.TICKERS]
+        with mock.patch.object(get_channel_layer(), "group_send", side_effect=group_send):
+            StockBroadcastService.publish(rows)
+        groups = {group for group, loop in sends}
+        self.assertEqual(groups, {StockBroadcastService.GROUP_NAME, StockBroadcastService.group_for(self.TICKERS[0])})
+        self.assertEqual(len({loop for group, loop in sends}), 1)
+
+
+@override_settings(CACHES=LOCAL_CACHES, STOCK_METRICS_ENABLED=False, STOCK_FANOUT_MODE="channel_layer")
+class PublishOrderTests(SimpleTestCase):
+    """Overlapping publishers never broadcast the same seq, and stale ticks are dropped"""
+
+    TICKERS = SimulatedProvider.tickers(3)
+
+    def setUp(self):
+        cache.clear()
+        SubscriptionRegistry._counts.clear()
+
+    def rows(self, price):
+        return [{"symbol": ticker[:-3], "ticker": ticker, "current_price": price} for ticker in self.TICKERS]
+
+    def test_overlapping_ticks_publish_distinct_seqs_in_order(self):
+        compute_delta = StockBroadcastService.compute_delta
+        published = []
+
+        def slow_compute_delta(previous, current):
+            # Widen the window between reading the snapshot and storing the next one
+            time.sleep(0.02)
+            published.append(int(next(iter(current.values()))["current_price"]))
+            return compute_delta(previous, current)
+
+        ticks = [PollService.start_tick(1) for _ in range(6)]
+        threads = [
+            threading.Thread(target=PollService.publish_tick, args=(tick, self.rows(float(tick)), time.time(), 1))
+            for tick in ticks
+        ]
+        with mock.patch.object(StockBroadcastService, "compute_delta", side_effect=slow_compute_delta):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # Every published tick got its own seq, and no tick was published after a newer one
+        self.assertEqual(StockBroadcastService.get_snapshot()["seq"], len(published))
+        self.assertEqual(published, sorted(published))
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_FANOUT_MODE="channel_layer",
+)
+class StockQuoteTests(SimpleTestCase):
+    """Rows are compact StockQuotes internally and plain dicts wherever they are encoded"""
+
+    def setUp(self):
+        cache.clear()
+        SubscriptionRegistry._counts.clear()
+
+    def quote(self, ticker, price):
+        return StockDataService.build_stock_data(ticker, {"longName": ticker, "previousClose": 100.0}, price)
+
+    def test_quote_reads_like_the_row_dict(self):
+        quote = self.quote("TCS.NS", 101.0)
+        row = dict(quote)
+        self.assertIsInstance(quote, StockQuote)
+        self.assertEqual(list(row)[:3], ["symbol", "ticker", "name"])
+        self.assertEqual(quote, row)
+        self.assertEqual(quote["change"], 1.0)
+        self.assertNotIn("error", quote)
+
+        error = StockDataService.build_error_data("TCS.NS", "boom")
+        self.assertEqual(dict(error), {"symbol": "TCS", "ticker": "TCS.NS", "error": "boom"})
+        self.assertEqual(dict(error.replace(stale=True)), {**error, "stale": True})
+        with self.assertRaises(AttributeError):
+            error.symbol = "INFY"
+
+    def test_pickled_quotes_are_smaller_than_dicts(self):
+        quotes = [self.quote(ticker, 101.0) for ticker in SimulatedProvider.tickers(50)]
+        quotes.append(StockDataService.build_error_data("TCS.NS", "boom").replace(stale=True))
+        self.assertEqual(pickle.loads(pickle.dumps(quotes)), quotes)
+        self.assertLess(len(pickle.dumps(quotes)), len(pickle.dumps([dict(quote) for quote in quotes])))
+
+    @override_settings(WS_PREENCODED_FRAMES=False)
+    def test_broadcast_messages_hold_plain_dicts(self):
+        tickers = SimulatedProvider.tickers(2)
+        events = []
+
+        async def group_send(group, message):
+            events.append(message)
+
+        with mock.patch.object(get_channel_layer(), "group_send", side_effect=group_send):
+            StockBroadcastService.publish([self.quote(ticker, 101.0) for ticker in tickers])
+            StockBroadcastService.publish([self.quote(tickers[0], 102.0), self.quote(tickers[1], 101.0)])
+        message = StockBroadcastService.snapshot_message(StockBroadcastService.get_snapshot())
+
+        rows = [row for event in events for row in event["data"]] + message["data"]
+        self.assertEqual(len(rows), 2 + 1 + 2)
+        self.assertTrue(all(type(row) is dict for row in rows))
+        self.assertEqual(message["data"][0], dict(self.quote(tickers[0], 102.0)))
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_FANOUT_MODE="channel_layer",
+)
+class DeltaEncodingTests(SimpleTestCase):
+    """Broadcasts carry only changed tickers and fields, numbered by seq within an epoch"""
+
+    def setUp(self):
+        cache.clear()
+        SubscriptionRegistry._counts.clear()
+
+    @staticmethod
+    def row(ticker, price, **fields):
+        return {"symbol": ticker[:-3], "ticker": ticker, "current_price": price, "volume": 10, **fields}
+
+    @staticmethod
+    def apply(rows, event):
+        """A client's view of the rows after receiving event"""
+        rows = {ticker: dict(row) for ticker, row in rows.items() if ticker not in event["removed"]}
+        for row in event["data"]:
+            if row["ticker"] in event["replace"]:
+                rows[row["ticker"]] = dict(row)
+            else:
+                rows[row["ticker"]].update(row)
+        return rows
+
+    def test_compute_delta(self):
+        previous = {
+            "A.NS": self.row("A.NS", 1.0),
+            "B.NS": self.row("B.NS", 2.0),
+            "C.NS": self.row("C.NS", 3.0),
+            "E.NS": self.row("E.NS", 5.0),
+        }
+        current = {
+            "A.NS": self.row("A.NS", 1.5),
+            "B.NS": self.row("B.NS", 2.0),
+            "C.NS": self.row("C.NS", 3.0, stale=True),
+            "D.NS": self.row("D.NS", 4.0),
+        }
+        delta = StockBroadcastService.compute_delta(previous, current)
+        self.assertEqual(delta["data"], [
+            {"ticker": "A.NS", "current_price": 1.5},
+            current["C.NS"],
+            current["D.NS"],
+        ])
+        # Rows that gained or lost fields are sent whole, like new tickers
+        self.assertEqual(delta["replace"], ["C.NS", "D.NS"])
+        self.assertEqual(delta["removed"], ["E.NS"])
+        self.assertEqual(self.apply(previous, delta), current)
+
+    def test_seq_and_versions_advance_only_on_changes(self):
+        with mock.patch.object(get_channel_layer(), "group_send", new=mock.AsyncMock()):
+            first = StockBroadcastService.publish([self.row("A.NS", 1.0), self.row("B.NS", 2.0)])
+            unchanged = StockBroadcastService.publish([self.row("A.NS", 1.0), self.row("B.NS", 2.0)])
+            second = StockBroadcastService.publish([self.row("A.NS", 1.5), self.row("B.NS", 2.0)])
+            third = StockBroadcastService.publish([self.row("B.NS", 2.5)])
+
+        self.assertIsNone(unchanged)
+        self.assertEqual([first["seq"], second["seq"], third["seq"]], [1, 2, 3])
+        self.assertEqual(len({first["epoch"], second["epoch"], third["epoch"]}), 1)
+        # since: the version each changed ticker had before, for gap detection per ticker
+        self.assertEqual(first["since"], {"A.NS": None, "B.NS": None})
+        self.assertEqual(second["since"], {"A.NS": 1})
+        self.assertEqual(third["since"], {"B.NS": 1, "A.NS": 2})
+        snapshot = StockBroadcastService.get_snapshot()
+        self.assertEqual((snapshot["seq"], snapshot["versions"]), (3, {"B.NS": 3}))
+
+        # Replaying the deltas in seq order rebuilds the snapshot
+        rows = {}
+        for event in (first, second, third):
+            rows = self.apply(rows, event)
+        self.assertEqual(rows, snapshot["stocks"])
+
+
+class DeltaBufferTests(SimpleTestCase):
+    """Conflated deltas leave a client in the same state as the deltas one by one"""
+
+    @staticmethod
+    def delta(seq, data, replace=(), removed=()):
+        return seq, (lambda: (data, list(replace), list(removed)))
+
+    def test_single_delta_keeps_its_frame(self):
+        buffer = DeltaBuffer()
+        seq, parts = self.delta(1, [{"ticker": "A.NS", "current_price": 1.0}])
+        buffer.add(seq, parts, frame={"text_data": "frame-1"})
+        self.assertEqual(buffer.take(), ({"text_data": "frame-1"}, None))
+        self.assertFalse(buffer)
+
+    def test_conflated_replay_matches_sequential_replay(self):
+        rows = {
+            "A.NS": {"ticker": "A.NS", "current_price": 1.0, "volume": 10},
+            "B.NS": {"ticker": "B.NS", "current_price": 2.0, "volume": 20},
+        }
+        deltas = [
+            self.delta(2, [{"ticker": "A.NS", "current_price": 1.1}]),
+            self.delta(3, [{"ticker": "A.NS", "current_price": 1.2, "volume": 11, "stale": True}], replace=["A.NS"]),
+            self.delta(4, [{"ticker": "A.NS", "current_price": 1.3}], removed=["B.NS"]),
+            self.delta(5, [{"ticker": "C.NS", "current_price": 3.0}], replace=["C.NS"]),
+            self.delta(6, [{"ticker": "B.NS", "current_price": 2.5, "volume": 25}], replace=["B.NS"], removed=["C.NS"]),
+        ]
+        buffer = DeltaBuffer()
+        expected = rows
+        for index, (seq, parts) in enumerate(deltas):
+            # The first delta arrives pre-encoded and must be unfrozen by the next one
+            buffer.add(seq, parts, frame={"text_data": "frame"} if index == 0 else None)
+            data, replace, removed = parts()
+            expected = DeltaEncodingTests.apply(expected, {"data": data, "replace": replace, "removed": removed})
+
+        frame, message = buffer.take()
+        self.assertIsNone(frame)
+        self.assertEqual(message["seq"], 6)
+        self.assertEqual((message["replace"], message["removed"]), (["A.NS", "B.NS"], ["C.NS"]))
+        self.assertEqual(DeltaEncodingTests.apply(rows, message), expected)
+
+    def test_discard_drops_pending_changes(self):
+        buffer = DeltaBuffer()
+        buffer.add(*self.delta(1, [{"ticker": "A.NS", "current_price": 1.0}]), frame={"text_data": "frame-1"})
+        buffer.add(*self.delta(2, [{"ticker": "B.NS", "current_price": 2.0}], removed=["C.NS"]))
+        buffer.discard(["A.NS", "C.NS"])
+        frame, message = buffer.take()
+        self.assertEqual((message["data"], message["removed"]), ([{"ticker": "B.NS", "current_price": 2.0}], []))
+
+        buffer.add(*self.delta(3, [{"ticker": "A.NS", "current_price": 1.5}]))
+        buffer.discard(["A.NS"])
+        self.assertFalse(buffer)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS,
+    STOCK_METRICS_ENABLED=False,
+    STOCK_FANOUT_MODE="channel_layer",
+)
+class SnapshotEpochTests(SimpleTestCase):
+    """Clients recover when the broadcast snapshot is lost and seq restarts"""
+
+    TICKERS = SimulatedProvider.tickers(3)
+
+    def setUp(self):
+        cache.clear()
+        self.price = 100.0
+
+    async def publish(self):
+        self.price += 1
+        rows = [{"symbol": ticker[:-3], "ticker": ticker, "current_price": self.price} for ticker in self.TICKERS]
+        return await sync_to_async(StockBroadcastService.publish)(rows)
+
+    async def test_lost_snapshot_resyncs_clients(self):
+        for _ in range(5):
+            await self.publish()
+        communicator = WebsocketCommunicator(StockConsumer.as_asgi(), "/ws/stock/")
+        await communicator.connect()
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot["seq"], 5)
+
+        await sync_to_async(cache.delete)(StockBroadcastService.SNAPSHOT_KEY)
+        event = await self.publish()
+        self.assertEqual(event["seq"], 1)
+        # Without the epoch the client would drop every delta until seq passed 5
+        message = await communicator.receive_json_from()
+        self.assertEqual((message["type"], message["seq"]), ("stock_update", 1))
+        self.assertEqual({row["current_price"] for row in message["data"]}, {self.price})
+
+        event = await self.publish()
+        message = await communicator.receive_json_from()
+        self.assertEqual((message["type"], message["seq"]), ("stock_delta", event["seq"]))
+        await communicator.disconnect()
+
+    @override_settings(STOCK_SNAPSHOT_MIRROR_TTL=0)
+    def test_snapshot_etag_changes_with_the_epoch(self):
+        client = Client(HTTP_HOST="127.0.0.1")
+        async_to_sync(self.publish)()
+        etag = client.get("/stocks/snapshot/")["ETag"]
+        self.assertEqual(client.get("/stocks/snapshot/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        cache.delete(StockBroadcastService.SNAPSHOT_KEY)
+        self.price -= 1
+        async_to_sync(self.publish)()
+        # Same seq and rows as before the loss, but a new epoch
+        response = client.get("/stocks/snapshot/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+@override_settings(CACHES=LOCAL_CACHES, STOCK_METRICS_ENABLED=False, STOCK_POLL_ADAPTIVE=True)
+class SnapshotMaxAgeTests(SimpleTestCase):
+    """The snapshot max-age never outlasts the next market phase boundary"""
+
+    IST = pytz.timezone("Asia/Kolkata")
+
+    def setUp(self):
+        cache.clear()
+
+    def at(self, *args):
+        return self.IST.localize(datetime(*args))
+
+    def test_seconds_to_next_phase(self):
+        # Thursday 2026-10-15 (a trading day): pre-open, open and the evening before
+        self.assertEqual(TimeUtility.seconds_to_next_phase(self.at(2026, 10, 15, 9, 10)), 5 * 60)
+        self.assertEqual(TimeUtility.seconds_to_next_phase(self.at(2026, 10, 15, 8, 0)), 60 * 60)
+        # Friday after the post-close session: the weekend is skipped
+        self.assertEqual(TimeUtility.seconds_to_next_phase(self.at(2026, 10, 16, 16, 30)), (2 * 24 + 16.5) * 3600)
+
+    def test_closed_market_max_age_stops_at_the_pre_open(self):
+        with mock.patch.object(TimeUtility, "market_time", return_value=self.at(2026, 10, 15, 8, 59)):
+            response = Client(HTTP_HOST="127.0.0.1").get("/stocks/snapshot/")
+        self.assertEqual(response["Cache-Control"], "public, max-age=60")
+
+
+@override_settings(STOCK_PROFILE_SAMPLE_RATE=2, STOCK_PROFILE_PATHS=["/stocks/"])
+class ProfileSamplingTests(SimpleTestCase):
+    """Only requests to the exact STOCK_PROFILE_PATHS count towards the profiling sample"""
+
+    @mock.patch.object(ServerTimingMiddleware, "_requests", itertools.count(1))
+    def test_other_paths_do_not_use_up_samples(self):
+        middleware = ServerTimingMiddleware(lambda request: None)
+        factory = RequestFactory()
+        profiled = []
+        for path in ("/stocks/", "/stocks/async/", "/stocks/snapshot/", "/stocks/"):
+            request = factory.get(path)
+            started, token = middleware.begin(request)
+            RequestTiming.stop(token)
+            profiled.append(request.profile)
+        self.assertEqual(profiled, [False, False, False, True])
@@ -1,7 +1,11 @@
 from django.urls import path, include
-from .views import StocksView, websocket_test_view
+from .views import AsyncStocksView, MetricsView, StockSnapshotView, StocksView, websocket_test_view
 
 urlpatterns = [
     path('stocks/', StocksView.as_view(), name='stocks'),
+    path('stocks/async/', AsyncStocksView.as_view(), name='stocks-async'),
+    path('stocks/snapshot/', StockSnapshotView.as_view(), name='stocks-snapshot'),
     path('ws-test/', websocket_test_view, name='websocket_test'),
+    # No trailing slash: the default Prometheus metrics_path
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
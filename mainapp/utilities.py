@@ -1,9 +1,27 @@
+import asyncio
+import atexit
 import calendar
+import os
+import threading
+import time
+import weakref
 import pytz
-from datetime import datetime, date
+from asgiref.sync import sync_to_async
+from collections import Counter, OrderedDict, deque
+from collections.abc import Mapping
+from itertools import chain
+from datetime import datetime, date, timedelta
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
-import yfinance as yf
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from curl_cffi import requests as curl_requests
+from curl_cffi.requests import AsyncSession
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from .metrics import Metrics
+from .middleware import RequestTiming
+from .providers import MarketDataProvider
+from .wire_formats import WireFormat
 
 
 class TimeUtility:
@@ -53,6 +71,361 @@ class TimeUtility:
         formatted_time = current_time.strftime("%Y-%m-%dT%H:%M:%SZ")
         return formatted_time
 
+    @classmethod
+    def market_time(cls):
+        """
+        Returns current datetime in the exchange timezone (MARKET_TIMEZONE, Asia/Kolkata)
+        """
+        return timezone.now().astimezone(pytz.timezone(getattr(settings, 'MARKET_TIMEZONE', 'Asia/Kolkata')))
+
+    @classmethod
+    def is_market_holiday(cls, day):
+        """
+        Whether the exchange is closed all day: weekends, MARKET_ANNUAL_HOLIDAYS
+        (MM-DD) and MARKET_HOLIDAYS (YYYY-MM-DD)
+        """
+        if day.weekday() >= 5:
+            return True
+        if day.strftime("%m-%d") in getattr(settings, 'MARKET_ANNUAL_HOLIDAYS', ()):
+            return True
+        return day.isoformat() in getattr(settings, 'MARKET_HOLIDAYS', ())
+
+    @classmethod
+    def market_phase(cls, moment=None):
+        """
+        Trading phase of the exchange at a moment (default: now)
+        
+        Args:
+            moment: Timezone-aware datetime
+            
+        Returns:
+            str: "pre_open" (MARKET_PRE_OPEN to MARKET_OPEN), "open" (MARKET_OPEN to
+                 MARKET_CLOSE), "post_close" (MARKET_CLOSE to MARKET_POST_CLOSE) or
+                 "closed" (any other time, weekends and holidays)
+        """
+        if moment is None:
+            moment = cls.market_time()
+        else:
+            moment = moment.astimezone(pytz.timezone(getattr(settings, 'MARKET_TIMEZONE', 'Asia/Kolkata')))
+        if cls.is_market_holiday(moment.date()):
+            return "closed"
+        now = moment.strftime("%H:%M")
+        if getattr(settings, 'MARKET_PRE_OPEN', '09:00') <= now < getattr(settings, 'MARKET_OPEN', '09:15'):
+            return "pre_open"
+        if getattr(settings, 'MARKET_OPEN', '09:15') <= now < getattr(settings, 'MARKET_CLOSE', '15:30'):
+            return "open"
+        if getattr(settings, 'MARKET_CLOSE', '15:30') <= now < getattr(settings, 'MARKET_POST_CLOSE', '16:00'):
+            return "post_close"
+        return "closed"
+
+    @classmethod
+    def seconds_to_next_phase(cls, moment=None):
+        """
+        Seconds from a moment (default: now) until market_phase next changes
+        
+        Args:
+            moment: Timezone-aware datetime
+            
+        Returns:
+            float: Seconds until the next phase boundary on a trading day, or None if
+                   there is none within two weeks
+        """
+        market_tz = pytz.timezone(getattr(settings, 'MARKET_TIMEZONE', 'Asia/Kolkata'))
+        moment = cls.market_time() if moment is None else moment.astimezone(market_tz)
+        boundaries = [
+            getattr(settings, 'MARKET_PRE_OPEN', '09:00'),
+            getattr(settings, 'MARKET_OPEN', '09:15'),
+            getattr(settings, 'MARKET_CLOSE', '15:30'),
+            getattr(settings, 'MARKET_POST_CLOSE', '16:00'),
+        ]
+        for offset in range(15):
+            day = moment.date() + timedelta(days=offset)
+            if cls.is_market_holiday(day):
+                continue
+            for boundary in boundaries:
+                hour, minute = (int(part) for part in boundary.split(":"))
+                at = market_tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+                if at > moment:
+                    return (at - moment).total_seconds()
+        return None
+
+
+class FetchPool:
+    """
+    Process-wide resources shared by all upstream fetches
+    
+    A single thread pool (STOCK_FETCH_MAX_WORKERS threads) and a single keep-alive
+    curl_cffi session are created lazily on first use and reused by every request
+    and beat tick, instead of a new executor per call and a new session per
+    yf.Ticker. Tasks running on the executor must not submit to it and wait.
+    """
+    
+    _lock = threading.Lock()
+    _executor = None
+    _session = None
+
+    @classmethod
+    def executor(cls):
+        """Return the shared ThreadPoolExecutor, creating it on first use"""
+        if cls._executor is None:
+            with cls._lock:
+                if cls._executor is None:
+                    cls._executor = ThreadPoolExecutor(
+                        max_workers=getattr(settings, 'STOCK_FETCH_MAX_WORKERS', 10),
+                        thread_name_prefix="stock-fetch",
+                    )
+        return cls._executor
+
+    @classmethod
+    def session(cls):
+        """Return the shared curl_cffi session, creating it on first use"""
+        if cls._session is None:
+            with cls._lock:
+                if cls._session is None:
+                    # yfinance requires a curl_cffi session impersonating a browser
+                    cls._session = curl_requests.Session(impersonate="chrome")
+        return cls._session
+
+    @classmethod
+    def shutdown(cls):
+        """Stop the executor and close the session; both are recreated on next use"""
+        with cls._lock:
+            executor, cls._executor = cls._executor, None
+            session, cls._session = cls._session, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if session is not None:
+            session.close()
+
+
+    # Longest wait between checks while calls are still queued (their timeouts start when they run)
+    QUEUE_POLL_INTERVAL = 0.05
+
+    @classmethod
+    def iter_results(cls, calls, kind, timeout=None, deadline_at=None):
+        """
+        Run calls on the shared executor with timeouts and hedged duplicates
+        
+        A call's timeout runs from when a pool thread starts it, not from when it
+        was queued. Once a running call has taken longer than the
+        STOCK_HEDGE_PERCENTILE latency recently observed for its kind, a duplicate
+        is submitted and whichever finishes first wins; at most
+        STOCK_HEDGE_MAX_FRACTION of the calls are hedged. Calls still running when
+        their timeout or the deadline passes are reported as timed out (their
+        threads finish in the background); calls not started yet are cancelled,
+        as are leftover duplicates and every call once the caller stops iterating.
+        
+        Args:
+            calls: Dictionary of key -> (function, args tuple)
+            kind: Latency bucket used for hedging thresholds (e.g., 'ticker', 'chunk')
+            timeout: Seconds each call may take once started, or None for no limit
+            deadline_at: Absolute time.monotonic() by which every call must finish, or None
+            
+        Yields:
+            tuple: (key, result, error) in completion order; error is the raised
+                   exception (TimeoutError when the call missed its limit) or None
+        """
+        pending = set(calls)
+        if deadline_at is not None and deadline_at <= time.monotonic():
+            for key in pending:
+                yield key, None, TimeoutError(f"Deadline exceeded fetching {key}")
+            return
+
+        hedge_after = None
+        hedges_left = 0
+        if getattr(settings, 'STOCK_HEDGE_ENABLED', True):
+            threshold = LatencyTracker.percentile(kind, getattr(settings, 'STOCK_HEDGE_PERCENTILE', 95))
+            if threshold is not None:
+                hedge_after = max(threshold, getattr(settings, 'STOCK_HEDGE_MIN_DELAY', 0.25))
+                hedges_left = max(1, int(len(calls) * getattr(settings, 'STOCK_HEDGE_MAX_FRACTION', 0.1)))
+
+        executor = cls.executor()
+        futures = {key: [] for key in calls}
+        future_to_key = {}
+        # Key -> time.monotonic() its first attempt started running (set by pool threads)
+        started_at = {}
+        hedged = set()
+
+        def submit(key):
+            function, args = calls[key]
+            submitted = time.monotonic()
+
+            def timed():
+                call_started = time.monotonic()
+                started_at.setdefault(key, call_started)
+                Metrics.observe("stock_fetch_queue_wait_seconds", call_started - submitted, kind=kind)
+                try:
+                    return function(*args)
+                finally:
+                    duration = time.monotonic() - call_started
+                    LatencyTracker.record(kind, duration)
+                    Metrics.observe("stock_upstream_fetch_seconds", duration, kind=kind)
+
+            future = executor.submit(timed)
+            futures[key].append(future)
+            future_to_key[future] = key
+
+        def give_up(key):
+            pending.discard(key)
+            for future in futures[key]:
+                future.cancel()
+
+        for key in calls:
+            submit(key)
+
+        try:
+            while pending:
+                now = time.monotonic()
+                if deadline_at is not None and now >= deadline_at:
+                    for key in list(pending):
+                        give_up(key)
+                        yield key, None, TimeoutError(f"Deadline exceeded fetching {key}")
+                    return
+
+                wait_until = deadline_at
+                queued = False
+                for key in list(pending):
+                    key_started = started_at.get(key)
+                    if key_started is None:
+                        queued = True
+                        continue
+                    if timeout:
+                        if now >= key_started + timeout:
+                            give_up(key)
+                            yield key, None, TimeoutError(f"Timed out fetching {key}")
+                            continue
+                        expires_at = key_started + timeout
+                        wait_until = expires_at if wait_until is None else min(wait_until, expires_at)
+                    if hedge_after is not None and hedges_left and key not in hedged:
+                        if now >= key_started + hedge_after:
+                            hedged.add(key)
+                            hedges_left -= 1
+                            submit(key)
+                        else:
+                            hedge_at = key_started + hedge_after
+                            wait_until = hedge_at if wait_until is None else min(wait_until, hedge_at)
+                if not pending:
+                    return
+                if queued and (timeout or hedges_left):
+                    # A queued call's timeout and hedge clock start once a thread picks it up
+                    poll_until = now + cls.QUEUE_POLL_INTERVAL
+                    wait_until = poll_until if wait_until is None else min(wait_until, poll_until)
+
+                running = [future for key in pending for future in futures[key]]
+                done, _ = wait(
+                    running,
+                    timeout=None if wait_until is None else max(0, wait_until - time.monotonic()),
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    key = future_to_key[future]
+                    if key not in pending or future.cancelled():
+                        continue
+                    give_up(key)
+                    try:
+                        yield key, future.result(), None
+                    except Exception as e:
+                        yield key, None, e
+        finally:
+            # The caller stopped early (or everything is done): drop work nobody will read
+            for key in list(pending):
+                give_up(key)
+
+
+atexit.register(FetchPool.shutdown)
+
+
+class LatencyTracker:
+    """
+    Rolling window of recent upstream call durations per kind of call
+    """
+    
+    _lock = threading.Lock()
+    _samples = {}
+
+    @classmethod
+    def record(cls, kind, seconds):
+        with cls._lock:
+            samples = cls._samples.get(kind)
+            if samples is None:
+                samples = cls._samples[kind] = deque(maxlen=getattr(settings, 'STOCK_HEDGE_WINDOW', 200))
+            samples.append(seconds)
+
+    @classmethod
+    def percentile(cls, kind, percent):
+        """
+        Return the given percentile of recent durations in seconds
+        
+        Returns None until STOCK_HEDGE_MIN_SAMPLES durations have been recorded.
+        """
+        with cls._lock:
+            samples = sorted(cls._samples.get(kind, ()))
+        if not samples or len(samples) < getattr(settings, 'STOCK_HEDGE_MIN_SAMPLES', 20):
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+class StockQuote(Mapping):
+    """
+    Compact, read-only stock data row used between fetching and broadcasting
+
+    Rows live in the quote cache, the poll chunks and the broadcast snapshot for
+    every ticker; a slot per field takes a fraction of the memory (and pickle
+    size) of a per-row dict. It reads like the dict it replaces (row["ticker"],
+    row.get(...), "error" in row, keys()/items()); fields a row does not have
+    are absent rather than None. Convert with dict(row) where rows leave the
+    process as JSON, msgpack or Celery results.
+    """
+
+    FIELDS = WireFormat.FIELDS
+    __slots__ = tuple(f"_{field}" for field in FIELDS)
+    _SLOTS = dict(zip(FIELDS, __slots__))
+
+    def __init__(self, **fields):
+        for field, value in fields.items():
+            # KeyError for a field outside FIELDS
+            object.__setattr__(self, self._SLOTS[field], value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("StockQuote is read-only")
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, self._SLOTS[field])
+        except (KeyError, AttributeError):
+            raise KeyError(field) from None
+
+    def __iter__(self):
+        for field, slot in self._SLOTS.items():
+            if hasattr(self, slot):
+                yield field
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"StockQuote({self.to_dict()!r})"
+
+    def __reduce__(self):
+        # Positional values instead of field names keep cached snapshots small
+        present = [hasattr(self, slot) for slot in self.__slots__]
+        values = tuple(getattr(self, slot) for slot, has in zip(self.__slots__, present) if has)
+        return (StockQuote.from_values, (sum(1 << index for index, has in enumerate(present) if has), values))
+
+    @staticmethod
+    def from_values(present, values):
+        """Rebuild a pickled row from its field bitmask and the values of those fields"""
+        fields = (field for index, field in enumerate(StockQuote.FIELDS) if present >> index & 1)
+        return StockQuote(**dict(zip(fields, values)))
+
+    def to_dict(self):
+        """Plain dictionary of the fields the row has, in FIELDS order"""
+        return {field: getattr(self, slot) for field, slot in self._SLOTS.items() if hasattr(self, slot)}
+
+    def replace(self, **fields):
+        """Copy of the row with fields added or overwritten"""
+        return StockQuote(**{**self.to_dict(), **fields})
+
 
 class StockDataService:
     """
@@ -63,71 +436,1055 @@ class StockDataService:
     def fetch_stock_data(ticker):
         """Fetch stock data for a single ticker"""
         try:
-            stock = yf.Ticker(ticker)
-            info = stock.info
-            hist = stock.history(period="1d")
-            
-            # Get current price from history or info
-            current_price = None
-            if not hist.empty:
-                current_price = float(hist['Close'].iloc[-1])
-            elif 'currentPrice' in info:
-                current_price = info.get('currentPrice')
-            elif 'regularMarketPrice' in info:
-                current_price = info.get('regularMarketPrice')
-            
-            stock_data = {
-                "symbol": ticker.replace('.NS', ''),
-                "ticker": ticker,
-                "name": info.get('longName') or info.get('shortName', 'N/A'),
-                "current_price": round(current_price, 2) if current_price else None,
-                "previous_close": round(info.get('previousClose', 0), 2) if info.get('previousClose') else None,
-                "open": round(info.get('open', 0), 2) if info.get('open') else None,
-                "day_high": round(info.get('dayHigh', 0), 2) if info.get('dayHigh') else None,
-                "day_low": round(info.get('dayLow', 0), 2) if info.get('dayLow') else None,
-                "volume": info.get('volume', 0),
-                "average_volume": info.get('averageVolume', 0),
-                "market_cap": info.get('marketCap', 0),
-                "52_week_high": round(info.get('fiftyTwoWeekHigh', 0), 2) if info.get('fiftyTwoWeekHigh') else None,
-                "52_week_low": round(info.get('fiftyTwoWeekLow', 0), 2) if info.get('fiftyTwoWeekLow') else None,
-                "pe_ratio": round(info.get('trailingPE', 0), 2) if info.get('trailingPE') else None,
-                "dividend_yield": round(info.get('dividendYield', 0) * 100, 2) if info.get('dividendYield') else None,
-                "beta": round(info.get('beta', 0), 2) if info.get('beta') else None,
-                "change": round(current_price - info.get('previousClose', 0), 2) if current_price and info.get('previousClose') else None,
-                "change_percent": round(((current_price - info.get('previousClose', 0)) / info.get('previousClose', 1)) * 100, 2) if current_price and info.get('previousClose') else None,
-            }
-            return stock_data
+            prices = MarketDataProvider.current().fetch_prices(ticker)
+            fundamentals = FundamentalsService.get_fundamentals([ticker])[ticker]
+            if not prices and not fundamentals:
+                raise ValueError(f"No data found for symbol {ticker.replace('.NS', '')}")
+            
+            info = {**fundamentals, **prices}
+            return StockDataService.build_stock_data(ticker, info, prices.get('currentPrice'))
         except Exception as e:
-            return {
-                "symbol": ticker.replace('.NS', ''),
-                "ticker": ticker,
-                "error": str(e)
-            }
-    
+            return StockDataService.build_error_data(ticker, e)
+
+    @staticmethod
+    def build_stock_data(ticker, info, current_price):
+        """
+        Build the response dictionary for a single ticker
+        
+        Args:
+            ticker: Stock ticker symbol (e.g., 'RELIANCE.NS')
+            info: Yahoo Finance style info dictionary (e.g., 'previousClose', 'dayHigh')
+            current_price: Latest traded price, or None if unavailable
+            
+        Returns:
+            StockQuote: Stock data row
+        """
+        return StockQuote(**{
+            "symbol": ticker.replace('.NS', ''),
+            "ticker": ticker,
+            "name": info.get('longName') or info.get('shortName', 'N/A'),
+            "current_price": round(current_price, 2) if current_price else None,
+            "previous_close": round(info.get('previousClose', 0), 2) if info.get('previousClose') else None,
+            "open": round(info.get('open', 0), 2) if info.get('open') else None,
+            "day_high": round(info.get('dayHigh', 0), 2) if info.get('dayHigh') else None,
+            "day_low": round(info.get('dayLow', 0), 2) if info.get('dayLow') else None,
+            "volume": info.get('volume', 0),
+            "average_volume": info.get('averageVolume', 0),
+            "market_cap": info.get('marketCap', 0),
+            "52_week_high": round(info.get('fiftyTwoWeekHigh', 0), 2) if info.get('fiftyTwoWeekHigh') else None,
+            "52_week_low": round(info.get('fiftyTwoWeekLow', 0), 2) if info.get('fiftyTwoWeekLow') else None,
+            "pe_ratio": round(info.get('trailingPE', 0), 2) if info.get('trailingPE') else None,
+            "dividend_yield": round(info.get('dividendYield', 0) * 100, 2) if info.get('dividendYield') else None,
+            "beta": round(info.get('beta', 0), 2) if info.get('beta') else None,
+            "change": round(current_price - info.get('previousClose', 0), 2) if current_price and info.get('previousClose') else None,
+            "change_percent": round(((current_price - info.get('previousClose', 0)) / info.get('previousClose', 1)) * 100, 2) if current_price and info.get('previousClose') else None,
+        })
+
+    @staticmethod
+    def build_error_data(ticker, error):
+        """Build the partial-error dictionary for a ticker that could not be fetched"""
+        if Metrics.enabled():
+            from .polling import PollService
+
+            Metrics.inc("stock_fetch_errors_total", ticker=PollService.metric_label(ticker))
+        return StockQuote(
+            symbol=ticker.replace('.NS', ''),
+            ticker=ticker,
+            error=str(error),
+        )
+
+    @staticmethod
+    def prices_from_bars(bars):
+        """
+        Extract the live price fields from recent daily bars
+        
+        Args:
+            bars: DataFrame of daily bars with Open/High/Low/Close/Volume columns
+            
+        Returns:
+            dict: Info style price fields ('currentPrice', 'previousClose', 'open',
+                  'dayHigh', 'dayLow', 'volume'), empty if there are no bars
+        """
+        bars = bars.dropna(subset=['Close'])
+        if bars.empty:
+            return {}
+
+        last_bar = bars.iloc[-1]
+        fields = {
+            "currentPrice": float(last_bar['Close']),
+            "previousClose": float(bars['Close'].iloc[-2]) if len(bars) > 1 else None,
+            "open": float(last_bar['Open']),
+            "dayHigh": float(last_bar['High']),
+            "dayLow": float(last_bar['Low']),
+            "volume": int(last_bar['Volume']) if last_bar['Volume'] == last_bar['Volume'] else None,
+        }
+        # Drop missing (None/NaN) values so they don't override fundamentals on merge
+        return {key: value for key, value in fields.items() if value is not None and value == value}
+
+    @staticmethod
+    def prices_from_quote(quote):
+        """
+        Extract the live price fields from a Yahoo Finance quote API result
+        
+        Args:
+            quote: One entry of quoteResponse.result (regularMarket* keys)
+            
+        Returns:
+            dict: Info style price fields, empty if the quote has no price
+        """
+        if quote.get('regularMarketPrice') is None:
+            return {}
+        fields = {
+            "currentPrice": quote.get('regularMarketPrice'),
+            "previousClose": quote.get('regularMarketPreviousClose'),
+            "open": quote.get('regularMarketOpen'),
+            "dayHigh": quote.get('regularMarketDayHigh'),
+            "dayLow": quote.get('regularMarketDayLow'),
+            "volume": quote.get('regularMarketVolume'),
+        }
+        # Drop missing values so they don't override fundamentals on merge
+        return {key: value for key, value in fields.items() if value is not None}
+
+    @staticmethod
+    def download_prices(tickers):
+        """
+        Fetch live prices for a chunk of tickers in one bulk provider request
+        
+        Args:
+            tickers: List of stock ticker symbols
+            
+        Returns:
+            dict: Ticker -> info style price fields ('currentPrice', 'previousClose',
+                  'open', 'dayHigh', 'dayLow', 'volume'). Tickers missing from the
+                  download are left out.
+        """
+        return MarketDataProvider.current().download_prices(tickers)
+
+    @staticmethod
+    def iter_stocks_data_batched(tickers, deadline_at=None):
+        """
+        Fetch stock data for a list of tickers using bulk price downloads
+        
+        Prices are downloaded in chunks of STOCK_BATCH_CHUNK_SIZE tickers per request.
+        Tickers the bulk download misses (or whose chunk fails or times out) fall back
+        to fetch_stock_data. Fundamentals cache misses are fetched within the deadline
+        too; tickers whose fundamentals miss it are returned with prices only.
+        
+        Args:
+            tickers: List of unique stock ticker symbols (e.g., ['RELIANCE.NS', 'TCS.NS'])
+            deadline_at: Absolute time.monotonic() deadline, or None
+            
+        Yields:
+            dict: Stock data dictionary, as soon as its chunk or fallback fetch completes
+        """
+        chunk_size = getattr(settings, 'STOCK_BATCH_CHUNK_SIZE', 50)
+        chunks = [tickers[i:i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+
+        calls = {index: (StockDataService.download_prices, (chunk,)) for index, chunk in enumerate(chunks)}
+        fallback = []
+        for index, prices, error in FetchPool.iter_results(
+            calls, "chunk",
+            timeout=getattr(settings, 'STOCK_FETCH_CHUNK_TIMEOUT', 20),
+            deadline_at=deadline_at,
+        ):
+            # A failed chunk falls back to the per-ticker path as a whole
+            prices = prices or {}
+            fallback.extend(ticker for ticker in chunks[index] if ticker not in prices)
+            fundamentals = FundamentalsService.get_fundamentals_until(list(prices), deadline_at)
+            for ticker, fields in prices.items():
+                info = {**fundamentals[ticker], **fields}
+                yield StockDataService.build_stock_data(ticker, info, fields['currentPrice'])
+
+        yield from StockDataService.iter_stocks_data_each(fallback, deadline_at=deadline_at)
+
+    @staticmethod
+    def iter_stocks_data_each(tickers, deadline_at=None):
+        """
+        Fetch stock data with one fetch_stock_data call per ticker
+        
+        Each call may take STOCK_FETCH_TICKER_TIMEOUT seconds; tickers that time out
+        or miss the deadline come back as error entries.
+        
+        Args:
+            tickers: List of unique stock ticker symbols (e.g., ['RELIANCE.NS', 'TCS.NS'])
+            deadline_at: Absolute time.monotonic() deadline, or None
+            
+        Yields:
+            dict: Stock data dictionary, in completion order
+        """
+        calls = {ticker: (StockDataService.fetch_stock_data, (ticker,)) for ticker in tickers}
+        for ticker, stock_data, error in FetchPool.iter_results(
+            calls, "ticker",
+            timeout=getattr(settings, 'STOCK_FETCH_TICKER_TIMEOUT', 10),
+            deadline_at=deadline_at,
+        ):
+            yield stock_data if error is None else StockDataService.build_error_data(ticker, error)
+
+    @staticmethod
+    def iter_stocks_data_uncached(tickers, deadline_at=None):
+        """
+        Fetch stock data for a list of tickers directly from the market-data provider
+        
+        Args:
+            tickers: List of unique stock ticker symbols (e.g., ['RELIANCE.NS', 'TCS.NS'])
+            deadline_at: Absolute time.monotonic() deadline, or None
+            
+        Yields:
+            dict: Stock data dictionary, in completion order
+        """
+        if getattr(settings, 'STOCK_FETCH_BATCHED', True) and len(tickers) > 1:
+            yield from StockDataService.iter_stocks_data_batched(tickers, deadline_at=deadline_at)
+        else:
+            yield from StockDataService.iter_stocks_data_each(tickers, deadline_at=deadline_at)
+
+    @staticmethod
+    def fetch_stocks_data_uncached(tickers):
+        """
+        Fetch stock data for a list of tickers directly from the market-data provider
+        
+        Args:
+            tickers: List of unique stock ticker symbols (e.g., ['RELIANCE.NS', 'TCS.NS'])
+            
+        Returns:
+            list: List of stock data dictionaries (unsorted)
+        """
+        return list(StockDataService.iter_stocks_data_uncached(tickers))
+
+    @staticmethod
+    def iter_stocks_data_coalesced(tickers, deadline_at=None):
+        """
+        Fetch and cache stock data, sharing in-flight upstream fetches between callers
+        
+        Tickers another thread is already fetching are awaited instead of fetched again
+        (see SingleFlight). With SINGLE_FLIGHT_REDIS_LEASE set, the same applies across
+        processes: tickers leased by another process are read from QuoteCache once
+        that process has stored them.
+        
+        Args:
+            tickers: List of unique stock ticker symbols
+            deadline_at: Absolute time.monotonic() deadline, or None
+            
+        Yields:
+            dict: Stock data dictionary, in completion order
+        """
+        owned, waiting = SingleFlight.claim(tickers)
+        results = {}
+        leased = []
+        try:
+            to_fetch = list(owned)
+            if to_fetch and getattr(settings, 'SINGLE_FLIGHT_REDIS_LEASE', False):
+                leased, held_elsewhere = SingleFlight.acquire_leases(to_fetch)
+                for ticker, stock_data in SingleFlight.wait_for_leases(held_elsewhere, deadline_at=deadline_at).items():
+                    results[ticker] = stock_data
+                    yield stock_data
+                to_fetch = [ticker for ticker in to_fetch if ticker not in results]
+
+            fetched = []
+            for stock_data in StockDataService.iter_stocks_data_uncached(to_fetch, deadline_at=deadline_at):
+                fetched.append(stock_data)
+                results[stock_data['ticker']] = stock_data
+                yield stock_data
+            QuoteCache.set_many(fetched)
+        finally:
+            SingleFlight.release_leases(leased)
+            SingleFlight.resolve(owned, results)
+
+        future_to_ticker = {future: ticker for ticker, future in waiting.items()}
+        timeout = None if deadline_at is None else max(0, deadline_at - time.monotonic())
+        try:
+            for future in as_completed(future_to_ticker, timeout=timeout):
+                ticker = future_to_ticker.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    yield StockDataService.build_error_data(ticker, e)
+        except FuturesTimeoutError:
+            for ticker in future_to_ticker.values():
+                yield StockDataService.build_error_data(ticker, f"Deadline exceeded fetching {ticker}")
+
     @staticmethod
-    def fetch_stocks_data(stocks_list):
+    def fetch_stocks_data_coalesced(tickers):
+        """
+        Fetch and cache stock data, sharing in-flight upstream fetches between callers
+        
+        Args:
+            tickers: List of unique stock ticker symbols
+            
+        Returns:
+            dict: Ticker -> stock data dictionary
+        """
+        return {stock_data['ticker']: stock_data for stock_data in StockDataService.iter_stocks_data_coalesced(tickers)}
+
+    @staticmethod
+    def iter_stocks_data(stocks_list, allow_stale=True, deadline=None, refresh=False):
+        """
+        Fetch stock data for a list of stock tickers, yielding results as they arrive
+        
+        Quotes are read through QuoteCache when QUOTE_CACHE_ENABLED is set: fresh
+        entries are served as-is, stale entries are served (flagged "stale": true)
+        while being refreshed in the background, and only missing tickers are
+        fetched upstream. Cached entries are yielded first, then fetched ones in
+        completion order.
+        
+        Args:
+            stocks_list: List of stock ticker symbols (e.g., ['RELIANCE.NS', 'TCS.NS'])
+            allow_stale: Serve stale cache entries (refreshing them in the background)
+                         instead of fetching them before returning
+            deadline: Total latency budget in seconds, or None. Tickers not fetched
+                      in time come back as error entries.
+            refresh: Fetch every ticker upstream (sharing in-flight fetches) and
+                     store the results in QuoteCache, without reading it. Poll
+                     ticks use this: a cached quote younger than QUOTE_CACHE_TTL
+                     would be re-broadcast unchanged.
+            
+        Yields:
+            dict: Stock data dictionary, once per occurrence of its ticker in stocks_list
+        """
+        deadline_at = time.monotonic() + deadline if deadline is not None else None
+        occurrences = Counter(stocks_list)
+        tickers = list(occurrences)
+        if not getattr(settings, 'QUOTE_CACHE_ENABLED', True):
+            source = StockDataService.iter_stocks_data_uncached(tickers, deadline_at=deadline_at)
+        elif refresh:
+            source = StockDataService.iter_stocks_data_coalesced(tickers, deadline_at=deadline_at)
+        else:
+            quotes, stale = QuoteCache.get_many(tickers)
+            if not allow_stale:
+                stale = {}
+            if stale:
+                QuoteCache.revalidate(list(stale))
+            missing = [ticker for ticker in tickers if ticker not in quotes and ticker not in stale]
+            source = chain(
+                quotes.values(),
+                stale.values(),
+                StockDataService.iter_stocks_data_coalesced(missing, deadline_at=deadline_at) if missing else (),
+            )
+
+        for stock_data in source:
+            for _ in range(occurrences[stock_data['ticker']]):
+                yield stock_data
+
+    @staticmethod
+    def fetch_stocks_data(stocks_list, allow_stale=True, deadline=None, refresh=False):
         """
         Fetch stock data for a list of stock tickers
         
         Args:
             stocks_list: List of stock ticker symbols (e.g., ['RELIANCE.NS', 'TCS.NS'])
+            allow_stale: Serve stale cache entries (refreshing them in the background)
+                         instead of fetching them before returning
+            deadline: Total latency budget in seconds, or None
+            refresh: Bypass QuoteCache reads (see iter_stocks_data)
             
         Returns:
             list: List of stock data dictionaries, sorted by symbol
         """
-        # Fetch data for all requested stocks in parallel for better performance
-        stocks_data = []
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            future_to_ticker = {executor.submit(StockDataService.fetch_stock_data, ticker): ticker for ticker in stocks_list}
-            for future in as_completed(future_to_ticker):
-                stock_data = future.result()
-                stocks_data.append(stock_data)
+        with RequestTiming.phase("fetch"):
+            stocks_data = list(StockDataService.iter_stocks_data(
+                stocks_list, allow_stale=allow_stale, deadline=deadline, refresh=refresh,
+            ))
         
         # Sort by symbol for consistent ordering
-        stocks_data.sort(key=lambda x: x.get('symbol', ''))
+        with RequestTiming.phase("sort"):
+            stocks_data.sort(key=lambda x: x.get('symbol', ''))
+        
+        return stocks_data
+
+
+class AsyncStockDataService:
+    """
+    Asyncio fetch engine for stock data
+    
+    Prices come from the provider's afetch_prices (for Yahoo Finance, the chart
+    API over a curl_cffi AsyncSession), so every ticker is a coroutine on the
+    event loop instead of a thread in FetchPool. Concurrency is bounded by ASYNC_FETCH_CONCURRENCY and every
+    ticker has its own ASYNC_FETCH_TIMEOUT, counted once it holds a concurrency slot. Results share
+    QuoteCache, SingleFlight and FundamentalsService with StockDataService.
+    """
+    
+    _sessions = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def session(cls):
+        """Return the AsyncSession for the running event loop, creating it on first use"""
+        loop = asyncio.get_running_loop()
+        session = cls._sessions.get(loop)
+        if session is None:
+            session = cls._sessions[loop] = AsyncSession(
+                impersonate="chrome",
+                max_clients=getattr(settings, 'ASYNC_FETCH_CONCURRENCY', 20),
+            )
+        return session
+
+    @staticmethod
+    def prices_from_chart(chart):
+        """
+        Extract the live price fields from a chart API response
+        
+        Args:
+            chart: Decoded JSON body of the chart API (range=5d, interval=1d)
+            
+        Returns:
+            dict: Info style price fields, same keys as StockDataService.prices_from_bars
+        """
+        result = (chart.get('chart', {}).get('result') or [None])[0]
+        if not result or not result.get('indicators', {}).get('quote'):
+            return {}
+
+        quote = result['indicators']['quote'][0]
+        bars = [
+            (open_, high, low, close, volume)
+            for open_, high, low, close, volume in zip(
+                quote.get('open', []), quote.get('high', []), quote.get('low', []),
+                quote.get('close', []), quote.get('volume', []),
+            )
+            if close is not None
+        ]
+        if not bars:
+            return {}
+
+        open_, high, low, close, volume = bars[-1]
+        fields = {
+            "currentPrice": float(close),
+            "previousClose": float(bars[-2][3]) if len(bars) > 1 else None,
+            "open": float(open_) if open_ is not None else None,
+            "dayHigh": float(high) if high is not None else None,
+            "dayLow": float(low) if low is not None else None,
+            "volume": int(volume) if volume is not None else None,
+        }
+        return {key: value for key, value in fields.items() if value is not None}
+
+    @classmethod
+    async def fetch_prices(cls, ticker, semaphore, timeout, deadline_at=None):
+        """
+        Fetch live price fields for a single ticker
+        
+        Args:
+            ticker: Stock ticker symbol (e.g., 'RELIANCE.NS')
+            semaphore: asyncio.Semaphore bounding concurrent upstream requests
+            timeout: Seconds the request may take once it holds the semaphore
+            deadline_at: Absolute time.monotonic() deadline bounding the wait for the
+                         semaphore plus the request, or None
+            
+        Returns:
+            dict: Info style price fields, empty if the provider has no data for the ticker
+            
+        Raises:
+            asyncio.TimeoutError: The request timed out or the deadline passed
+        """
+        provider = MarketDataProvider.current()
+        waiting = time.perf_counter()
+
+        async def fetch():
+            async with semaphore:
+                started = time.perf_counter()
+                Metrics.observe("stock_fetch_queue_wait_seconds", started - waiting, kind="async")
+                limit, reason = timeout, "Timed out"
+                if deadline_at is not None and deadline_at - time.monotonic() < limit:
+                    limit, reason = max(0, deadline_at - time.monotonic()), "Deadline exceeded"
+                try:
+                    return await asyncio.wait_for(provider.afetch_prices(ticker), timeout=limit)
+                except asyncio.TimeoutError:
+                    raise asyncio.TimeoutError(f"{reason} fetching {ticker}") from None
+                finally:
+                    Metrics.observe("stock_upstream_fetch_seconds", time.perf_counter() - started, kind="async")
+
+        if deadline_at is None:
+            return await fetch()
+        try:
+            # The deadline also covers the wait for the semaphore
+            return await asyncio.wait_for(fetch(), timeout=max(0, deadline_at - time.monotonic()))
+        except asyncio.TimeoutError as e:
+            raise asyncio.TimeoutError(str(e) or f"Deadline exceeded fetching {ticker}") from None
+
+    @classmethod
+    async def fetch_stocks_data_uncached(cls, tickers, deadline_at=None):
+        """
+        Fetch stock data for a list of unique tickers from the market-data provider
         
+        Args:
+            tickers: List of unique stock ticker symbols
+            deadline_at: Absolute time.monotonic() deadline, or None
+            
+        Returns:
+            list: List of stock data dictionaries (unsorted)
+        """
+        timeout = getattr(settings, 'ASYNC_FETCH_TIMEOUT', 5)
+        semaphore = asyncio.Semaphore(getattr(settings, 'ASYNC_FETCH_CONCURRENCY', 20))
+        results = await asyncio.gather(
+            *(cls.fetch_prices(ticker, semaphore, timeout, deadline_at) for ticker in tickers),
+            return_exceptions=True,
+        )
+        prices = {ticker: result for ticker, result in zip(tickers, results) if isinstance(result, dict) and result}
+        fundamentals, missing = await sync_to_async(FundamentalsService.get_cached)(list(prices))
+        if missing:
+            refresh = sync_to_async(FundamentalsService.refresh_fundamentals_until, thread_sensitive=False)
+            try:
+                fundamentals.update(await asyncio.wait_for(
+                    refresh(missing, deadline_at),
+                    timeout=None if deadline_at is None else max(0, deadline_at - time.monotonic()),
+                ))
+            except asyncio.TimeoutError:
+                # Out of time: serve the prices without fundamentals rather than block
+                fundamentals.update({ticker: {} for ticker in missing})
+
+        stocks_data = []
+        for ticker, result in zip(tickers, results):
+            if ticker in prices:
+                info = {**fundamentals[ticker], **prices[ticker]}
+                stocks_data.append(StockDataService.build_stock_data(ticker, info, prices[ticker]['currentPrice']))
+            elif isinstance(result, asyncio.TimeoutError):
+                stocks_data.append(StockDataService.build_error_data(ticker, str(result) or f"Timed out fetching {ticker}"))
+            elif isinstance(result, Exception):
+                stocks_data.append(StockDataService.build_error_data(ticker, result))
+            else:
+                stocks_data.append(
+                    StockDataService.build_error_data(ticker, f"No data found for symbol {ticker.replace('.NS', '')}")
+                )
         return stocks_data
 
+    @classmethod
+    async def fetch_stocks_data_coalesced(cls, tickers, deadline_at=None):
+        """
+        Async counterpart of StockDataService.fetch_stocks_data_coalesced
+        
+        Args:
+            tickers: List of unique stock ticker symbols
+            deadline_at: Absolute time.monotonic() deadline, or None
+            
+        Returns:
+            dict: Ticker -> stock data dictionary
+        """
+        owned, waiting = SingleFlight.claim(tickers)
+        results = {}
+        try:
+            if owned:
+                fetched = await cls.fetch_stocks_data_uncached(list(owned), deadline_at=deadline_at)
+                await sync_to_async(QuoteCache.set_many)(fetched)
+                results.update({stock_data['ticker']: stock_data for stock_data in fetched})
+        finally:
+            SingleFlight.resolve(owned, results)
+
+        for ticker, future in waiting.items():
+            timeout = None if deadline_at is None else max(0, deadline_at - time.monotonic())
+            try:
+                # shield() so giving up on the deadline doesn't cancel the owner's Future
+                results[ticker] = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+            except asyncio.TimeoutError:
+                results[ticker] = StockDataService.build_error_data(ticker, f"Deadline exceeded fetching {ticker}")
+            except Exception as e:
+                results[ticker] = StockDataService.build_error_data(ticker, e)
+        return results
+
+    @classmethod
+    async def fetch_stocks_data(cls, stocks_list, deadline=None):
+        """
+        Fetch stock data for a list of stock tickers
+        
+        Same semantics as StockDataService.fetch_stocks_data (including QuoteCache
+        read-through), without a thread per ticker.
+        
+        Args:
+            stocks_list: List of stock ticker symbols (e.g., ['RELIANCE.NS', 'TCS.NS'])
+            deadline: Total latency budget in seconds, or None
+            
+        Returns:
+            list: List of stock data dictionaries, sorted by symbol
+        """
+        started = time.perf_counter()
+        deadline_at = time.monotonic() + deadline if deadline is not None else None
+        tickers = list(dict.fromkeys(stocks_list))
+        if getattr(settings, 'QUOTE_CACHE_ENABLED', True):
+            quotes, stale = await sync_to_async(QuoteCache.get_many)(tickers)
+        else:
+            quotes, stale = {}, {}
+
+        missing = [ticker for ticker in tickers if ticker not in quotes and ticker not in stale]
+        if missing:
+            quotes.update(await cls.fetch_stocks_data_coalesced(missing, deadline_at=deadline_at))
+        if stale:
+            QuoteCache.revalidate(list(stale))
+            quotes.update(stale)
+        stocks_data = [quotes[ticker] for ticker in stocks_list]
+        RequestTiming.record("fetch", time.perf_counter() - started)
+
+        # Sort by symbol for consistent ordering
+        with RequestTiming.phase("sort"):
+            stocks_data.sort(key=lambda x: x.get('symbol', ''))
+
+        return stocks_data
+
+
+class QuoteCache:
+    """
+    Two-tier, ticker-keyed cache for stock data dictionaries
+    
+    The in-process tier is an LRU bounded by QUOTE_CACHE_MAX_ENTRIES; the shared tier
+    is the Django cache (Redis), so quotes fetched by the Celery worker are visible
+    to the web process and vice versa. Entries younger than QUOTE_CACHE_TTL seconds
+    are fresh; entries up to QUOTE_CACHE_STALE_TTL seconds older than that are
+    stale and are served while a background refresh runs.
+    """
+    
+    _local = OrderedDict()
+    _lock = threading.Lock()
+    _revalidating = set()
+
+    @staticmethod
+    def cache_key(ticker):
+        return f"quote:{ticker}"
+
+    @classmethod
+    def _ttl(cls):
+        return getattr(settings, 'QUOTE_CACHE_TTL', 5)
+
+    @classmethod
+    def _stale_ttl(cls):
+        return getattr(settings, 'QUOTE_CACHE_STALE_TTL', 30)
+
+    @classmethod
+    def _set_local(cls, ticker, entry):
+        max_entries = getattr(settings, 'QUOTE_CACHE_MAX_ENTRIES', 5000)
+        with cls._lock:
+            cls._local[ticker] = entry
+            cls._local.move_to_end(ticker)
+            while len(cls._local) > max_entries:
+                cls._local.popitem(last=False)
+
+    @classmethod
+    def get_many(cls, tickers):
+        """
+        Look up cached quotes for a list of tickers
+        
+        Args:
+            tickers: List of stock ticker symbols
+            
+        Returns:
+            tuple: (fresh, stale) dictionaries of ticker -> stock data; stale data is
+                   flagged "stale": true. Tickers that are missing or past the
+                   stale window are in neither.
+        """
+        now = time.time()
+        entries = {}
+        with cls._lock:
+            for ticker in tickers:
+                entry = cls._local.get(ticker)
+                if entry is not None:
+                    cls._local.move_to_end(ticker)
+                    entries[ticker] = entry
+
+        # Anything not fresh locally may have been refreshed by another process
+        remote = [ticker for ticker in dict.fromkeys(tickers) if ticker not in entries or now - entries[ticker]["fetched_at"] >= cls._ttl()]
+        if remote:
+            cached = cache.get_many([cls.cache_key(ticker) for ticker in remote])
+            for ticker in remote:
+                entry = cached.get(cls.cache_key(ticker))
+                if entry is not None and entry["fetched_at"] > entries.get(ticker, {}).get("fetched_at", 0):
+                    entries[ticker] = entry
+                    cls._set_local(ticker, entry)
+
+        fresh, stale = {}, {}
+        for ticker, entry in entries.items():
+            age = now - entry["fetched_at"]
+            if age < cls._ttl():
+                fresh[ticker] = entry["data"]
+            elif age < cls._ttl() + cls._stale_ttl():
+                stale[ticker] = StockQuote(**{**entry["data"], "stale": True})
+        Metrics.inc("stock_cache_requests_total", len(fresh), cache="quote", result="fresh")
+        Metrics.inc("stock_cache_requests_total", len(stale), cache="quote", result="stale")
+        Metrics.inc("stock_cache_requests_total", len(set(tickers)) - len(fresh) - len(stale), cache="quote", result="miss")
+        return fresh, stale
+
+    @classmethod
+    def set_many(cls, stocks_data):
+        """
+        Store freshly fetched stock data dictionaries in both tiers
+        
+        Error entries are not cached so that failed tickers are retried on the next call.
+        
+        Args:
+            stocks_data: List of stock data dictionaries
+        """
+        now = time.time()
+        entries = {}
+        for stock_data in stocks_data:
+            if "error" in stock_data:
+                continue
+            entry = {"data": stock_data, "fetched_at": now}
+            cls._set_local(stock_data["ticker"], entry)
+            entries[cls.cache_key(stock_data["ticker"])] = entry
+
+        if entries:
+            cache.set_many(entries, timeout=int(cls._ttl() + cls._stale_ttl()) + 1)
+
+    @classmethod
+    def revalidate(cls, tickers):
+        """
+        Refresh stale tickers in a background thread
+        
+        Tickers that already have a refresh in flight are skipped.
+        
+        Args:
+            tickers: List of stock ticker symbols
+        """
+        with cls._lock:
+            tickers = [ticker for ticker in tickers if ticker not in cls._revalidating]
+            cls._revalidating.update(tickers)
+        if not tickers:
+            return
+
+        def refresh():
+            try:
+                StockDataService.fetch_stocks_data_coalesced(tickers)
+            finally:
+                with cls._lock:
+                    cls._revalidating.difference_update(tickers)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    @classmethod
+    def clear(cls):
+        """Drop every entry from the in-process tier"""
+        with cls._lock:
+            cls._local.clear()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent upstream fetches of the same ticker
+    
+    The first caller to claim a ticker owns its fetch; later callers in the same
+    process get a Future that resolves with the owner's result. Optional Redis leases
+    extend this across processes (web workers and Celery workers).
+    """
+    
+    _lock = threading.Lock()
+    _in_flight = {}
+
+    @staticmethod
+    def lease_key(ticker):
+        return f"quote-lease:{ticker}"
+
+    @classmethod
+    def claim(cls, tickers):
+        """
+        Claim tickers for fetching
+        
+        Args:
+            tickers: List of unique stock ticker symbols
+            
+        Returns:
+            tuple: (owned, waiting) dictionaries of ticker -> Future. Owned futures
+                   must be passed to resolve() by the caller once fetched.
+        """
+        owned, waiting = {}, {}
+        with cls._lock:
+            for ticker in tickers:
+                if ticker in cls._in_flight:
+                    waiting[ticker] = cls._in_flight[ticker]
+                else:
+                    owned[ticker] = cls._in_flight[ticker] = Future()
+        return owned, waiting
+
+    @classmethod
+    def resolve(cls, owned, results):
+        """
+        Publish the results of owned fetches to waiting callers
+        
+        Args:
+            owned: Ticker -> Future dictionary returned by claim()
+            results: Ticker -> stock data dictionary; owned tickers missing here fail
+        """
+        with cls._lock:
+            for ticker in owned:
+                cls._in_flight.pop(ticker, None)
+        for ticker, future in owned.items():
+            if ticker in results:
+                future.set_result(results[ticker])
+            else:
+                future.set_exception(RuntimeError(f"Fetch for {ticker} did not complete"))
+
+    @classmethod
+    def acquire_leases(cls, tickers):
+        """
+        Take cross-process Redis leases for tickers about to be fetched
+        
+        Args:
+            tickers: List of unique stock ticker symbols
+            
+        Returns:
+            tuple: (leased, held_elsewhere) lists of tickers
+        """
+        timeout = getattr(settings, 'SINGLE_FLIGHT_LEASE_TIMEOUT', 10)
+        leased, held_elsewhere = [], []
+        for ticker in tickers:
+            if cache.add(cls.lease_key(ticker), os.getpid(), timeout=timeout):
+                leased.append(ticker)
+            else:
+                held_elsewhere.append(ticker)
+        return leased, held_elsewhere
+
+    @classmethod
+    def release_leases(cls, tickers):
+        if tickers:
+            cache.delete_many([cls.lease_key(ticker) for ticker in tickers])
+
+    @classmethod
+    def wait_for_leases(cls, tickers, deadline_at=None):
+        """
+        Wait for other processes to store the tickers they hold leases for
+        
+        Args:
+            tickers: List of tickers leased by other processes
+            deadline_at: Absolute time.monotonic() after which to stop waiting, or None
+            
+        Returns:
+            dict: Ticker -> stock data for tickers that became fresh in QuoteCache.
+                  Tickers whose lease was released or expired without a fresh quote
+                  are left out for the caller to fetch itself.
+        """
+        results = {}
+        pending = list(tickers)
+        deadline = time.monotonic() + getattr(settings, 'SINGLE_FLIGHT_LEASE_TIMEOUT', 10)
+        if deadline_at is not None:
+            deadline = min(deadline, deadline_at)
+        while pending and time.monotonic() < deadline:
+            fresh, _ = QuoteCache.get_many(pending)
+            results.update(fresh)
+            pending = [ticker for ticker in pending if ticker not in fresh]
+            if not pending:
+                break
+            held = cache.get_many([cls.lease_key(ticker) for ticker in pending])
+            pending = [ticker for ticker in pending if cls.lease_key(ticker) in held]
+            time.sleep(0.05)
+        return results
+
+
+class FundamentalsService:
+    """
+    Service class for slow-moving company fundamentals
+    
+    Name, market cap, 52-week range, PE, dividend yield and beta change at most
+    daily, so they are kept in the Django cache (shared through Redis) and refreshed
+    by fetch_fundamentals_task instead of being requested on every price fetch.
+    """
+    
+    # Keys kept from the Yahoo Finance info dictionary
+    FIELDS = (
+        'longName', 'shortName', 'averageVolume', 'marketCap', 'fiftyTwoWeekHigh',
+        'fiftyTwoWeekLow', 'trailingPE', 'dividendYield', 'beta',
+    )
+
+    @staticmethod
+    def cache_key(ticker):
+        return f"fundamentals:{ticker}"
+
+    @staticmethod
+    def fetch_fundamentals(ticker):
+        """
+        Fetch fundamentals for a single ticker from the market-data provider
+        
+        Args:
+            ticker: Stock ticker symbol (e.g., 'RELIANCE.NS')
+            
+        Returns:
+            dict: Info style fundamentals, empty if the request failed
+        """
+        try:
+            info = MarketDataProvider.current().fetch_fundamentals(ticker) or {}
+        except Exception:
+            return {}
+        return {key: info[key] for key in FundamentalsService.FIELDS if info.get(key) is not None}
+
+    @staticmethod
+    def refresh_fundamentals(tickers):
+        """
+        Fetch fundamentals for a list of tickers and store them in the cache
+        
+        Args:
+            tickers: List of stock ticker symbols
+            
+        Returns:
+            dict: Ticker -> fundamentals dictionary
+        """
+        if len(tickers) == 1:
+            fundamentals = {tickers[0]: FundamentalsService.fetch_fundamentals(tickers[0])}
+        else:
+            executor = FetchPool.executor()
+            fundamentals = dict(zip(tickers, executor.map(FundamentalsService.fetch_fundamentals, tickers)))
+
+        FundamentalsService.store(fundamentals)
+        return fundamentals
+
+    @staticmethod
+    def store(fundamentals):
+        """Cache fetched fundamentals (ticker -> dictionary, empty for failed lookups)"""
+        found = {FundamentalsService.cache_key(ticker): data for ticker, data in fundamentals.items() if data}
+        failed = {FundamentalsService.cache_key(ticker): data for ticker, data in fundamentals.items() if not data}
+        # Failed lookups are cached briefly so unknown symbols don't hit the provider on every tick
+        cache.set_many(found, timeout=getattr(settings, 'FUNDAMENTALS_CACHE_TIMEOUT', 36 * 60 * 60))
+        cache.set_many(failed, timeout=getattr(settings, 'FUNDAMENTALS_FAILURE_CACHE_TIMEOUT', 10 * 60))
+
+    @staticmethod
+    def get_fundamentals(tickers):
+        """
+        Read fundamentals from the cache, fetching any that are missing
+        
+        Args:
+            tickers: List of stock ticker symbols
+            
+        Returns:
+            dict: Ticker -> fundamentals dictionary
+        """
+        fundamentals, missing = FundamentalsService.get_cached(tickers)
+        if missing:
+            fundamentals.update(FundamentalsService.refresh_fundamentals(missing))
+        return fundamentals
+
+    @staticmethod
+    def get_cached(tickers):
+        """
+        Read fundamentals from the cache
+        
+        Args:
+            tickers: List of stock ticker symbols
+            
+        Returns:
+            tuple: (ticker -> fundamentals dictionary, list of tickers not in the cache)
+        """
+        keys = {ticker: FundamentalsService.cache_key(ticker) for ticker in tickers}
+        cached = cache.get_many(list(keys.values()))
+        
+        fundamentals = {ticker: cached[key] for ticker, key in keys.items() if key in cached}
+        missing = [ticker for ticker in keys if ticker not in fundamentals]
+        Metrics.inc("stock_cache_requests_total", len(fundamentals), cache="fundamentals", result="hit")
+        Metrics.inc("stock_cache_requests_total", len(missing), cache="fundamentals", result="miss")
+        return fundamentals, missing
+
+    @staticmethod
+    def get_fundamentals_until(tickers, deadline_at=None):
+        """
+        Read fundamentals from the cache, fetching missing ones until a deadline
+        
+        Args:
+            tickers: List of stock ticker symbols
+            deadline_at: Absolute time.monotonic() deadline, or None to wait for every fetch
+            
+        Returns:
+            dict: Ticker -> fundamentals dictionary, empty for tickers not fetched in time
+        """
+        fundamentals, missing = FundamentalsService.get_cached(tickers)
+        if missing:
+            fundamentals.update(FundamentalsService.refresh_fundamentals_until(missing, deadline_at))
+        return fundamentals
+
+    @staticmethod
+    def refresh_fundamentals_until(tickers, deadline_at=None):
+        """
+        Fetch fundamentals on FetchPool until a deadline, caching the ones that arrive
+        
+        Must not run on a FetchPool thread.
+        
+        Args:
+            tickers: List of stock ticker symbols
+            deadline_at: Absolute time.monotonic() deadline, or None to wait for every fetch
+            
+        Returns:
+            dict: Ticker -> fundamentals dictionary, empty for tickers not fetched in time
+        """
+        if deadline_at is None:
+            return FundamentalsService.refresh_fundamentals(tickers)
+        calls = {ticker: (FundamentalsService.fetch_fundamentals, (ticker,)) for ticker in tickers}
+        fundamentals, fetched = {}, {}
+        for ticker, data, error in FetchPool.iter_results(
+            calls, "fundamentals",
+            timeout=getattr(settings, 'STOCK_FETCH_TICKER_TIMEOUT', 10),
+            deadline_at=deadline_at,
+        ):
+            if error is None:
+                fetched[ticker] = data
+            # Out of time: serve the prices without fundamentals rather than block
+            fundamentals[ticker] = data or {}
+        FundamentalsService.store(fetched)
+        return fundamentals
+
+    @staticmethod
+    def known_tickers(tickers):
+        """
+        Filter tickers down to the ones the market-data provider has fundamentals for
+        
+        Args:
+            tickers: List of stock ticker symbols
+            
+        Returns:
+            list: The known tickers, in order
+        """
+        fundamentals = FundamentalsService.get_fundamentals(tickers)
+        return [ticker for ticker in tickers if fundamentals.get(ticker)]
+
+
+class RunHistory:
+    """
+    Fixed-size ring buffer of compact per-run task metadata in the Django cache
+
+    Each run claims the next slot of its task's ring (an atomic counter modulo
+    STOCK_RUN_HISTORY_SIZE) and overwrites it, so storage stays constant however
+    long the beat schedule runs, and nothing is written to the database.
+    """
+
+    @staticmethod
+    def _size():
+        return getattr(settings, 'STOCK_RUN_HISTORY_SIZE', 500)
+
+    @staticmethod
+    def counter_key(task_name):
+        return f"run-history:{task_name}:counter"
+
+    @staticmethod
+    def slot_key(task_name, slot):
+        return f"run-history:{task_name}:{slot}"
+
+    @classmethod
+    def record(cls, task_name, **metadata):
+        """
+        Store one run's metadata
+
+        Args:
+            task_name: Name of the task
+            **metadata: JSON-serializable run metadata (duration, counts, ...)
+
+        Returns:
+            dict: The stored entry, with its run number and finish time
+        """
+        if "duration_ms" in metadata:
+            Metrics.observe("stock_run_seconds", metadata["duration_ms"] / 1000, task=task_name)
+        key = cls.counter_key(task_name)
+        cache.add(key, 0, timeout=None)
+        run = cache.incr(key)
+        entry = {"run": run, "finished_at": TimeUtility().get_current_datetime_endwith_z(), **metadata}
+        cache.set(cls.slot_key(task_name, run % cls._size()), entry, timeout=None)
+        return entry
+
+    @classmethod
+    def recent(cls, task_name, limit=None):
+        """
+        Latest runs of a task, newest first
+
+        Args:
+            task_name: Name of the task
+            limit: Maximum number of runs (default: the whole ring)
+
+        Returns:
+            list: Run metadata dictionaries
+        """
+        size = cls._size()
+        last = cache.get(cls.counter_key(task_name)) or 0
+        runs = range(last, max(last - min(limit or size, size), 0), -1)
+        keys = [cls.slot_key(task_name, run % size) for run in runs]
+        entries = cache.get_many(keys)
+        # Skip slots not yet overwritten by the expected run (e.g. after a resize)
+        return [entries[key] for key, run in zip(keys, runs) if entries.get(key, {}).get("run") == run]
+
 
 class CommonService:
     """
@@ -156,5 +1513,45 @@ class CommonService:
                 "path": str(request.get_host()) + str(path),
             },
         }
+        if RequestTiming.requested(request):
+            # Phases so far; rendering happens after the envelope is built
+            output["meta"]["timings"] = RequestTiming.milliseconds()
         return output
 
+    @staticmethod
+    def request_deadline(validated_data):
+        """
+        Latency budget in seconds for a validated stock data request
+        
+        Uses the request's deadline_ms, falling back to STOCK_REQUEST_DEADLINE
+        (None means no deadline).
+        """
+        if validated_data.get("deadline_ms"):
+            return validated_data["deadline_ms"] / 1000
+        return getattr(settings, 'STOCK_REQUEST_DEADLINE', None)
+
+    @staticmethod
+    async def iterate_in_thread(iterator):
+        """
+        Consume a blocking iterator from async code without buffering it
+        
+        Each item is pulled in a worker thread; the iterator is closed if the
+        consumer stops early (e.g. the client disconnects).
+        
+        Args:
+            iterator: Synchronous iterator or generator
+            
+        Yields:
+            Items of iterator, one at a time
+        """
+        done = object()
+        try:
+            while True:
+                item = await sync_to_async(next, thread_sensitive=False)(iterator, done)
+                if item is done:
+                    break
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                await sync_to_async(close, thread_sensitive=False)()
@@ -1,43 +1,219 @@
+import json
+import zlib
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
 from django.urls import reverse_lazy
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.settings import api_settings
 from drf_spectacular.utils import extend_schema
-from .utilities import CommonService, StockDataService
+from .broadcast import StockBroadcastService
+from .metrics import Metrics
+from .middleware import RequestTiming
+from .polling import PollScheduler
+from .utilities import AsyncStockDataService, CommonService, StockDataService, TimeUtility
 from .serializers import StockDataRequestSerializer
+from .renderers import ColumnarJSONRenderer, EventStreamRenderer, NDJSONRenderer
 from mainapp.openAPI.output_schema import ExtendSchemaStructure
 from django.conf import settings
 from pathlib import Path
 
 
+def columnar_response(request, data):
+    """JSON response of a default_response envelope, with the stock rows in columnar form on ?format=columnar"""
+    if request.GET.get("format") == ColumnarJSONRenderer.format:
+        return JsonResponse(
+            ColumnarJSONRenderer.columnar(data), status=status.HTTP_200_OK,
+            content_type=ColumnarJSONRenderer.media_type,
+        )
+    return JsonResponse(data, status=status.HTTP_200_OK)
+
+
 # Create your views here.
 class StocksView(APIView):
     authentication_classes = ()
     serializer_class = StockDataRequestSerializer
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [
+        ColumnarJSONRenderer, NDJSONRenderer, EventStreamRenderer,
+    ]
+    streaming_renderers = (NDJSONRenderer, EventStreamRenderer)
     api_path = reverse_lazy("stocks")
 
     @extend_schema(**ExtendSchemaStructure.StockData.value)
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
-        if not serializer.is_valid():
+        with RequestTiming.phase("validate"):
+            valid = serializer.is_valid()
+        if not valid:
             return Response(
                 {"error": serializer.errors},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
         stocks_list = serializer.validated_data["stocks"]
-        stocks_data = StockDataService.fetch_stocks_data(stocks_list)
+        deadline = CommonService.request_deadline(serializer.validated_data)
+        if isinstance(request.accepted_renderer, self.streaming_renderers):
+            return self.stream_response(request, stocks_list, deadline)
+
+        stocks_data = StockDataService.fetch_stocks_data(stocks_list, deadline=deadline)
         
         response_data = {
             "count": len(stocks_data),
-            "stocks": stocks_data
+            "stocks": [dict(stock_data) for stock_data in stocks_data]
         }
 
-        data = CommonService().default_response(request, response_data, self.api_path)    
+        with RequestTiming.phase("envelope"):
+            data = CommonService().default_response(request, response_data, self.api_path)    
         return Response(data, status=status.HTTP_200_OK)
 
+    def stream_response(self, request, stocks_list, deadline=None):
+        """
+        Stream each stock as soon as it is available, then a trailer with the meta block
+
+        Used when the client accepts application/x-ndjson or text/event-stream. Stocks
+        arrive in completion order (cached first), not sorted by symbol. The trailer
+        is the usual default_response envelope with only the count in data.
+        """
+        renderer = request.accepted_renderer
+
+        def events():
+            count = 0
+            for stock_data in StockDataService.iter_stocks_data(stocks_list, deadline=deadline):
+                count += 1
+                yield renderer.render_event(dict(stock_data), event="stock")
+            trailer = CommonService().default_response(request, {"count": count}, self.api_path)
+            yield renderer.render_event(trailer, event="end")
+
+        content = events()
+        if hasattr(request, "scope"):
+            # Under ASGI Django buffers sync iterators completely; pull items from a thread instead
+            content = CommonService.iterate_in_thread(content)
+
+        response = StreamingHttpResponse(content, content_type=renderer.media_type, status=status.HTTP_200_OK)
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncStocksView(View):
+    """
+    Async variant of StocksView served natively under ASGI
+
+    Accepts the same request body and returns the same response shape (columnar
+    with ?format=columnar), but fetches with AsyncStockDataService so an in-flight
+    request holds no thread.
+    """
+    api_path = reverse_lazy("stocks-async")
+
+    async def post(self, request):
+        try:
+            payload = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse(
+                {"error": {"non_field_errors": ["Invalid JSON body."]}},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = StockDataRequestSerializer(data=payload)
+        with RequestTiming.phase("validate"):
+            valid = serializer.is_valid()
+        if not valid:
+            return JsonResponse(
+                {"error": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        stocks_list = serializer.validated_data["stocks"]
+        deadline = CommonService.request_deadline(serializer.validated_data)
+        stocks_data = await AsyncStockDataService.fetch_stocks_data(stocks_list, deadline=deadline)
+
+        response_data = {
+            "count": len(stocks_data),
+            "stocks": [dict(stock_data) for stock_data in stocks_data]
+        }
+
+        with RequestTiming.phase("envelope"):
+            data = CommonService().default_response(request, response_data, self.api_path)
+        with RequestTiming.phase("render"):
+            response = columnar_response(request, data)
+        return response
+
+
+class StockSnapshotView(View):
+    """
+    Read-only latest stock data, served from the broadcast snapshot
+
+    GET /stocks/snapshot/?tickers=TCS.NS,INFY.NS (all broadcast tickers without
+    tickers) never calls upstream: it returns the state the beat task last
+    broadcast. Responses carry a strong ETag derived from the snapshot epoch and
+    seq and the requested tickers (seq alone restarts when the snapshot is lost), answer a matching If-None-Match with 304, and may be cached
+    for the current poll interval (PollScheduler.interval, or STOCK_POLL_INTERVAL
+    when polling is not adaptive). ?format=columnar returns the rows in
+    columnar form.
+    """
+    api_path = reverse_lazy("stocks-snapshot")
+
+    async def get(self, request):
+        tickers = None
+        if request.GET.get("tickers"):
+            tickers = sorted({ticker.strip() for ticker in request.GET["tickers"].split(",") if ticker.strip()})
+
+        snapshot = await StockBroadcastService.aget_snapshot()
+        etag = None
+        if snapshot.get("updated_at"):
+            # Only snapshots stamped with their broadcast time have a stable body
+            selection = ",".join(tickers) if tickers is not None else "*"
+            if request.GET.get("format") == ColumnarJSONRenderer.format:
+                selection += ";columnar"
+            # Snapshots written before epochs existed fall back to their broadcast time
+            epoch = snapshot.get("epoch") or f'{zlib.crc32(snapshot["updated_at"].encode("utf-8")):08x}'
+            etag = f'"{epoch}-{snapshot["seq"]}-{zlib.crc32(selection.encode("utf-8")):08x}"'
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            message = StockBroadcastService.snapshot_message(snapshot, tickers)
+            response_data = {
+                "count": len(message["data"]),
+                "seq": snapshot["seq"],
+                "stocks": message["data"],
+                "missing": [ticker for ticker in tickers if ticker not in snapshot["stocks"]] if tickers else [],
+            }
+            data = CommonService().default_response(request, response_data, self.api_path)
+            # The body must only change with the ETag: stamp it with the snapshot time
+            data["meta"]["timestamp"] = snapshot.get("updated_at") or data["meta"]["timestamp"]
+            response = columnar_response(request, data)
+        if etag:
+            response["ETag"] = etag
+        if PollScheduler.enabled():
+            max_age = await sync_to_async(PollScheduler.interval)()
+            # A closed-market max-age must not outlast the pre-open or the open
+            until_change = TimeUtility.seconds_to_next_phase()
+            if until_change is not None:
+                max_age = min(max_age, until_change)
+        else:
+            max_age = getattr(settings, 'STOCK_POLL_INTERVAL', 10)
+        response["Cache-Control"] = f"public, max-age={int(max_age)}"
+        return response
+
+
+class MetricsView(View):
+    """
+    Prometheus scrape endpoint
+
+    GET /metrics returns the counters and histograms of every live web and Celery
+    process (see Metrics), summed, in the Prometheus text format.
+    """
+
+    def get(self, request):
+        return HttpResponse(Metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 
 def websocket_test_view(request):
     """Simple view to serve the WebSocket test page"""
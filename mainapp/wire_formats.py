@@ -0,0 +1,171 @@
+import json
+from functools import lru_cache
+
+import cbor2
+import msgpack
+
+
+class WireFormat:
+    """
+    Encodings of WebSocket messages, negotiated through the WebSocket subprotocol
+
+    json (the default, also used when the client offers no known subprotocol) sends
+    text frames. msgpack and cbor send binary frames holding the same messages.
+    Their ".indexed" variants additionally replace the keys of stock rows with
+    their index in FIELDS (announced once in a "schema" message after connecting);
+    keys missing from FIELDS stay strings.
+
+    Independently of the encoding, clients connecting with ?format=columnar get
+    the stock rows of every message in columnar form (see columnar_message).
+    """
+
+    JSON = "json"
+    MSGPACK = "msgpack"
+    CBOR = "cbor"
+
+    # Subprotocol -> (encoding, indexed rows)
+    SUBPROTOCOLS = {
+        "json": (JSON, False),
+        "msgpack": (MSGPACK, False),
+        "msgpack.indexed": (MSGPACK, True),
+        "cbor": (CBOR, False),
+        "cbor.indexed": (CBOR, True),
+    }
+
+    # Append only: clients may cache the schema of a previous connection
+    FIELDS = (
+        "symbol", "ticker", "name", "current_price", "previous_close", "open", "day_high", "day_low",
+        "volume", "average_volume", "market_cap", "52_week_high", "52_week_low", "pe_ratio",
+        "dividend_yield", "beta", "change", "change_percent", "error", "stale",
+    )
+    FIELD_INDEX = {field: index for index, field in enumerate(FIELDS)}
+
+    @classmethod
+    def negotiate(cls, subprotocols):
+        """
+        Pick the first subprotocol offered by the client that the server supports
+
+        Args:
+            subprotocols: Subprotocols from the client's Sec-WebSocket-Protocol header
+
+        Returns:
+            tuple: (subprotocol to accept or None, encoding, indexed rows)
+        """
+        for subprotocol in subprotocols or ():
+            if subprotocol in cls.SUBPROTOCOLS:
+                return (subprotocol, *cls.SUBPROTOCOLS[subprotocol])
+        return (None, cls.JSON, False)
+
+    @classmethod
+    def schema_message(cls):
+        """Client message announcing the field indexes of indexed rows"""
+        return {"type": "schema", "fields": list(cls.FIELDS)}
+
+    @classmethod
+    def index_rows(cls, message):
+        """Copy of message with the keys of its stock rows replaced by field indexes"""
+        if "data" not in message:
+            return message
+        index = cls.FIELD_INDEX
+        data = [{index.get(key, key): value for key, value in row.items()} for row in message["data"]]
+        return {**message, "data": data}
+
+    @classmethod
+    def columns(cls, rows):
+        """
+        Columnar form of stock rows: field names once, values as parallel arrays
+
+        Args:
+            rows: Stock data dictionaries
+
+        Returns:
+            dict: {"fields": [...], "columns": [[...], ...]} where columns[i][j] is
+                  field i of row j (null where row j lacks the field). Only fields
+                  present in some row are listed, in FIELDS order, then unknown
+                  keys sorted.
+        """
+        present = set().union(*rows)
+        fields = [field for field in cls.FIELDS if field in present]
+        fields += sorted(present.difference(cls.FIELD_INDEX))
+        return {"fields": fields, "columns": [[row.get(field) for row in rows] for field in fields]}
+
+    @classmethod
+    def columnar_message(cls, message):
+        """
+        Copy of message with its stock rows ("data") replaced by columns()
+
+        Rows of a stock_delta not listed in replace only hold changed fields, so
+        a null there means "unchanged"; fields that did change to null are listed
+        per ticker in "cleared".
+        """
+        if "data" not in message:
+            return message
+        columnar = {key: value for key, value in message.items() if key != "data"}
+        columnar.update(cls.columns(message["data"]))
+        if "replace" in message:
+            replace = set(message["replace"])
+            cleared = {
+                row["ticker"]: fields
+                for row in message["data"]
+                if row["ticker"] not in replace
+                and (fields := [key for key, value in row.items() if value is None])
+            }
+            if cleared:
+                columnar["cleared"] = cleared
+        return columnar
+
+    @classmethod
+    def encode(cls, message, encoding, indexed=False, columnar=False):
+        """
+        Encode a client message
+
+        Returns:
+            dict: Keyword arguments for WebsocketConsumer.send
+                  ({"text_data": str} or {"bytes_data": bytes})
+        """
+        if columnar:
+            message = cls.columnar_message(message)
+        if encoding == cls.JSON:
+            return {"text_data": json.dumps(message)}
+        if indexed:
+            message = cls.index_rows(message)
+        if encoding == cls.MSGPACK:
+            return {"bytes_data": msgpack.packb(message)}
+        return {"bytes_data": cbor2.dumps(message)}
+
+    @classmethod
+    def encode_frame(cls, frame, encoding, indexed=False, columnar=False):
+        """
+        Re-encode a pre-encoded JSON frame
+
+        Memoized, so every consumer of a process that receives the same broadcast
+        frame shares a single re-encoding per wire format.
+        """
+        if encoding == cls.JSON and not columnar:
+            return {"text_data": frame}
+        return cls._encode_frame(frame, encoding, indexed, columnar)
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _encode_frame(frame, encoding, indexed, columnar):
+        return WireFormat.encode(json.loads(frame), encoding, indexed, columnar)
+
+    @classmethod
+    def decode(cls, text_data, bytes_data, encoding):
+        """
+        Decode a client message: text frames are JSON, binary frames use the negotiated
+        encoding (JSON on json connections)
+
+        Raises:
+            ValueError: The frame could not be decoded
+        """
+        if text_data is not None:
+            return json.loads(text_data)
+        try:
+            if encoding == cls.JSON:
+                return json.loads(bytes_data)
+            if encoding == cls.CBOR:
+                return cbor2.loads(bytes_data)
+            return msgpack.unpackb(bytes_data)
+        except Exception as e:
+            raise ValueError(str(e)) from e
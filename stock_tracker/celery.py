@@ -14,11 +14,28 @@ app.conf.update(timezone = 'Asia/Kolkata')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+TRACKED_STOCKS = ['RELIANCE.NS', 'TCS.NS', 'HDFCBANK.NS']
+
+# With adaptive polling the beat fires at the fastest cadence and
+# mainapp.polling.PollScheduler skips ticks that are not due
+if getattr(settings, 'STOCK_POLL_ADAPTIVE', True):
+    POLL_BEAT_INTERVAL = float(getattr(settings, 'STOCK_POLL_MIN_INTERVAL', 2))
+else:
+    POLL_BEAT_INTERVAL = float(getattr(settings, 'STOCK_POLL_INTERVAL', 10))
+
 app.conf.beat_schedule = {
+    # Polls TRACKED_STOCKS plus every ticker a WebSocket client subscribed to
     'fetch-stock-data-every-ten-seconds': {
-        'task': 'mainapp.tasks.fetch_stocks_data_task',
-        'schedule': 10.0,
-        'args': (['RELIANCE.NS', 'TCS.NS', 'HDFCBANK.NS'],),
+        'task': 'mainapp.tasks.poll_stocks_task',
+        'schedule': POLL_BEAT_INTERVAL,
+        'args': (TRACKED_STOCKS,),
+    },
+    # Fundamentals change at most daily; refresh them (tracked plus subscribed tickers)
+    # before NSE pre-open (09:00 IST)
+    'fetch-fundamentals-daily': {
+        'task': 'mainapp.tasks.fetch_fundamentals_task',
+        'schedule': crontab(hour=8, minute=30),
+        'args': (TRACKED_STOCKS,),
     },
 }
 
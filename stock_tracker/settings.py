@@ -60,6 +60,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Last: profiled requests call the view from its process_view
+    'mainapp.middleware.ServerTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'stock_tracker.urls'
@@ -142,6 +144,88 @@ SPECTACULAR_SETTINGS = {
     'SERVE_INCLUDE_SCHEMA': False,
 }
 
+# Stock data settings
+STOCK_POLL_INTERVAL = 10 # Seconds between beat fetches of the tracked stocks (fixed cadence and max-age of GET /stocks/snapshot/ when not adaptive)
+STOCK_POLL_CHUNK_SIZE = 100 # Tickers per fetch_stocks_chunk_task; larger universes fan out across workers
+STOCK_POLL_MAX_TICKERS = 2000 # Cap on the polled universe (configured + WebSocket-subscribed tickers)
+STOCK_POLL_ADAPTIVE = True # Poll by exchange phase and observed change rate (PollScheduler) instead of every STOCK_POLL_INTERVAL
+STOCK_POLL_MIN_INTERVAL = 2 # Fastest in-session cadence (and the beat period when adaptive)
+STOCK_POLL_MAX_INTERVAL = 30 # Slowest in-session cadence
+STOCK_POLL_CLOSED_INTERVAL = 900 # Heartbeat poll while the exchange is closed
+STOCK_POLL_SPEEDUP_RATIO = 0.5 # Halve the interval when at least this share of tickers changed in a tick
+STOCK_POLL_SLOWDOWN_RATIO = 0.1 # Grow the interval by half when at most this share changed
+STOCK_FEED_INTERVAL = 1 # Seconds between ticks of manage.py run_feed
+
+# Exchange calendar (NSE)
+MARKET_TIMEZONE = "Asia/Kolkata"
+MARKET_PRE_OPEN = "09:00"
+MARKET_OPEN = "09:15"
+MARKET_CLOSE = "15:30"
+MARKET_POST_CLOSE = "16:00"
+MARKET_ANNUAL_HOLIDAYS = ["01-26", "05-01", "08-15", "10-02", "12-25"] # Fixed-date holidays (MM-DD)
+MARKET_HOLIDAYS = [] # Moving holidays (YYYY-MM-DD), from the NSE trading holiday circular for the year
+STOCK_DATA_PROVIDER = "yfinance" # Upstream market data: "yfinance", "simulated" (offline GBM feed) or the dotted path of a mainapp.providers.MarketDataProvider subclass
+STOCK_SIMULATOR_TICKERS = 500 # Synthetic tickers (SIM0001.NS ...) listed by SimulatedProvider.tickers()
+STOCK_SIMULATOR_SEED = 0 # Same seed, same price paths
+STOCK_SIMULATOR_STEP = 1 # Seconds of wall clock time per price path step
+STOCK_SIMULATOR_VOLATILITY = 0.3 # Annualized volatility (scaled 0.5-1.5x per ticker)
+STOCK_SIMULATOR_DRIFT = 0.05 # Annualized drift
+STOCK_SIMULATOR_LATENCY = 0.05 # Seconds every simulated upstream request takes
+STOCK_SIMULATOR_LATENCY_JITTER = 0.5 # +/- share of the latency, drawn uniformly per request
+STOCK_SIMULATOR_ERROR_RATE = 0.0 # Probability that a simulated upstream request fails
+STOCK_FETCH_BATCHED = True # Use bulk provider downloads (one quote API request per chunk) for multi-ticker fetches
+STOCK_BATCH_CHUNK_SIZE = 50 # Tickers per bulk download request
+STOCK_FETCH_MAX_WORKERS = 10 # Threads in the process-wide upstream fetch pool
+STOCK_FETCH_TICKER_TIMEOUT = 10 # Seconds a single-ticker upstream fetch may take before it is reported as an error
+STOCK_FETCH_CHUNK_TIMEOUT = 20 # Seconds a bulk download may take before its tickers fall back to single fetches
+STOCK_REQUEST_DEADLINE = None # Default total latency budget (seconds) for POST /stocks/; overridden by deadline_ms
+STOCK_HEDGE_ENABLED = True # Send a duplicate request for upstream calls slower than the recent percentile below
+STOCK_HEDGE_PERCENTILE = 95
+STOCK_HEDGE_MIN_DELAY = 0.25 # Never hedge calls younger than this (seconds)
+STOCK_HEDGE_MIN_SAMPLES = 20 # Observed calls needed before hedging starts
+STOCK_HEDGE_MAX_FRACTION = 0.1 # Hedge at most this share of the calls of one batch (at least one)
+ASYNC_FETCH_CONCURRENCY = 20 # Concurrent upstream requests per event loop for POST /stocks/async/
+ASYNC_FETCH_TIMEOUT = 5 # Seconds a single ticker fetch on the async path may take once it has a concurrency slot
+FUNDAMENTALS_CACHE_TIMEOUT = 36 * 60 * 60 # Seconds; outlives the daily refresh so entries never expire between runs
+FUNDAMENTALS_FAILURE_CACHE_TIMEOUT = 10 * 60 # Seconds to remember tickers whose fundamentals could not be fetched
+QUOTE_CACHE_ENABLED = True # Read quotes through mainapp.utilities.QuoteCache
+QUOTE_CACHE_TTL = 5 # Seconds a cached quote is served as fresh to REST requests (poll ticks always refetch)
+QUOTE_CACHE_STALE_TTL = 30 # Further seconds a quote is served stale while it is refreshed in the background
+QUOTE_CACHE_MAX_ENTRIES = 5000 # In-process LRU size per process
+SINGLE_FLIGHT_REDIS_LEASE = False # Also coalesce concurrent fetches of a ticker across processes via Redis leases
+SINGLE_FLIGHT_LEASE_TIMEOUT = 10 # Seconds a cross-process fetch lease is held at most
+
+# WebSocket settings
+STOCK_SUBSCRIPTION_SHARDS = 0 # 0: one channel layer group per ticker; N: hash tickers into N shard groups
+WS_MAX_SUBSCRIPTIONS = 200 # Tickers a single WebSocket connection may subscribe to
+WS_SUBSCRIPTION_TTL = 60 # Seconds a process's published subscriptions outlive its last heartbeat
+WS_PREENCODED_FRAMES = True # Serialize each broadcast frame once in the publisher; consumers forward it as-is
+WS_MAX_CLIENT_LAG = 30 # Seconds a WebSocket client that opted in to acks may stay behind (undelivered deltas) before it is disconnected
+WS_ACK_WINDOW = 4 # Snapshot/delta messages an acking WebSocket client (?ack=1) may have unacknowledged; 0 disables acks for everyone
+STOCK_FANOUT_MODE = "channel_layer" # "pubsub": publish each broadcast once to Redis pub/sub; every ASGI process fans out to its own clients
+STOCK_FANOUT_REDIS_URL = "redis://127.0.0.1:6379/0"
+STOCK_FANOUT_CHANNEL = "stock_fanout"
+STOCK_SNAPSHOT_MIRROR_TTL = 1 # Seconds an ASGI process reuses its copy of the broadcast snapshot for connecting clients
+
+# Metrics (GET /metrics, Prometheus text format)
+STOCK_METRICS_ENABLED = True # Record fetch, cache, broadcast and WebSocket send timings (mainapp.metrics.Metrics)
+STOCK_METRICS_FLUSH_INTERVAL = 5 # Seconds between copies of each process's totals to the cache
+STOCK_METRICS_TTL = 120 # Seconds a process's totals outlive its last flush
+
+# Request timing and profiling
+STOCK_SERVER_TIMING = True # Server-Timing header with per-phase durations on every response (?timing=1 adds them to meta)
+STOCK_PROFILE_SAMPLE_RATE = 0 # N: run one in N requests to STOCK_PROFILE_PATHS under cProfile; 0 disables
+STOCK_PROFILE_PATHS = ["/stocks/"] # Exact paths of the synchronous views to sample
+STOCK_PROFILE_DIR = BASE_DIR / "profiles" # Where .prof dumps are written
+
+# Cache (shared between web and Celery processes; holds fundamentals and quotes)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/1",
+    }
+}
+
 # Celery Settings
 CELERY_BROKER_URL = 'redis://localhost:6379'
 CELERY_ACCEPT_CONTENT = ['application/json']
@@ -149,6 +233,8 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Kolkata'
 CELERY_RESULT_BACKEND = 'django-db' # This is used to store the results of the tasks
+STOCK_TASK_RESULTS = "metadata" # "metadata": fetch_stocks_data_task stores no result, only RunHistory entries; "full": store the whole payload in the result backend
+STOCK_RUN_HISTORY_SIZE = 500 # Runs kept per task in the RunHistory ring buffer
 
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers.DatabaseScheduler'
 